@@ -0,0 +1,239 @@
+from __future__ import annotations
+import argparse
+import json
+import logging
+import sys
+import time
+from typing import Callable, NamedTuple
+
+import numpy as np
+
+import controller
+import database_connector
+import odds_engine
+import schemas
+import synthetic_odds
+from schemas import BetInfoParameters, BetInfoType, BetType, DevigMethod, Event
+
+ENGINES = ("vectorised", "legacy")
+STORES = ("memory", "db")
+
+class BenchmarkResult(NamedTuple):
+    outcomes : int
+    store : str
+    engine : str
+    info_type : str
+    bet_type : str
+    calls : int
+    # priced outcomes of the bet type analysed per second
+    throughput : float
+    p50_ms : float
+    p99_ms : float
+    found : int
+
+    def key(self) -> tuple:
+        return (self.outcomes, self.store, self.engine, self.info_type, self.bet_type)
+
+# (event_id, bet_type_id) -> [(description, point, names)]
+MarketCatalog = dict[tuple[str, int], list[tuple[str, float | None, list[str]]]]
+
+def groupCatalog(entries : list[tuple[str, int, str, float | None, str]]) -> MarketCatalog:
+    """Group (event_id, bet_type_id, description, point, name) entries into the markets the legacy engine loops over."""
+    markets : dict[tuple[str, int, str, float | None], list[str]] = {}
+    for event_id, bet_type_id, description, point, name in entries:
+        names = markets.setdefault((str(event_id), int(bet_type_id), description, point), [])
+        if name not in names:
+            names.append(name)
+    catalog : MarketCatalog = {}
+    for (event_id, bet_type_id, description, point), names in markets.items():
+        catalog.setdefault((event_id, bet_type_id), []).append((description, point, names))
+    return catalog
+
+def topOddsFromRows(rows : list[tuple], sharp_book : str) \
+        -> tuple[dict[schemas.OutcomeKey, tuple[schemas.Outcome, str]], dict[schemas.OutcomeKey, schemas.Outcome]]:
+    """Return the best quote of every outcome and the quotes of sharp_book, the preloaded inputs of the legacy engine."""
+    top_odds : dict[schemas.OutcomeKey, tuple[schemas.Outcome, str]] = {}
+    sharp_odds : dict[schemas.OutcomeKey, schemas.Outcome] = {}
+    for event_id, bet_type_id, description, point, name, price, book, last_update in rows:
+        key = schemas.OutcomeKey.of(event_id, bet_type_id, description, name, point)
+        best = top_odds.get(key)
+        if best is None or price > best[0].price:
+            top_odds[key] = (schemas.Outcome(name=name, price=price, point=point), book)
+        if book == sharp_book:
+            sharp_odds[key] = schemas.Outcome(name=name, price=price, point=point)
+    return top_odds, sharp_odds
+
+def runVectorised(info_type : BetInfoType, events : list[Event], bet_type : BetType, devig_method : DevigMethod,
+                  snapshot : odds_engine.OddsSnapshot) -> list:
+    """Run findArbsForEvents or findPositiveEVsForEvents on the preloaded odds snapshot of events."""
+    if info_type == BetInfoType.arbs:
+        return controller.findArbsForEvents(events, [bet_type], snapshot=snapshot)
+    return controller.findPositiveEVsForEvents(events, synthetic_odds.SHARP_BOOK, [bet_type], devig_method,
+                                               snapshot=snapshot)
+
+def runLegacy(info_type : BetInfoType, events : list[Event], bet_type : BetType, devig_method : DevigMethod,
+              catalog : MarketCatalog, top_odds : dict, sharp_odds : dict) -> list:
+    """Run the per market findArbsForEvent and findPositiveEVForEvent over every market of events."""
+    found : list = []
+    for event in events:
+        for description, point, names in catalog.get((str(event.event_id), int(bet_type)), []):
+            params = BetInfoParameters(event=event, names=names, bet_type=bet_type, point=point,
+                                       description=description, sharp_book=synthetic_odds.SHARP_BOOK,
+                                       devig_method=devig_method)
+            if info_type == BetInfoType.arbs:
+                controller.findArbsForEvent(params, found, top_odds)
+            else:
+                found.extend(controller.findPositiveEVForEvent(params, top_odds, sharp_odds))
+    return found
+
+def measure(run : Callable[[int], list], calls : int, repeat : int, min_samples : int) -> tuple[list[float], int, int]:
+    """Time run on every call index 0..calls repeat times, and more passes until there are min_samples latencies.
+
+    Returns the latencies in seconds, what one pass found and the number of passes.
+    """
+    latencies : list[float] = []
+    found = 0
+    passes = 0
+    while calls > 0 and (passes < repeat or len(latencies) < min_samples):
+        for index in range(calls):
+            begin = time.perf_counter()
+            results = run(index)
+            latencies.append(time.perf_counter() - begin)
+            if passes == 0:
+                found += len(results)
+        passes += 1
+    return latencies, found, passes
+
+def benchmarkSize(outcome_count : int, store : str, engines : list[str], info_types : list[BetInfoType],
+                  bet_types : list[BetType], seed : int, repeat : int, chunk : int,
+                  devig_method : DevigMethod, min_samples : int = 0) -> list[BenchmarkResult]:
+    """Benchmark the engines on outcome_count synthetic outcomes, analysing chunk events per call.
+
+    The inputs of both engines are prepared before the timing, the odds snapshots of the chunks for the vectorised
+    one and the best and sharp quotes for the legacy one, so only the analysis is timed.
+    """
+    odds = synthetic_odds.generateOdds(outcome_count, seed)
+    rows_per_bet_type = {bet_type: sum(1 for row in odds.rows if row[1] == bet_type) for bet_type in bet_types}
+    category_id = None
+    odds_book = None
+    try:
+        if store == "db":
+            category_id, events = synthetic_odds.loadDatabase(odds)
+            rows = database_connector.getOddsSnapshot([event.event_id for event in events])
+        else:
+            events = odds.events
+            odds_book = synthetic_odds.loadOddsBook(odds)
+            rows = odds.rows
+        catalog = groupCatalog([row[:5] for row in rows])
+        top_odds, sharp_odds = topOddsFromRows(rows, synthetic_odds.SHARP_BOOK)
+        if store == "db":
+            # the legacy engine reads the best quotes the triggers of top_universal_outcomes keep ranked
+            top_odds = database_connector.getUniversalTopOddsForEvents([event.event_id for event in events])
+        parts = [events[start:start + chunk] for start in range(0, len(events), chunk)]
+        snapshots : dict[BetType, list[odds_engine.OddsSnapshot]] = {}
+        if "vectorised" in engines:
+            snapshots = {bet_type: [controller.loadOddsSnapshot([str(event.event_id) for event in part], [bet_type], odds_book)
+                                    for part in parts]
+                         for bet_type in bet_types}
+        results = []
+        for engine in engines:
+            for info_type in info_types:
+                for bet_type in bet_types:
+                    if engine == "vectorised":
+                        run = lambda index: runVectorised(info_type, parts[index], bet_type, devig_method,
+                                                          snapshots[bet_type][index])
+                    else:
+                        run = lambda index: runLegacy(info_type, parts[index], bet_type, devig_method, catalog, top_odds,
+                                                      sharp_odds)
+                    latencies, found, passes = measure(run, len(parts), repeat, min_samples)
+                    total = sum(latencies)
+                    results.append(BenchmarkResult(
+                        outcomes=len(odds.rows),
+                        store=store,
+                        engine=engine,
+                        info_type=info_type.name,
+                        bet_type=bet_type.name,
+                        calls=len(latencies),
+                        throughput=rows_per_bet_type[bet_type] * passes / total if total > 0 else float("inf"),
+                        p50_ms=float(np.percentile(latencies, 50)) * 1000,
+                        p99_ms=float(np.percentile(latencies, 99)) * 1000,
+                        found=found,
+                    ))
+                    logging.info(results[-1])
+        return results
+    finally:
+        if category_id is not None:
+            database_connector.deleteCategory(category_id)
+
+def printResults(results : list[BenchmarkResult]):
+    print(f"{'outcomes':>9} {'store':<6} {'engine':<10} {'info':<4} {'bet type':<13} {'calls':>6} "
+          f"{'outcomes/s':>12} {'p50 ms':>9} {'p99 ms':>9} {'found':>6}")
+    for result in results:
+        print(f"{result.outcomes:>9} {result.store:<6} {result.engine:<10} {result.info_type:<4} {result.bet_type:<13} "
+              f"{result.calls:>6} {result.throughput:>12.0f} {result.p50_ms:>9.2f} {result.p99_ms:>9.2f} {result.found:>6}")
+
+def compareResults(results : list[BenchmarkResult], baseline : list[BenchmarkResult], tolerance : float) -> list[str]:
+    """Return a description of every result more than tolerance slower than the same benchmark in baseline."""
+    previous = {result.key(): result for result in baseline}
+    regressions = []
+    for result in results:
+        before = previous.get(result.key())
+        if before is None:
+            continue
+        if result.p50_ms > before.p50_ms * (1 + tolerance) or result.throughput < before.throughput / (1 + tolerance):
+            regressions.append(f"{'/'.join(map(str, result.key()))}: p50 {before.p50_ms:.2f} -> {result.p50_ms:.2f} ms, "
+                               f"{before.throughput:.0f} -> {result.throughput:.0f} outcomes/s")
+    return regressions
+
+def main():
+    logging.basicConfig(level=logging.WARNING)
+    parser = argparse.ArgumentParser(description="Benchmark the arb and EV analysis on synthetic odds")
+    parser.add_argument("-n", "--outcomes", type=int, nargs="+", default=[1000, 10000, 100000],
+                        help="sizes to generate, in priced outcomes")
+    parser.add_argument("-s", "--seed", type=int, default=0)
+    parser.add_argument("-r", "--repeat", type=int, default=3, help="passes over the events of every size")
+    parser.add_argument("-m", "--min-samples", type=int, default=100,
+                        help="latency samples at the least, more passes are made when a size has too few chunks")
+    parser.add_argument("-c", "--chunk", type=int, default=controller.FIND_INFO_CHUNK,
+                        help="events analysed per call, a latency sample is one call without loading its odds")
+    parser.add_argument("--store", choices=STORES, default="memory",
+                        help="analyse from an odds book, or from a local database migrate.py was run on, "
+                             "the data is loaded into and removed from")
+    parser.add_argument("--engines", choices=ENGINES, nargs="+", default=list(ENGINES))
+    parser.add_argument("--info", choices=[info_type.name for info_type in BetInfoType], nargs="+",
+                        default=[info_type.name for info_type in BetInfoType])
+    parser.add_argument("-t", "--betTypes", choices=[bet_type.name for bet_type in odds_engine.ANALYSED_BET_TYPES],
+                        nargs="+", default=[bet_type.name for bet_type in odds_engine.ANALYSED_BET_TYPES])
+    parser.add_argument("-d", "--devig", choices=[method.name for method in DevigMethod],
+                        default=DevigMethod.multiplicative.name)
+    parser.add_argument("--save", help="write the results as JSON to this file")
+    parser.add_argument("--baseline", help="JSON results of an earlier run, exits with 1 on regressions")
+    parser.add_argument("--tolerance", type=float, default=0.2, help="slowdown from the baseline allowed, 0.2 being 20%%")
+    args = parser.parse_args()
+
+    if args.store == "db":
+        database_connector.connectDb()
+    results = []
+    try:
+        for outcome_count in args.outcomes:
+            results.extend(benchmarkSize(outcome_count, args.store, args.engines,
+                                         [BetInfoType[name] for name in args.info], [BetType[name] for name in args.betTypes],
+                                         args.seed, args.repeat, args.chunk, DevigMethod[args.devig], args.min_samples))
+    finally:
+        if args.store == "db":
+            database_connector.disconnectDb()
+    printResults(results)
+    if args.save is not None:
+        with open(args.save, "w") as file:
+            json.dump([result._asdict() for result in results], file, indent=2)
+    if args.baseline is not None:
+        with open(args.baseline) as file:
+            baseline = [BenchmarkResult(**result) for result in json.load(file)]
+        regressions = compareResults(results, baseline, args.tolerance)
+        for regression in regressions:
+            print(f"Regression: {regression}")
+        if len(regressions) > 0:
+            sys.exit(1)
+
+if __name__ == '__main__':
+    main()
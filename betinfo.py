@@ -1,10 +1,12 @@
+import concurrent.futures
 import logging
 import sys
 import controller
-import asyncio
-import nodriver as uc
 import argparse
+import odds_daemon
+import profiling
 import schemas
+import sinks
 
 
 import database_connector
@@ -12,8 +14,6 @@ import database_connector
 SHARP_BOOK = "pinnacle"
 
 def main():
-   print(sys.argv)
-
    logging.basicConfig(level=logging.INFO)
    database_connector.connectDb()
    parser = argparse.ArgumentParser()
@@ -24,14 +24,69 @@ def main():
    parser.add_argument("-t", "--betType")
    parser.add_argument("-a", "--all")
    parser.add_argument("-A", "--arbitrage", action='store_true')
+   parser.add_argument("-d", "--devig", choices=[method.name for method in schemas.DevigMethod],
+                       default=schemas.DevigMethod.multiplicative.name, help="how the vig is removed from the sharp odds")
+   parser.add_argument("--max-age", type=float, help="seconds after which a quote is too old to bet on")
+   parser.add_argument("-w", "--workers", type=int, default=1,
+                       help="threads analysing categories, bet types and event shards in parallel, the output is the same as with one")
+   parser.add_argument("-i", "--incremental", action='store_true',
+                       help="only re-evaluate events with markets updated since the previous run and report the differences")
+   parser.add_argument("--all-users", action='store_true',
+                       help="analyse once for every user, with the bookmakers and categories of each user")
+   parser.add_argument("-D", "--daemon", action='store_true',
+                       help="keep running and report opportunities as soon as the markets they are in change")
+   parser.add_argument("--interval", type=float, default=5.,
+                       help="seconds between polls of the markets in daemon mode, the longest wait with --listen")
+   parser.add_argument("--listen", action='store_true', help="wake the daemon up on database notifications of market writes")
+   parser.add_argument("-o", "--output", choices=sinks.OUTPUTS, default="text",
+                       help="where the opportunities are written, db inserts them into the opportunities table")
+   parser.add_argument("--socket", default="127.0.0.1:8765", help="host:port served by --output socket")
+   parser.add_argument("--profile", nargs="?", const="betinfo.prof",
+                       help="profile the analysis with cProfile and write the stats to this file, betinfo.prof by default")
 
    args = parser.parse_args()
+   if not args.daemon:
+      logging.info(sys.argv)
    info_type = schemas.BetInfoType.arbs if args.arbitrage else schemas.BetInfoType.evs
-   provideData(info_type, args.eventId, args.userId, args.category, args.betType)
+   sink = sinks.makeSink(args.output, args.socket)
+   try:
+      with profiling.profiled(args.profile):
+         if args.daemon:
+            runDaemon(info_type, args.eventId, args.userId, args.category, args.betType, schemas.DevigMethod[args.devig],
+                      args.interval, args.listen, sink, args.max_age)
+         else:
+            provideData(info_type, args.eventId, args.userId, args.category, args.betType,
+                        schemas.DevigMethod[args.devig], args.workers, args.incremental, args.max_age, args.all_users, sink)
+   finally:
+      sink.close()
+      profiling.printReport()
+
+def provideData(info_type : schemas.BetInfoType, event_id : str | None, user : str | None, category : str | None, bet_type : str | None = None,
+                devig_method : schemas.DevigMethod = schemas.DevigMethod.multiplicative, workers : int = 1,
+                incremental : bool = False, max_odds_age : float | None = None, all_users : bool = False,
+                sink : sinks.OpportunitySink | None = None):
+   if sink is None:
+      sink = sinks.TextSink()
+   logging.info(bet_type)
+   all_params = buildInfoParameters(event_id, user, category, bet_type, devig_method, max_odds_age)
+   if all_params is None:
+      return
+   # logged rather than printed so the jsonl and csv outputs stay parseable
+   logging.info(sorted({params.category_id for params in all_params}, key=str))
+   if all_users:
+      findInfoForUsers(info_type, all_params, sink)
+   elif incremental:
+      findInfoIncremental(info_type, all_params, workers, sink)
+   elif workers <= 1:
+      for params in all_params:
+         sink.write(info_type, controller.findInfo(info_type, params))
+   else:
+      findInfoParallel(info_type, all_params, workers, sink)
 
-def provideData(info_type : schemas.BetInfoType, event_id : str | None, user : str | None, category : str | None, bet_type : str | None = None):
-   print(bet_type)
-   database_connector.prepareUniversalOutcomeTopOdds()
+def buildInfoParameters(event_id : str | None, user : str | None, category : str | None, bet_type : str | None,
+                        devig_method : schemas.DevigMethod, max_odds_age : float | None = None) \
+      -> list[schemas.BetInfoParameters] | None:
+   """Return the parameters of every (category, bet type) to analyse, None if event_id doesn't exist."""
    bet_type_id = database_connector.searchBetTypeId(bet_type) if bet_type is not None else None
    category_id = None
    if category is not None:
@@ -42,19 +97,82 @@ def provideData(info_type : schemas.BetInfoType, event_id : str | None, user : s
    event = database_connector.getEventById(event_id)
    if event_id is not None and event is None:
       logging.error("Invalid event id provided")
+      return None
+   bet_type_ids = list(schemas.BetType) if bet_type is None else [bet_type_id]
+   return [schemas.BetInfoParameters(event=event, category_id=category_id, bet_type=bet_type_id, user_id=user_id,\
+                                     sharp_book=SHARP_BOOK, devig_method=devig_method, max_odds_age=max_odds_age)
+           for category_id in categories for bet_type_id in bet_type_ids]
+
+def runDaemon(info_type : schemas.BetInfoType, event_id : str | None, user : str | None, category : str | None,
+              bet_type : str | None, devig_method : schemas.DevigMethod, interval : float, listen : bool,
+              sink : sinks.OpportunitySink, max_odds_age : float | None = None):
+   """Run the analysis as an odds_daemon.OddsDaemon until interrupted.
+
+   listen relies on the market update trigger migrate.py creates.
+   """
+   all_params = buildInfoParameters(event_id, user, category, bet_type, devig_method, max_odds_age)
+   if all_params is None:
       return
-   print(categories)
-   for category_id in categories:
-      if bet_type is None:
-         for bet_type_id in schemas.BetType:
-            controller.findInfo(info_type, schemas.BetInfoParameters(event=event, category_id=category_id,\
-                                                                     bet_type=bet_type_id, user_id=user_id, sharp_book=SHARP_BOOK))
-      else:
-         controller.findInfo(info_type, schemas.BetInfoParameters(event=event, category_id=category_id,\
-                                                                  bet_type=bet_type_id, user_id=user_id, sharp_book=SHARP_BOOK))
+   try:
+      odds_daemon.OddsDaemon(info_type, all_params, sink, interval, listen).run()
+   except KeyboardInterrupt:
+      logging.info("Stopping the odds daemon")
+   finally:
+      database_connector.disconnectDb()
+
+def findInfoForUsers(info_type : schemas.BetInfoType, all_params : list[schemas.BetInfoParameters],
+                     sink : sinks.OpportunitySink):
+   """Analyse all_params once for all users and write the results of every user."""
+   eligibilities = list(database_connector.loadUserEligibilities().values())
+   for params in all_params:
+      for eligibility, results in zip(eligibilities, controller.analyseInfoForUsers(info_type, params, eligibilities)):
+         sink.write(info_type, results, user_id=eligibility.user_id)
 
+def findInfoParallel(info_type : schemas.BetInfoType, all_params : list[schemas.BetInfoParameters], workers : int,
+                     sink : sinks.OpportunitySink):
+   """Analyse all_params on a thread pool and write the same results in the same order as the sequential findInfo.
 
+   The events are split into the chunks of findInfo and every chunk into contiguous shards, so a single category
+   still keeps every worker busy, and the shards of a chunk are merged back into the chunk findInfo would yield.
+   The threads share the database connection pool.
+   """
+   chunks_by_category = {}
+   for params in all_params:
+      if params.category_id not in chunks_by_category:
+         chunks_by_category[params.category_id] = controller.chunkEvents(controller.getInfoEvents(params))
+   tasks = []
+   for params in all_params:
+      for chunk in chunks_by_category[params.category_id]:
+         shard_count = max(1, min(workers, len(chunk)))
+         for shard in range(shard_count):
+            tasks.append((params, chunk[shard * len(chunk) // shard_count:(shard + 1) * len(chunk) // shard_count]))
+   with concurrent.futures.ThreadPoolExecutor(max_workers=workers) as executor:
+      # map returns the results in the order of tasks however the workers finish
+      results = list(executor.map(lambda task: controller.analyseInfo(info_type, task[0], task[1]), tasks))
+   position = 0
+   for params in all_params:
+      merged = []
+      for chunk in chunks_by_category[params.category_id]:
+         shard_count = max(1, min(workers, len(chunk)))
+         merged.extend(controller.mergeInfo(info_type, results[position:position + shard_count]))
+         position += shard_count
+      sink.write(info_type, merged)
 
+def findInfoIncremental(info_type : schemas.BetInfoType, all_params : list[schemas.BetInfoParameters], workers : int,
+                        sink : sinks.OpportunitySink):
+   """Update the stored analysis of every parameter set with the markets changed since the previous run
+   and write what appeared, changed and disappeared."""
+   states = controller.loadAnalysisStates(info_type)
+   names = [controller.analysisStateName(info_type, params) for params in all_params]
+   for name in names:
+      states.setdefault(name, controller.AnalysisState())
+   with concurrent.futures.ThreadPoolExecutor(max_workers=max(1, workers)) as executor:
+      diffs = list(executor.map(lambda task: controller.analyseInfoIncremental(info_type, task[1], states[task[0]]),
+                                zip(names, all_params)))
+   for params, diff in zip(all_params, diffs):
+      for change, results in controller.diffChanges(info_type, diff):
+         sink.write(info_type, results, change)
+   controller.saveAnalysisStates(states)
 
 if __name__ == '__main__':
    # since asyncio.run never worked (for me)
@@ -1,8 +1,14 @@
+import database_connector
 import schemas
 
+# prices are stored as REAL, differences below this are float noise rather than a new price
+PRICE_TOLERANCE = 1e-4
+
 
 class BettingWrapper():
     requires_browser = False
+    # wrappers that can refresh the prices of all their stored outcomes with updateOdds
+    can_update_all = False
     def __init__(self):
         self.bookmaker = "undefined_bookmaker"
         self.requires_browser = False
@@ -10,8 +16,27 @@ class BettingWrapper():
         raise NotImplementedError("Subclasses should implement this!")
     async def rescanEvent(self, link : str):
         raise NotImplementedError("Subclasses should implement this!")
+    async def updateOdds(self):
+        raise NotImplementedError("Subclasses should implement this!")
     
     async def scrapeGame(self, link: str, event : schemas.Event,\
                         oghome : str, ogaway : str,  is_event_url : bool, index : int | None = None, disable_scroll : bool = True):
         raise NotImplementedError("Subclasses should implement this!")
 
+    def savePrices(self, outcomes : list[tuple[int, str, int, float | None]], prices : dict[str, float]) -> int:
+        """Write the prices, keyed by outcome_bookmaker_id, of the getBookmakerOutcomeIds outcomes they changed for.
+
+        Only the markets with a changed price are marked as updated, so the incremental analysis and the daemon
+        don't analyse again the markets a refresh found unchanged. Returns the number of changed prices.
+        """
+        update : dict[int, float] = {}
+        market_ids : set[int] = set()
+        for outcome_id, outcome_bookmaker_id, market_id, price in outcomes:
+            new_price = prices.get(outcome_bookmaker_id)
+            if new_price is None:
+                continue
+            if price is None or abs(new_price - price) > PRICE_TOLERANCE:
+                update[outcome_id] = new_price
+                market_ids.add(market_id)
+        database_connector.updateOddsByOutcomeId(update, list(market_ids))
+        return len(update)
@@ -10,8 +10,8 @@ from prettytable import PrettyTable
 from telegram import Update
 from telegram.ext import ApplicationBuilder, CommandHandler, ContextTypes
 
-import controller
 import database_connector
+import wrapper_registry
 
 scanning : bool = False
 
@@ -42,12 +42,12 @@ async def scan(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     if arg is None:
         await update.message.reply_text("Bookmaker missing from command")
         return
-    if arg not in controller.wrapperDict:
+    if arg not in wrapper_registry.wrappers:
         await update.message.reply_text("Bookmaker not supported")
         return
     if scanning is True:
         await update.message.reply_text("Already scanning, try again later")
-    wrapper = controller.wrapperDict[arg]()
+    wrapper = wrapper_registry.wrappers[arg]()
     try:
         scanning = True
         await notifyAdmins("Scanning " + arg + " initiated by " + thisUser, context, thisUser)
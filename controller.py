@@ -1,121 +1,295 @@
 from __future__ import annotations
 
 import datetime
+import json
 import logging
+import os
 import re
-from typing import Any, Optional
+from typing import TYPE_CHECKING, Any, Iterator, NamedTuple, Optional
 
 import pytz
-from lxml import etree, html
-from nodriver import Element
 
 import database_connector
+import odds_engine
+import profiling
 import schemas
-from schemas import BetInfoParameters, BetInfoType, BetType, Event, Outcome, PositiveEVBet
-from wrappers.coolbet import CoolbetWrapper
-from wrappers.coolbetV2 import CoolbetWrapperV2
-from wrappers.pinnacle import PinnacleWrapper
-from wrappers.polymarket import PolymarketWrapper
-from wrappers.veikkaus import VeikkausWrapper
-
-wrapperDict = {
-        "veikkaus" : VeikkausWrapper,
-        "coolbet" : CoolbetWrapper,
-        "coolbetv2" : CoolbetWrapperV2,
-        "polymarket" : PolymarketWrapper,
-        "pinnacle" : PinnacleWrapper,
-    }
-
-def findInfo(info_type : BetInfoType, info_params : BetInfoParameters):
+from schemas import Arb, BetInfoParameters, BetInfoType, BetType, DevigMethod, Event, Outcome, PositiveEVBet
+
+# the html helpers at the end are only used by the wrappers, lxml and nodriver are imported where they're needed
+# so the analysis doesn't load them
+if TYPE_CHECKING:
+    from lxml import html
+    from nodriver import Element
+
+# events analysed at a time by findInfo, the opportunities of a chunk are yielded before the next one is loaded
+FIND_INFO_CHUNK = 200
+
+def findInfo(info_type : BetInfoType, info_params : BetInfoParameters) -> Iterator[schemas.Opportunity]:
+    """Yield the arbs or positive EV bets of info_params as they are found, FIND_INFO_CHUNK events at a time.
+
+    Every chunk is in the order of analyseInfo, the order across chunks is the order of the events.
+    """
+    for chunk in chunkEvents(getInfoEvents(info_params)):
+        yield from analyseInfo(info_type, info_params, chunk)
+
+def chunkEvents(events : list[Event]) -> list[list[Event]]:
+    """Split events, ordered by id, into the chunks findInfo analyses one at a time."""
+    events = sorted(events, key=lambda event: str(event.event_id))
+    return [events[start:start + FIND_INFO_CHUNK] for start in range(0, len(events), FIND_INFO_CHUNK)]
+
+def getInfoEvents(info_params : BetInfoParameters) -> list[Event]:
     ip = info_params
+    if ip.event is not None:
+        return [ip.event]
     dt = datetime.datetime.now(pytz.utc) - datetime.timedelta(hours=1)
-    events = None
-    if info_params.event is not None:
-        events = [info_params.event]
-    else:
-        events = database_connector.getEvents(category_id=ip.category_id, dt = dt)
-    outcome_combinations : tuple[Event, list[Outcome, str], float] = []
-    results : list[PositiveEVBet] = []
-    for event in events:
-        names = database_connector.getMarketOutcomeNames(event, ip.bet_type)
-        variants = database_connector.getMarketVariants(event, bet_type=ip.bet_type) or []
-        for variant in variants:
-            if ip.bet_type == BetType.totals:
-                points = list[float]
-                points = database_connector.getMarketPoints(event, ip.bet_type, description=variant)
-                for point in points:
-                    if type(point) is not float:
-                        logging.error("point is not a float")
-                        return
-                    params = info_params.model_copy(update={
-                        "event" : event,
-                        "names" : names,
-                        "description" : variant,
-                        "point" : point
-                    })
-                    results.extend(findInfoForEvent(info_type, params, outcome_combinations))
-            if ip.bet_type in [BetType.spreads, BetType.asian_spreads]:
-                if ip.description is None:
-                    points : list[float] = []
-                    points = database_connector.getMarketPoints(event, ip.bet_type, name="home")
-                    for point in points:
-                        if type(point) is not float:
-                            logging.error("point is not a float")
-                            return
-                        params = info_params.model_copy(update={
-                            "event" : event,
-                            "names" : names,
-                            "description" : variant,
-                            "point" : point,
-                        })
-                        results.extend(findInfoForEvent(info_type, params, outcome_combinations))
-            elif ip.bet_type == BetType.h2h:
-                params = info_params.model_copy(update={
-                            "event" : event,
-                            "names" : names,
-                            "description" : variant,
-                            "point" : None,
-                        })
-                results.extend(findInfoForEvent(info_type, params, outcome_combinations))
-        # logging.info("outcome combinations for event:")
-        if len(results) > 0:
-            for bet in results:
-                commence_time = bet.event.commence_time.replace(tzinfo=pytz.utc)
-                now = datetime.datetime.now(pytz.utc)
-                future_limit = now + datetime.timedelta(hours=24)
-                home_str = database_connector.getTeamName(bet.event.home)
-                away_str = database_connector.getTeamName(bet.event.away)
-                bet_type_str = database_connector.getBetTypeName(bet.bet_type)
-                print(f"Event: {home_str} vs {away_str} market: {bet_type_str} {ip.description or ''} category: {bet.event.category_id}")
-                print(f"Time: {commence_time}")
-                print(f"{bet.outcome.name} ({bet.outcome.point or ''!s}) at {round(bet.outcome.price,3)!s} from {bet.book}")
-                edge = round((bet.edge - 1)*100, 2)
-                print(f"Edge: {edge!s}% Fair Odds: {round(bet.fair_odds, 2)!s}")
-                print(f"Kelly Criterion: {round(bet.kelly_criterion, 3)!s}\n")
-
-        if len(outcome_combinations) > 0:
-            print("Arbs found: ", len(outcome_combinations))
-            for outcome_combination in outcome_combinations:
-                event = outcome_combination[0]
-                outcomes = outcome_combination[1]
-                probability = outcome_combination[2]
-                home_str = database_connector.getTeamName(event.home)
-                away_str = database_connector.getTeamName(event.away)
-                bet_type_str = database_connector.getBetTypeName(ip.bet_type)
-                print(f"Event: {home_str} vs {away_str} market: {bet_type_str} {ip.description or ''}")
-                for (i,name) in enumerate(names):
-                    print(f"({str(outcomes[i][0].point or '')}) {name} {str(outcomes[i][0].price)} from {outcomes[i][1]}")
-                print("Total: " + str(probability) + "\n")
-        outcome_combinations = []
-    
-def findInfoForEvent(info_type : BetInfoType, info_params : BetInfoParameters, outcome_combinations : list | None) -> list[PositiveEVBet] | None:
+    return database_connector.getEvents(category_id=ip.category_id, dt = dt)
+
+def analyseInfo(info_type : BetInfoType, info_params : BetInfoParameters, events : list[Event] | None = None,
+                odds_book : odds_engine.OddsBook | None = None) -> list:
+    """Return the arbs or positive EV bets of info_params, for events when given instead of the events it selects.
+
+    Prices are read from odds_book when given, from the database otherwise.
+    """
+    eligibility = database_connector.getUserEligibility(info_params.user_id)
+    return analyseInfoForUsers(info_type, info_params, [eligibility], events, odds_book)[0]
+
+def analyseInfoForUsers(info_type : BetInfoType, info_params : BetInfoParameters,
+                        eligibilities : list[schemas.UserEligibility | None], events : list[Event] | None = None,
+                        odds_book : odds_engine.OddsBook | None = None) -> list[list]:
+    """Return the arbs or positive EV bets of info_params for every user eligibility, None being a user without limits.
+
+    The odds are loaded, and de-vigged for EVs, once for all users, only the choice of eligible quotes is per user.
+    """
+    ip = info_params
+    if events is None:
+        events = getInfoEvents(ip)
+    updated_after = None
+    if ip.max_odds_age is not None:
+        updated_after = datetime.datetime.now(pytz.utc) - datetime.timedelta(seconds=ip.max_odds_age)
+    league = str(ip.category_id) if ip.category_id is not None else "all"
+    with profiling.scope(wrapper=info_type.name, league=league), profiling.stage("analyze"):
+        if info_type == BetInfoType.arbs:
+            return findArbsForUsers(events, eligibilities, [ip.bet_type], odds_book, updated_after)
+        if info_type == BetInfoType.evs and ip.sharp_book is not None:
+            return findPositiveEVsForUsers(events, eligibilities, ip.sharp_book, [ip.bet_type], ip.devig_method,
+                                           odds_book, updated_after)
+    return [[] for _ in eligibilities]
+
+def mergeInfo(info_type : BetInfoType, results : list[list]) -> list:
+    """Merge results of analyseInfo on parts of the same events in the order the engines sort them.
+
+    The sort is stable, so ties keep the order of results and the merge is the same on every run.
+    """
+    merged = [result for part in results for result in part]
     if info_type == BetInfoType.arbs:
-        findArbsForEvent(info_params, outcome_combinations)
-    elif info_type == BetInfoType.evs:
-        return findPositiveEVForEvent(info_params)
-    return None
+        merged.sort(key=lambda arb: arb.probability)
+    else:
+        merged.sort(key=lambda bet: -bet.edge)
+    return merged
+
+# markets written while the previous run read its high-water mark can commit with an older last_update,
+# so changes are looked up from a bit before it
+INCREMENTAL_OVERLAP = datetime.timedelta(minutes=1)
+
+analysis_state_path = "analysis_state.json"
+
+def opportunityKey(result : Arb | PositiveEVBet) -> tuple:
+    """Identify an arb by its market and a positive EV bet by its outcome, so reruns can tell what changed."""
+    if isinstance(result, Arb):
+        return (str(result.event.event_id), int(result.bet_type), result.description or "",
+                tuple((outcome.name, schemas.quantizePoint(outcome.point)) for outcome, _ in result.outcomes))
+    return tuple(schemas.OutcomeKey.of(result.event.event_id, result.bet_type, result.description,
+                                       result.outcome.name, result.outcome.point))
+
+class AnalysisState():
+    """Opportunities found by the previous runs of one analysis and the markets.last_update they are current to."""
+    def __init__(self, high_water_mark : datetime.datetime | None = None, opportunities : list[Arb | PositiveEVBet] | None = None):
+        self.high_water_mark = high_water_mark
+        self.opportunities : dict[tuple, Arb | PositiveEVBet] = {opportunityKey(result): result for result in opportunities or []}
+
+    def toJson(self) -> dict:
+        return {
+            "high_water_mark": self.high_water_mark.isoformat() if self.high_water_mark is not None else None,
+            "opportunities": [result.model_dump(mode="json") for result in self.opportunities.values()],
+        }
 
-def findArbsForEvent(info_params : BetInfoParameters, outcome_combinations : list):
+    @classmethod
+    def fromJson(cls, info_type : BetInfoType, data : dict) -> AnalysisState:
+        model = Arb if info_type == BetInfoType.arbs else PositiveEVBet
+        high_water_mark = data.get("high_water_mark")
+        return cls(datetime.datetime.fromisoformat(high_water_mark) if high_water_mark is not None else None,
+                   [model.model_validate(result) for result in data.get("opportunities", [])])
+
+class AnalysisDiff(NamedTuple):
+    new : list[Arb | PositiveEVBet]
+    changed : list[Arb | PositiveEVBet]
+    disappeared : list[Arb | PositiveEVBet]
+
+def analysisStateName(info_type : BetInfoType, info_params : BetInfoParameters) -> str:
+    ip = info_params
+    event_id = ip.event.event_id if ip.event is not None else None
+    return f"{info_type.name}:{ip.category_id}:{ip.bet_type.name}:{event_id}:{ip.user_id}:{ip.sharp_book}:{ip.devig_method.name}"
+
+def loadAnalysisStates(info_type : BetInfoType) -> dict[str, AnalysisState]:
+    """Read the analysis states of info_type from analysis_state_path, an unreadable file starts a full sweep."""
+    try:
+        with open(analysis_state_path) as file:
+            data = json.load(file)
+    except FileNotFoundError:
+        return {}
+    except (OSError, ValueError) as e:
+        logging.warning(f"Ignoring unreadable analysis state {analysis_state_path}: {e}")
+        return {}
+    prefix = info_type.name + ":"
+    return {name: AnalysisState.fromJson(info_type, state) for name, state in data.items() if name.startswith(prefix)}
+
+def saveAnalysisStates(states : dict[str, AnalysisState]):
+    """Write states to analysis_state_path, keeping the states of the other info types stored there."""
+    data = {}
+    if os.path.exists(analysis_state_path):
+        try:
+            with open(analysis_state_path) as file:
+                data = json.load(file)
+        except (OSError, ValueError):
+            data = {}
+    data.update({name: state.toJson() for name, state in states.items()})
+    tmp_path = analysis_state_path + ".tmp"
+    with open(tmp_path, "w") as file:
+        json.dump(data, file)
+    os.replace(tmp_path, analysis_state_path)
+
+def analyseInfoIncremental(info_type : BetInfoType, info_params : BetInfoParameters, state : AnalysisState,
+                           events : list[Event] | None = None) -> AnalysisDiff:
+    """Re-evaluate only the events whose markets changed since state.high_water_mark and update state.
+
+    Opportunities of the other events are kept from state, those of events that are no longer analysed disappear.
+    """
+    if events is None:
+        events = getInfoEvents(info_params)
+    since = state.high_water_mark - INCREMENTAL_OVERLAP if state.high_water_mark is not None else None
+    updates = database_connector.getChangedEventIds([event.event_id for event in events], since)
+    diff = updateAnalysis(info_type, info_params, state, events, set(updates))
+    if len(updates) > 0:
+        high_water_mark = max(updates.values())
+        if state.high_water_mark is None or high_water_mark > state.high_water_mark:
+            state.high_water_mark = high_water_mark
+    return diff
+
+def updateAnalysis(info_type : BetInfoType, info_params : BetInfoParameters, state : AnalysisState, events : list[Event],
+                   changed_ids : set[str], odds_book : odds_engine.OddsBook | None = None) -> AnalysisDiff:
+    """Re-evaluate the events in changed_ids, keep the opportunities of the rest of events and drop all others."""
+    events_by_id = {str(event.event_id): event for event in events}
+    changed_events = [event for event_id, event in events_by_id.items() if event_id in changed_ids]
+    results = analyseInfo(info_type, info_params, changed_events, odds_book) if len(changed_events) > 0 else []
+    previous = state.opportunities
+    current = {key: result for key, result in previous.items()
+               if str(result.event.event_id) in events_by_id and str(result.event.event_id) not in changed_ids}
+    current.update((opportunityKey(result), result) for result in results)
+    diff = AnalysisDiff(
+        new=[result for key, result in current.items() if key not in previous],
+        changed=[result for key, result in current.items() if key in previous and previous[key] != result],
+        disappeared=[result for key, result in previous.items() if key not in current],
+    )
+    state.opportunities = current
+    return diff
+
+def diffChanges(info_type : BetInfoType, diff : AnalysisDiff) -> list[tuple[str, list]]:
+    """Return the (change, opportunities) pairs of diff, each in the order of analyseInfo."""
+    return [(change, mergeInfo(info_type, [results])) for change, results in diff._asdict().items()]
+
+def loadOddsSnapshot(event_ids : list[str], bet_types : list[BetType],
+                     odds_book : odds_engine.OddsBook | None = None) -> odds_engine.OddsSnapshot:
+    if odds_book is not None:
+        return odds_book.snapshot(event_ids, bet_types)
+    return odds_engine.OddsSnapshot(database_connector.getOddsSnapshot(event_ids, bet_types))
+
+def findArbsForEvents(events : list[Event], bet_types : list[BetType] | None = None,
+                      odds_book : odds_engine.OddsBook | None = None, eligibility : schemas.UserEligibility | None = None,
+                      updated_after : datetime.datetime | None = None,
+                      snapshot : odds_engine.OddsSnapshot | None = None) -> list[Arb]:
+    """Find the arbs of every market of the given events with one odds snapshot and odds_engine.findArbs.
+
+    Only quotes the user can bet on, updated after updated_after, are used when those are given.
+    A snapshot of the events and bet types already loaded is used instead of loading one.
+    """
+    return findArbsForUsers(events, [eligibility], bet_types, odds_book, updated_after, snapshot)[0]
+
+def findArbsForUsers(events : list[Event], eligibilities : list[schemas.UserEligibility | None],
+                     bet_types : list[BetType] | None = None, odds_book : odds_engine.OddsBook | None = None,
+                     updated_after : datetime.datetime | None = None,
+                     snapshot : odds_engine.OddsSnapshot | None = None) -> list[list[Arb]]:
+    bet_types = [bet_type for bet_type in (bet_types or odds_engine.ANALYSED_BET_TYPES)
+                 if bet_type in odds_engine.ANALYSED_BET_TYPES]
+    events_by_id = {str(event.event_id): event for event in events}
+    if len(bet_types) == 0 or len(events_by_id) == 0:
+        return [[] for _ in eligibilities]
+    if snapshot is None:
+        snapshot = loadOddsSnapshot(list(events_by_id), bet_types, odds_book)
+    event_categories = {event_id: event.category_id for event_id, event in events_by_id.items()}
+    return [
+        [
+            Arb(event=events_by_id[market_key[0]], bet_type=BetType(market_key[1]), description=market_key[2] or None,
+                outcomes=[(Outcome(name=name, point=point, price=price), book) for name, point, price, book in outcomes],
+                probability=probability)
+            for market_key, outcomes, probability
+            in odds_engine.findArbs(snapshot, snapshot.eligibleRows(eligibility, updated_after, event_categories))
+        ]
+        for eligibility in eligibilities
+    ]
+
+def findPositiveEVsForEvents(events : list[Event], sharp_book : str, bet_types : list[BetType] | None = None,
+                             devig_method : DevigMethod = DevigMethod.multiplicative,
+                             odds_book : odds_engine.OddsBook | None = None,
+                             eligibility : schemas.UserEligibility | None = None,
+                             updated_after : datetime.datetime | None = None,
+                             snapshot : odds_engine.OddsSnapshot | None = None) -> list[PositiveEVBet]:
+    """Price every market of the given events against sharp_book with one odds snapshot and odds_engine.findPositiveEVs."""
+    return findPositiveEVsForUsers(events, [eligibility], sharp_book, bet_types, devig_method, odds_book, updated_after,
+                                   snapshot)[0]
+
+def findPositiveEVsForUsers(events : list[Event], eligibilities : list[schemas.UserEligibility | None], sharp_book : str,
+                            bet_types : list[BetType] | None = None, devig_method : DevigMethod = DevigMethod.multiplicative,
+                            odds_book : odds_engine.OddsBook | None = None,
+                            updated_after : datetime.datetime | None = None,
+                            snapshot : odds_engine.OddsSnapshot | None = None) -> list[list[PositiveEVBet]]:
+    bet_types = [bet_type for bet_type in (bet_types or odds_engine.ANALYSED_BET_TYPES)
+                 if bet_type in odds_engine.ANALYSED_BET_TYPES]
+    events_by_id = {str(event.event_id): event for event in events}
+    if len(bet_types) == 0 or len(events_by_id) == 0:
+        return [[] for _ in eligibilities]
+    if snapshot is None:
+        snapshot = loadOddsSnapshot(list(events_by_id), bet_types, odds_book)
+    event_categories = {event_id: event.category_id for event_id, event in events_by_id.items()}
+    fair = odds_engine.sharpFairProbabilities(snapshot, sharp_book, devig_method)
+    return [
+        [
+            PositiveEVBet(outcome=Outcome(name=name, point=point, price=price), event=events_by_id[market_key[0]],
+                          description=market_key[2] or None, bet_type=BetType(market_key[1]), book=book,
+                          fair_odds=fair_odds, edge=edge, kelly_criterion=kelly_criterion)
+            for market_key, name, point, price, book, fair_odds, edge, kelly_criterion
+            in odds_engine.findPositiveEVs(snapshot, sharp_book, devig_method, fair=fair,
+                                           eligible=snapshot.eligibleRows(eligibility, updated_after, event_categories))
+        ]
+        for eligibility in eligibilities
+    ]
+
+def getTopOdds(info_params : BetInfoParameters, name : str,
+               top_odds : dict[schemas.OutcomeKey, tuple[Outcome, str]] | None) -> tuple[Outcome | None, str | None]:
+    """Look up the top priced outcome from preloaded top_odds, or from top_universal_outcomes when none were loaded.
+
+    The database lookup returns the best ranked quote the user can bet on, recent enough for max_odds_age.
+    """
+    ip = info_params
+    if top_odds is None:
+        updated_after = None
+        if ip.max_odds_age is not None:
+            updated_after = datetime.datetime.now(pytz.utc) - datetime.timedelta(seconds=ip.max_odds_age)
+        return database_connector.getUniversalOutcomeTopOdds(ip.event, ip.bet_type, name, ip.point, ip.description,
+                                                             ip.user_id, updated_after)
+    return top_odds.get(schemas.OutcomeKey.of(ip.event.event_id, ip.bet_type, ip.description, name, ip.point), (None, None))
+
+def findArbsForEvent(info_params : BetInfoParameters, outcome_combinations : list,
+                     top_odds : dict[schemas.OutcomeKey, tuple[Outcome, str]] | None = None):
     ip = info_params
     outcomes : list[schemas.Outcome, str] = []
     probability : float = 0
@@ -123,8 +297,7 @@ def findArbsForEvent(info_params : BetInfoParameters, outcome_combinations : lis
         logging.debug("names is empty, event lacks data for a market")
         return
     for name in ip.names:
-        outcome_point = ip.point
-        outcome, book = database_connector.getUniversalOutcomeTopOdds(ip.event, ip.bet_type, name, ip.user_id, outcome_point, ip.description)
+        outcome, book = getTopOdds(ip, name, top_odds)
         if outcome is None or book is None:
             log = f"odds not found for event with id {ip.event.event_id} for bet type {ip.bet_type} description: {ip.description} point: {ip.point} name: {name}"
             logging.debug(log)
@@ -132,11 +305,15 @@ def findArbsForEvent(info_params : BetInfoParameters, outcome_combinations : lis
         probability += 1./outcome.price
         outcomes.append((outcome, book))
     if probability < 1.0:
-        outcome_combinations.append((ip.event, outcomes, probability))
+        outcome_combinations.append(Arb(event=ip.event, bet_type=ip.bet_type, description=ip.description,
+                                        outcomes=outcomes, probability=probability))
     
-def findPositiveEVForEvent(info_params : BetInfoParameters):
+def findPositiveEVForEvent(info_params : BetInfoParameters,
+                           top_odds : dict[schemas.OutcomeKey, tuple[Outcome, str]] | None = None,
+                           sharp_odds : dict[schemas.OutcomeKey, Outcome] | None = None):
     ip = info_params
-    fair_odds = getFairOddsForEvent(ip.event, ip.sharp_book, ip.names, ip.bet_type, ip.point, ip.description)
+    fair_odds = getFairOddsForEvent(ip.event, ip.sharp_book, ip.names, ip.bet_type, ip.point, ip.description, sharp_odds,
+                                    ip.devig_method)
     if fair_odds is None:
         return []
     top_bets : list[schemas.PositiveEVBet] = []
@@ -144,10 +321,9 @@ def findPositiveEVForEvent(info_params : BetInfoParameters):
         logging.debug("names is empty, event lacks data for a market")
         return []
     for index, name in enumerate(ip.names):
-        outcome_point = ip.point
         #if (ip.bet_type in [BetType.spreads, BetType.asian_spreads]) and name == "away":
             #outcome_point = -outcome_point
-        outcome, book = database_connector.getUniversalOutcomeTopOdds(ip.event, ip.bet_type, name, ip.user_id, outcome_point, ip.description)
+        outcome, book = getTopOdds(ip, name, top_odds)
         #if ip.bet_type == BetType.totals:
             #print(book)
         if outcome is None or book is None:
@@ -157,9 +333,9 @@ def findPositiveEVForEvent(info_params : BetInfoParameters):
         edge = outcome.price / fair_odds[index].price
 
         odds = fair_odds[index].price
-        kelly_criterion = getKellyCriterion(fair_odds[index].price, odds)
+        kelly_criterion = getKellyCriterion(outcome.price, odds)
 
-        if edge > 1.01 and round(kelly_criterion, 3) > 0.005:#and odds < 3.0
+        if edge > odds_engine.MIN_EDGE and round(kelly_criterion, 3) > odds_engine.MIN_KELLY:#and odds < 3.0
             top_bets.append(schemas.PositiveEVBet(outcome=outcome, event=ip.event, description=ip.description, bet_type = ip.bet_type,book=book, \
                                                 fair_odds=odds, edge=edge, kelly_criterion=kelly_criterion))
 
@@ -167,36 +343,38 @@ def findPositiveEVForEvent(info_params : BetInfoParameters):
     return top_bets
 
 def getKellyCriterion(odds : float, fair_odds : float, fraction = 0.25) -> float:
-    p = 1./fair_odds
-    q = 1. - p
-    b = odds
-    return (p - q/b)*fraction
+    return odds_engine.getKellyCriterion(odds, 1./fair_odds, fraction)
 
 def getFairOddsForEvent(event : schemas.Event, sharp_book : str, names : list[str], betType : BetType = BetType.h2h, point : float | None = None, \
-                        description : str | None = None) ->  list[schemas.Outcome] | None:
+                        description : str | None = None, sharp_odds : dict[schemas.OutcomeKey, Outcome] | None = None, \
+                        devig_method : DevigMethod = DevigMethod.multiplicative) ->  list[schemas.Outcome] | None:
     if len(names) == 0:
         logging.debug("names is empty, event lacks data for a market")
         return
     outcomes : list[schemas.Outcome] = []
-    probability : float = 0
     for name in names:
         outcome_point = point
         #if (betType in [BetType.spreads, BetType.asian_spreads]) and name == "away":
             #outcome_point = -point 
-        outcome = database_connector.getBookmakerOutcome(event, sharp_book, betType, name, outcome_point, description)
+        if sharp_odds is None:
+            outcome = database_connector.getBookmakerOutcome(event, sharp_book, betType, name, outcome_point, description)
+        else:
+            outcome = sharp_odds.get(schemas.OutcomeKey.of(event.event_id, betType, description, name, outcome_point))
         if outcome is None:
             home = database_connector.getTeamName(event.home)
             away = database_connector.getTeamName(event.away)
             logging.debug(f"Fair odds search error for {home} vs {away}")
             return None
-        probability += 1./outcome.price
         outcomes.append(outcome)
-    for outcome in outcomes:
-        if outcome is not None:
-            outcome.price = 1/((1./outcome.price) / probability) # this removes the "vig"
-    return outcomes
+    probabilities = odds_engine.fairProbabilities([outcome.price for outcome in outcomes], [0] * len(outcomes), devig_method)
+    if any(probability != probability for probability in probabilities):
+        logging.debug(f"Can't remove the vig from {sharp_book} odds of event {event.event_id} with {devig_method.name}")
+        return None
+    # copies, the sharp outcomes may be shared with other markets
+    return [outcome.model_copy(update={"price": 1./probability}) for outcome, probability in zip(outcomes, probabilities)]
         
 def verifyElement(variable : Any | Element):
+    from nodriver import Element
     if isinstance(variable, Element):
         return variable
     else:
@@ -214,6 +392,7 @@ def get_text_by_xpath(tree: html.HtmlElement, xpath_query: str) -> Optional[str]
         return None
     
 def print_tree(tree: html.HtmlElement):
+    from lxml import etree
     html_string = etree.tostring(tree, pretty_print=True).decode()
     print(html_string)
 
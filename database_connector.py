@@ -1,9 +1,10 @@
 from __future__ import annotations
 import configparser
-from datetime import datetime
-import hashlib
+from datetime import date, datetime, timedelta
 import inspect
 import logging
+import select
+import threading
 import time
 from typing import List, Optional, Tuple, Union
 
@@ -11,14 +12,16 @@ import psycopg2
 
 from psycopg2 import sql
 from psycopg2 import pool
+from psycopg2 import extras
 from psycopg2.extensions import connection
 import pytz
 from fuzzywuzzy import fuzz
 from fuzzywuzzy import process
-import spacy
 
 
+import profiling
 import schemas
+import team_similarity
 
 config = configparser.ConfigParser()
 config.read('db_config.ini')
@@ -26,7 +29,9 @@ config.read('db_config.ini')
 # Extract the connection details
 db_params = config['postgresql']
 
-nlp = spacy.load("en_core_web_sm")
+# markets.last_update and the other timestamp columns have no time zone, the sessions are in UTC so the aware
+# datetimes written to them are stored in UTC and the naive ones read back are UTC, whatever the server's TimeZone is
+SESSION_OPTIONS = "-c TimeZone=UTC"
 
 def connectDb():
     db_params = config['postgresql']
@@ -37,7 +42,8 @@ def connectDb():
                     password=db_params['password'],
                     host=db_params['host'],
                     port=db_params['port'],
-                    database=db_params['database'])
+                    database=db_params['database'],
+                    options=SESSION_OPTIONS)
 
 
 def get_connection() -> connection:
@@ -57,10 +63,147 @@ def release_connection(conn : connection):
 def disconnectDb():
     pool.closeall()
 
+class ResolutionCache():
+    """In-process cache for team, category and event lookups done by the wrappers.
+
+    Entries are grouped per category so that a category can be evicted on its own,
+    either explicitly or once it is older than max_age seconds.
+    """
+    def __init__(self, max_age : float = 3600):
+        self.max_age = max_age
+        self.lock = threading.RLock()
+        self.categories : dict[str, int] = {}
+        self.teams : dict[int, dict[str, int]] = {}
+        self.events : dict[int, dict[tuple[date, int, int], str]] = {}
+        self.event_rows : dict[str, schemas.Event] = {}
+        self.event_urls : dict[str, dict[str, str | None]] = {}
+        self.loaded_at : dict[int, float] = {}
+
+    def touch(self, category_id : int):
+        if category_id not in self.loaded_at:
+            self.loaded_at[category_id] = time.monotonic()
+
+    def getTeamId(self, name : str, category_id : int) -> int | None:
+        return self.teams.get(category_id, {}).get(name)
+
+    def putTeam(self, name : str, category_id : int, team_id : int):
+        with self.lock:
+            self.touch(category_id)
+            self.teams.setdefault(category_id, {})[name] = team_id
+
+    def getEventId(self, category_id : int, day : date, home : int, away : int) -> str | None:
+        return self.events.get(category_id, {}).get((day, home, away))
+
+    def putEventId(self, category_id : int, day : date, home : int, away : int, event_id : str):
+        with self.lock:
+            self.touch(category_id)
+            self.events.setdefault(category_id, {})[(day, home, away)] = event_id
+
+    def putEvent(self, event : schemas.Event):
+        with self.lock:
+            self.putEventId(event.category_id, event.commence_time.date(), event.home, event.away, str(event.event_id))
+            self.event_rows[str(event.event_id)] = event
+
+    def getEventUrl(self, event_id : str, bookmaker : str) -> tuple[bool, str | None]:
+        urls = self.event_urls.get(event_id, {})
+        return (bookmaker in urls, urls.get(bookmaker))
+
+    def putEventUrl(self, event_id : str, bookmaker : str, event_url : str | None):
+        with self.lock:
+            self.event_urls.setdefault(event_id, {})[bookmaker] = event_url
+
+    def evictCategory(self, category_id : int):
+        with self.lock:
+            self.teams.pop(category_id, None)
+            self.loaded_at.pop(category_id, None)
+            for event_id in self.events.pop(category_id, {}).values():
+                self.event_rows.pop(event_id, None)
+                self.event_urls.pop(event_id, None)
+
+    def evictStale(self, max_age : float | None = None):
+        max_age = self.max_age if max_age is None else max_age
+        now = time.monotonic()
+        with self.lock:
+            stale = [category_id for category_id, loaded in self.loaded_at.items() if now - loaded > max_age]
+            for category_id in stale:
+                self.evictCategory(category_id)
+
+    def clear(self):
+        with self.lock:
+            self.categories.clear()
+            self.teams.clear()
+            self.events.clear()
+            self.event_rows.clear()
+            self.event_urls.clear()
+            self.loaded_at.clear()
+
+resolution_cache = ResolutionCache()
+
+def preloadResolutionCache(category_ids : list[int] | None = None, bookmaker : str | None = None):
+    """Load category names, and the teams and upcoming events of the given categories, with one query each."""
+    resolution_cache.evictStale()
+    conn = get_connection()
+    cur = conn.cursor()
+    cur.execute(
+        """
+        SELECT fd.text, f.category_id
+        FROM categories f
+        JOIN bookmaker_categories fd ON fd.category_id = f.category_id;
+        """
+    )
+    with resolution_cache.lock:
+        for row in cur.fetchall():
+            resolution_cache.categories.setdefault(row[0], int(row[1]))
+    if category_ids is not None and len(category_ids) > 0:
+        for category_id in category_ids:
+            resolution_cache.evictCategory(category_id)
+        cur.execute(
+            """
+            SELECT text, category_id, team_id FROM team_dict
+            WHERE category_id = ANY(%s);
+            """,
+            (list(category_ids),),
+        )
+        for row in cur.fetchall():
+            resolution_cache.putTeam(row[0], int(row[1]), int(row[2]))
+        cur.execute(
+            """
+            SELECT e.*, eu.event_url, eu.bookmaker_key
+            FROM events e
+            LEFT JOIN event_urls eu ON eu.event_id = e.event_id AND eu.bookmaker_key = %s
+            WHERE e.category_id = ANY(%s)
+            AND e.commence_time > %s;
+            """,
+            (bookmaker, list(category_ids), datetime.now(pytz.utc) - timedelta(days=1)),
+        )
+        for row in cur.fetchall():
+            event = eventFromDbRow(row)
+            resolution_cache.putEvent(event)
+            if row[-1] is not None:
+                resolution_cache.putEventUrl(str(event.event_id), bookmaker, row[-2])
+        for category_id in category_ids:
+            resolution_cache.touch(category_id)
+    conn.commit()
+    cur.close()
+    release_connection(conn)
+
+team_indexes : dict[int, team_similarity.TeamSimilarityIndex] = {}
+team_indexes_lock = threading.Lock()
+
 def get_closest_match(search_term : str, input_strings : list[str]):
-    input_team_doc = nlp(search_term)
-    similarities = [(name, input_team_doc.similarity(nlp(name))) for name in input_strings]
-    return max(similarities, key=lambda x: x[1])
+    similarities = team_similarity.encode(input_strings) @ team_similarity.encode([search_term])[0]
+    best = int(similarities.argmax())
+    return (input_strings[best], float(similarities[best]))
+
+def getTeamIndex(category_id : int) -> team_similarity.TeamSimilarityIndex:
+    """Return the similarity index of a category, building it from team_dict on first use."""
+    with team_indexes_lock:
+        index = team_indexes.get(category_id)
+        if index is None:
+            teams = getTeamDict(category_id)
+            index = team_similarity.TeamSimilarityIndex([team[0] for team in teams], [team[1] for team in teams])
+            team_indexes[category_id] = index
+    return index
 
 # TODO: implement RESTful api using flask for all the get methods
 # use api keys
@@ -94,6 +237,9 @@ def getUnmatchedCategories():
     return rows
 
 def getEventById(event_id : str) -> schemas.Event | None:
+    cached = resolution_cache.event_rows.get(str(event_id))
+    if cached is not None:
+        return cached
     conn = get_connection()
     cur = conn.cursor()
     cur.execute(
@@ -107,7 +253,9 @@ def getEventById(event_id : str) -> schemas.Event | None:
     row = cur.fetchone()
     release_connection(conn)
     if row is not None:
-        return eventFromDbRow(row)
+        event = eventFromDbRow(row)
+        resolution_cache.putEvent(event)
+        return event
     return None
 
 def getEvents(home : Optional[str] = None, away : Optional[str] = None, category_id : Optional[int] = None, dt: Optional[datetime] = None) ->  List[schemas.Event]:  # eg. games, elections
@@ -184,33 +332,118 @@ def getTopOddsInfo(limit = 25, eventId : Optional[str] = None, dt: Optional[date
 
 def addOrUpdateMarket(market: schemas.Market) -> int:  # TODO: decide how to do ids
     logging.info(market)
+    return upsertMarkets([market])[0]
+
+def marketKey(market : schemas.Market) -> tuple[str, str, str, int]:
+    return (str(market.event_id), market.bookmaker_key, market.description or "", int(market.bet_type_id))
+
+@profiling.timed("db_write")
+def upsertMarkets(markets : List[schemas.Market]) -> list[int]:
+    """Insert or update a batch of markets and their outcomes in a single transaction.
+
+    Existing markets are resolved with one joined SELECT, missing ones are inserted with one
+    multi-row INSERT and all outcomes are upserted with one INSERT ... ON CONFLICT.
+    Returns the market ids in the same order as the given markets.
+    """
+    if len(markets) == 0:
+        return []
+    keys = [marketKey(market) for market in markets]
+    unique_markets : dict[tuple[str, str, str, int], schemas.Market] = {}
+    for key, market in zip(keys, markets):
+        unique_markets[key] = market
     conn = get_connection()
     cur = conn.cursor()
+    rows = extras.execute_values(
+        cur,
+        """
+        SELECT DISTINCT ON (v.event_id, v.bookmaker_key, v.description, v.bet_type_id)
+        v.event_id, v.bookmaker_key, v.description, v.bet_type_id, m.market_id
+        FROM (VALUES %s) AS v(event_id, bookmaker_key, description, bet_type_id)
+        JOIN markets m ON m.event_id = v.event_id::uuid
+        AND m.bookmaker_key = v.bookmaker_key
+        AND coalesce(m.description, '') = v.description
+        AND m.bet_type_id = v.bet_type_id
+        ORDER BY v.event_id, v.bookmaker_key, v.description, v.bet_type_id, m.market_id;
+        """,
+        list(unique_markets.keys()),
+        template="(%s, %s, %s, %s::integer)",
+        page_size=len(unique_markets),
+        fetch=True,
+    )
+    market_ids : dict[tuple[str, str, str, int], int] = {
+        (str(row[0]), row[1], row[2], int(row[3])): int(row[4]) for row in rows
+    }
+    existing = set(market_ids)
+    missing = [market for key, market in unique_markets.items() if key not in existing]
+    if len(missing) > 0:
+        rows = extras.execute_values(
+            cur,
+            """
+            INSERT INTO markets (event_id, bookmaker_key, bet_type_id, description, last_update, market_bookmaker_id)
+            VALUES %s
+            RETURNING event_id, bookmaker_key, coalesce(description, ''), bet_type_id, market_id;
+            """,
+            [
+                (
+                    market.event_id,
+                    market.bookmaker_key,
+                    market.bet_type_id,
+                    market.description,
+                    market.last_update,
+                    market.market_bookmaker_id,
+                )
+                for market in missing
+            ],
+            page_size=len(missing),
+            fetch=True,
+        )
+        for row in rows:
+            market_ids[(str(row[0]), row[1], row[2], int(row[3]))] = int(row[4])
+
+    # markets stored before the bookmaker gave its ids get them now, the price refresh of updateOdds looks markets up by them
+    bookmaker_ids = {market_ids[key]: market.market_bookmaker_id for key, market in unique_markets.items()
+                     if key in existing and market.market_bookmaker_id is not None}
+    if len(bookmaker_ids) > 0:
+        extras.execute_values(
+            cur,
+            """
+            UPDATE markets m SET market_bookmaker_id = v.market_bookmaker_id
+            FROM (VALUES %s) AS v(market_id, market_bookmaker_id)
+            WHERE m.market_id = v.market_id
+            AND m.market_bookmaker_id IS DISTINCT FROM v.market_bookmaker_id;
+            """,
+            list(bookmaker_ids.items()),
+            template="(%s::integer, %s)",
+            page_size=len(bookmaker_ids),
+        )
+
+    # a single INSERT ... ON CONFLICT can't touch the same row twice, the last price seen wins
+    outcome_tuples : dict[tuple[str, int, float | None], tuple] = {}
+    for key, market in zip(keys, markets):
+        market_id = market_ids[key]
+        for outcome in market.outcomes:
+            outcome_tuples[(outcome.name, market_id, outcome.point)] = outcomeToTuple(outcome, market_id)
+    if len(outcome_tuples) > 0:
+        extras.execute_values(
+            cur,
+            """
+            INSERT INTO outcomes (name, description, market_id, price, point, outcome_bookmaker_id) VALUES %s
+            ON CONFLICT (name, market_id, point) DO UPDATE SET price = EXCLUDED.price,
+            outcome_bookmaker_id = COALESCE(EXCLUDED.outcome_bookmaker_id, outcomes.outcome_bookmaker_id);
+            """,
+            list(outcome_tuples.values()),
+            page_size=1000,
+        )
     cur.execute(
         """
-        SELECT  market_id FROM markets
-        WHERE event_id = %s AND
-        bookmaker_key = %s AND
-        coalesce(description, '') = %s AND
-        bet_type_id = %s;
+        UPDATE markets SET last_update = %s WHERE market_id = ANY(%s)
         """,
-        (
-            market.event_id,
-            market.bookmaker_key,
-            market.description or "",
-            market.bet_type_id,
-        ),
+        (datetime.now(pytz.utc), list(set(market_ids.values()))),
     )
-    row = cur.fetchone()
-    id = row[0] if row is not None else None
-    if id is None:
-        id = addMarket(market, conn)
-    
-    updateMarketOutcomes(id, market.outcomes)
     conn.commit()
     cur.close()
     release_connection(conn)
-    return id
+    return [market_ids[key] for key in keys]
 
 def getMarketPoints(event : schemas.Event, betType : int, name : str | None = None, description : str = "") -> list[float]:
     conn = get_connection()
@@ -264,11 +497,11 @@ def getMarketVariants(event : schemas.Event, bet_type : int):
         SELECT DISTINCT m.description 
         FROM outcomes o
         JOIN markets m ON o.market_id = m.market_id
-        AND m.bet_type_id = 3
+        AND m.bet_type_id = %s
         AND m.description <> ''
         AND m.event_id = %s
         """,
-        (event.event_id,)
+        (int(bet_type), event.event_id)
     )
     rows = cur.fetchall()
     conn.commit()
@@ -276,6 +509,7 @@ def getMarketVariants(event : schemas.Event, bet_type : int):
     release_connection(conn)
     return [None] + [str(row[0]) for row in rows]
 
+@profiling.timed("db_write")
 def addBookmakerEvent(event_id: str, bookmaker_key: str, event_url : str | None, oghome : str, ogaway : str):
     conn = get_connection()
     cur = conn.cursor()
@@ -301,9 +535,13 @@ def addBookmakerEvent(event_id: str, bookmaker_key: str, event_url : str | None,
     conn.commit()
     cur.close()
     release_connection(conn)
+    resolution_cache.putEventUrl(str(event_id), bookmaker_key, event_url)
 
 
 def getEventUrl(event_id: str, bookmaker_key: str):
+    cached, event_url = resolution_cache.getEventUrl(str(event_id), bookmaker_key)
+    if cached:
+        return event_url
     conn = get_connection()
     cur = conn.cursor()
     cur.execute(
@@ -411,6 +649,44 @@ def addEvent(event: schemas.Event, connection : connection | None) -> str:
         release_connection(conn)
     return eventId
 
+def addEvents(events : list[schemas.Event]):
+    """Insert events keeping their event_id, in a single statement."""
+    if len(events) == 0:
+        return
+    conn = get_connection()
+    cur = conn.cursor()
+    extras.execute_values(
+        cur,
+        """
+        INSERT INTO events (event_id, category_id, commence_time, description, home, away)
+        VALUES %s
+        """,
+        [(str(event.event_id), event.category_id, event.commence_time, event.description, event.home, event.away)
+         for event in events],
+        page_size=1000,
+    )
+    conn.commit()
+    cur.close()
+    release_connection(conn)
+
+def deleteCategory(category_id : int):
+    """Delete a category with its teams, events, markets and outcomes."""
+    conn = get_connection()
+    cur = conn.cursor()
+    cur.execute(
+        """
+        DELETE FROM markets
+        WHERE event_id IN (SELECT event_id FROM events WHERE category_id = %s)
+        """,
+        (category_id,),
+    )
+    cur.execute("DELETE FROM events WHERE category_id = %s", (category_id,))
+    cur.execute("DELETE FROM team_dict WHERE category_id = %s", (category_id,))
+    cur.execute("DELETE FROM categories WHERE category_id = %s", (category_id,))
+    conn.commit()
+    cur.close()
+    release_connection(conn)
+
 def addBookmakerCategory(category: schemas.category | str, bookmaker : str, bookmaker_category_key : str | None) -> int:
     category_row = None
     if type(category) is str:
@@ -489,6 +765,9 @@ def searchOrAddCategory(search_term: str, bookmaker : str, api_id : str | None)
     return id
 
 def searchCategoryId(slug: str, api_id : str | None = None) -> int | None:
+    cached = resolution_cache.categories.get(slug)
+    if cached is not None:
+        return cached
     conn = get_connection()
     cur = conn.cursor()
     cur.execute(
@@ -506,6 +785,7 @@ def searchCategoryId(slug: str, api_id : str | None = None) -> int | None:
     release_connection(conn)
     if rows is None:
         return None
+    resolution_cache.categories[slug] = int(rows[0])
     return int(rows[0])
 
 def getBookmakerMarkets(bookmaker : str) -> list[tuple[int, str]]:
@@ -524,14 +804,19 @@ def getBookmakerMarkets(bookmaker : str) -> list[tuple[int, str]]:
     release_connection(conn)
     return [(int(row[0]), row[1]) for row in rows]
 
-def getBookmakerOutcomeIds(bookmaker : str) -> list[tuple[int, str]]:
+def getBookmakerOutcomeIds(bookmaker : str) -> list[tuple[int, str, int, float | None]]:
+    """Return the (outcome_id, outcome_bookmaker_id, market_id, price) of the outcomes of bookmaker that have an id
+    at the bookmaker, in the events that haven't started."""
     conn = get_connection()
     cur = conn.cursor()
     cur.execute(
         """
-        SELECT outcome_id, bookmaker_outcome_id FROM outcomes o
+        SELECT o.outcome_id, o.outcome_bookmaker_id, o.market_id, o.price FROM outcomes o
         JOIN markets m ON o.market_id = m.market_id
-        WHERE m.bookmaker_key = %s;
+        JOIN events e ON e.event_id = m.event_id
+        WHERE m.bookmaker_key = %s
+        AND o.outcome_bookmaker_id IS NOT NULL
+        AND e.commence_time > NOW();
         """,
         (bookmaker,),
     )
@@ -539,7 +824,28 @@ def getBookmakerOutcomeIds(bookmaker : str) -> list[tuple[int, str]]:
     conn.commit()
     cur.close()
     release_connection(conn)
-    return [(int(row[0]), row[1]) for row in rows]
+    return [(int(row[0]), row[1], int(row[2]), row[3]) for row in rows]
+
+def getBookmakerCategoryKeys(bookmaker : str) -> list[str]:
+    """Return the ids at bookmaker of the categories that have markets of bookmaker in events that haven't started."""
+    conn = get_connection()
+    cur = conn.cursor()
+    cur.execute(
+        """
+        SELECT DISTINCT bc.category_bookmaker_key FROM bookmaker_categories bc
+        JOIN events e ON e.category_id = bc.category_id
+        JOIN markets m ON m.event_id = e.event_id AND m.bookmaker_key = bc.bookmaker_key
+        WHERE bc.bookmaker_key = %s
+        AND bc.category_bookmaker_key IS NOT NULL
+        AND e.commence_time > NOW();
+        """,
+        (bookmaker,),
+    )
+    rows = cur.fetchall()
+    conn.commit()
+    cur.close()
+    release_connection(conn)
+    return [row[0] for row in rows]
 
 def getTeamsInCategory(category_id: int) -> list[str]:
     conn = get_connection()
@@ -559,54 +865,95 @@ def getTeamsInCategory(category_id: int) -> list[str]:
     teams = []
     return [str(team[0]) for team in rows]
 
-def searchTeamId(search_term : str, category_id : int) -> int | None :
+def getTeamDict(category_id: int) -> list[tuple[str, int]]:
     conn = get_connection()
     cur = conn.cursor()
     cur.execute(
         """
-        SELECT team_id FROM team_dict
-        WHERE text = %s
-        AND category_id = %s;
+        SELECT text, team_id
+        FROM team_dict
+        WHERE category_id = %s
         """,
-        (search_term, category_id),
+        (category_id,),
     )
-    rows = cur.fetchone()
+    rows = cur.fetchall()
     conn.commit()
     cur.close()
     release_connection(conn)
-    return int(rows[0]) if rows is not None and rows[0] is not None else None
+    return [(str(row[0]), int(row[1])) for row in rows]
 
-def getTeamName(team_id : int) -> str:
+def searchTeamId(search_term : str, category_id : int) -> int | None :
+    cached = resolution_cache.getTeamId(search_term, category_id)
+    if cached is not None:
+        return cached
     conn = get_connection()
     cur = conn.cursor()
     cur.execute(
         """
-        SELECT text FROM team_dict
-        WHERE team_id = %s;
+        SELECT team_id FROM team_dict
+        WHERE text = %s
+        AND category_id = %s;
         """,
-        (team_id,),
+        (search_term, category_id),
     )
     rows = cur.fetchone()
     conn.commit()
     cur.close()
     release_connection(conn)
-    return str(rows[0]) if rows is not None and rows[0] is not None else None
+    if rows is None or rows[0] is None:
+        return None
+    resolution_cache.putTeam(search_term, category_id, int(rows[0]))
+    return int(rows[0])
 
-def getBetTypeName(bet_type_id : int) -> str:
+# names of the ids printed with the opportunities, they are read once per process
+team_names : dict[int, str | None] = {}
+bet_type_names : dict[int, str] | None = None
+_names_lock = threading.Lock()
+
+def getTeamNames(team_ids : list[int]) -> dict[int, str | None]:
+    """Return the name of every team id, reading the ones not cached yet with a single query."""
+    missing = list({team_id for team_id in team_ids if team_id not in team_names})
+    if len(missing) > 0:
+        conn = get_connection()
+        cur = conn.cursor()
+        cur.execute(
+            """
+            SELECT DISTINCT ON (team_id) team_id, text FROM team_dict
+            WHERE team_id = ANY(%s)
+            ORDER BY team_id;
+            """,
+            (missing,),
+        )
+        rows = cur.fetchall()
+        conn.commit()
+        cur.close()
+        release_connection(conn)
+        found = {row[0]: str(row[1]) if row[1] is not None else None for row in rows}
+        with _names_lock:
+            team_names.update((team_id, found.get(team_id)) for team_id in missing)
+    return {team_id: team_names.get(team_id) for team_id in team_ids}
+
+def getTeamName(team_id : int) -> str:
+    return getTeamNames([team_id])[team_id]
+
+def getBetTypeNames() -> dict[int, str]:
+    """Return the key of every bet type id, read from bet_types on first use."""
+    global bet_type_names
+    if bet_type_names is not None:
+        return bet_type_names
     conn = get_connection()
     cur = conn.cursor()
-    cur.execute(
-        """
-        SELECT key FROM bet_types
-        WHERE bet_type_id = %s;
-        """,
-        (bet_type_id,),
-    )
-    rows = cur.fetchone()
+    cur.execute("SELECT bet_type_id, key FROM bet_types;")
+    rows = cur.fetchall()
     conn.commit()
     cur.close()
     release_connection(conn)
-    return str(rows[0]) if rows is not None and rows[0] is not None else None
+    with _names_lock:
+        bet_type_names = {int(row[0]): str(row[1]) for row in rows if row[1] is not None}
+    return bet_type_names
+
+def getBetTypeName(bet_type_id : int) -> str:
+    return getBetTypeNames().get(int(bet_type_id))
 
 def searchSimilarCategoryId(search_term : str) -> tuple[int, str] | None :
     categories = getCategoryNames()
@@ -620,13 +967,12 @@ def searchSimilarCategoryId(search_term : str) -> tuple[int, str] | None :
 
 
 def searchSimilarTeamId(search_term : str, category_id : int) -> int | None :
-    teams = getTeamsInCategory(category_id)
-    if len(teams) == 0:
+    result = getTeamIndex(category_id).closest(search_term)
+    if result is None:
         return None
-    result = get_closest_match(search_term, teams)
     if result[1] > 0.98:
         print(search_term, result)
-        match = searchTeamId(result[0], category_id)
+        match = result[2]
         id = addTeam(search_term, category_id, match)
         if id is None:
             return searchTeamId(search_term, category_id) # team has been added while trying to add it
@@ -646,12 +992,16 @@ def addTeam(name : str, category_id : int, team_id : int = None) -> int | None:
         (name, category_id),
     )
     row = cur.fetchone()
-    if row is None:
-        return None
-    logging.info(f"Added team name {name} with id {team_id}")
     conn.commit()
     cur.close()
     release_connection(conn)
+    if row is None:
+        return None
+    resolution_cache.putTeam(name, category_id, int(row[0]))
+    index = team_indexes.get(category_id)
+    if index is not None:
+        index.add(name, int(row[0]))
+    logging.info(f"Added team name {name} with id {team_id}")
     return team_id
     
 
@@ -669,6 +1019,7 @@ def getNextTeamId():
     release_connection(conn)
     return int(rows[0])+1 if rows[0] is not None else 0
 
+@profiling.timed("resolve_teams")
 def searchOrAddTeam(name : str, category_id : int) -> int:
     id = searchTeamId(name, category_id)
     if id is None:
@@ -700,6 +1051,7 @@ def searchBetTypeId(search_term : str) -> int:  # TODO: finish
     return id
 
 
+@profiling.timed("resolve_event")
 def searchOrAddEvent(home : str, away : str, category: int, gameDateTime: datetime) -> str:
     home_id = searchOrAddTeam(home, category)
     away_id = searchOrAddTeam(away, category)
@@ -708,6 +1060,9 @@ def searchOrAddEvent(home : str, away : str, category: int, gameDateTime: dateti
         logging.error("Exception when looking up teams for event {home} vs {away}")
         return ""
 
+    cached = resolution_cache.getEventId(category, gameDateTime.date(), home_id, away_id)
+    if cached is not None:
+        return cached
     conn = get_connection()
     cur = conn.cursor()
     cur.execute(
@@ -735,6 +1090,7 @@ def searchOrAddEvent(home : str, away : str, category: int, gameDateTime: dateti
     conn.commit()
     cur.close()
     release_connection(conn)
+    resolution_cache.putEventId(category, gameDateTime.date(), home_id, away_id, str(id))
     return id
 
 
@@ -744,6 +1100,7 @@ def removecategoryDuplicates():
     print("todo")
 
 
+@profiling.timed("db_write")
 def updateMarketOutcomes(market_id, outcomes: List[schemas.Outcome]):
     conn = get_connection()
     cur = conn.cursor()
@@ -751,7 +1108,8 @@ def updateMarketOutcomes(market_id, outcomes: List[schemas.Outcome]):
     cur.executemany(
         """
         INSERT INTO outcomes (name, description, market_id, price, point, outcome_bookmaker_id) VALUES (%s, %s, %s, %s, %s, %s)
-        ON CONFLICT (name, market_id, point) DO UPDATE SET (price) = ROW(EXCLUDED.price);
+        ON CONFLICT (name, market_id, point) DO UPDATE SET price = EXCLUDED.price,
+        outcome_bookmaker_id = COALESCE(EXCLUDED.outcome_bookmaker_id, outcomes.outcome_bookmaker_id);
         """,
         tuples,
     )
@@ -765,15 +1123,35 @@ def updateMarketOutcomes(market_id, outcomes: List[schemas.Outcome]):
     cur.close()
     release_connection(conn)
 
-def updateOddsByOutcomeId(update : dict[int, float]):
+@profiling.timed("db_write")
+def updateOddsByOutcomeId(update : dict[int, float], market_ids : list[int] | None = None):
+    """Set the prices of outcomes by outcome_id and mark market_ids as updated now, in one transaction.
+
+    The prices are written with a single UPDATE and the markets with another, so the statement level triggers,
+    which rank the touched outcomes again in top_universal_outcomes and notify MARKET_UPDATES_CHANNEL,
+    run once per batch instead of once per outcome.
+    """
     conn = get_connection()
     cur = conn.cursor()
-    cur.executemany(
-        """
-        UPDATE outcomes SET price = %s WHERE outcome_id = %s;
-        """,
-        update.items(),
-    )
+    if len(update) > 0:
+        extras.execute_values(
+            cur,
+            """
+            UPDATE outcomes o SET price = v.price
+            FROM (VALUES %s) AS v(outcome_id, price)
+            WHERE o.outcome_id = v.outcome_id;
+            """,
+            list(update.items()),
+            template="(%s::integer, %s::real)",
+            page_size=len(update),
+        )
+    if market_ids:
+        cur.execute(
+            """
+            UPDATE markets SET last_update = %s WHERE market_id = ANY(%s)
+            """,
+            (datetime.now(pytz.utc), list(market_ids)),
+        )
     conn.commit()
     cur.close()
     release_connection(conn)
@@ -867,81 +1245,419 @@ def materialized_view_exists(cursor, view_name):
 def refresh_materialized_view(cursor, view_name):
     cursor.execute(sql.SQL("REFRESH MATERIALIZED VIEW {}").format(sql.Identifier(view_name)))
     
+def table_exists(cursor, table_name):
+    cursor.execute(sql.SQL("SELECT 1 FROM pg_tables WHERE schemaname = 'public' AND tablename = %s"), [table_name])
+    return cursor.fetchone() is not None
+
+def column_exists(cursor, table_name, column_name):
+    cursor.execute(
+        sql.SQL("SELECT 1 FROM information_schema.columns WHERE table_name = %s AND column_name = %s"),
+        [table_name, column_name],
+    )
+    return cursor.fetchone() is not None
+
+# the composite outcomes a statement on outcomes touched, with the ones its outcomes were ranked under before,
+# as the (event_id, bet_type_id, market_description, name, point_key) of schemas.OutcomeKey
+CHANGED_TOP_OUTCOMES = """
+    SELECT m.event_id, m.bet_type_id, coalesce(m.description, '') AS market_description, c.name,
+        round(c.point * %(point_scale)s)::integer AS point_key
+    FROM changed_outcomes c
+    JOIN markets m ON m.market_id = c.market_id
+    UNION
+    SELECT t.event_id, t.bet_type_id, t.market_description, t.name, t.point_key
+    FROM top_universal_outcomes t
+    JOIN changed_outcomes c ON c.outcome_id = t.outcome_id
+"""
+
+# the schemas.TOP_BOOKS best quotes of every composite outcome, ranked by price and then by bookmaker and outcome
+# so equal prices keep their rank. It is maintained by statement level triggers on outcomes, which only rank again the
+# composite outcomes the statement touched. A transaction locks those outcomes, in key order, before ranking them,
+# so concurrent writers rank one after the other and the later one sees the prices of the earlier one.
+# last_update is read from markets, it changes on every scan of a market without its outcomes being written.
+TOP_UNIVERSAL_OUTCOMES_DDL = """
+    CREATE TABLE top_universal_outcomes(
+        event_id UUID NOT NULL,
+        bet_type_id INTEGER NOT NULL,
+        market_description VARCHAR NOT NULL,
+        name VARCHAR(50) NOT NULL,
+        point_key INTEGER,
+        rank SMALLINT NOT NULL,
+        outcome_id INTEGER NOT NULL,
+        description VARCHAR(50),
+        market_id INTEGER NOT NULL,
+        price REAL NOT NULL,
+        point REAL,
+        bookmaker_key VARCHAR(50) NOT NULL
+    );
+    CREATE INDEX ix_top_universal_outcomes ON top_universal_outcomes
+        (event_id, bet_type_id, market_description, name, point_key, rank)
+        INCLUDE (price, bookmaker_key, market_id, point);
+    CREATE INDEX ix_top_universal_outcomes_outcome ON top_universal_outcomes (outcome_id);
+
+    INSERT INTO top_universal_outcomes
+        (event_id, bet_type_id, market_description, name, point_key, rank,
+        outcome_id, description, market_id, price, point, bookmaker_key)
+    SELECT * FROM (
+        SELECT m.event_id, m.bet_type_id, coalesce(m.description, ''), o.name,
+            round(o.point * %(point_scale)s)::integer,
+            row_number() OVER (PARTITION BY m.event_id, m.bet_type_id, coalesce(m.description, ''), o.name,
+                round(o.point * %(point_scale)s)::integer ORDER BY o.price DESC, m.bookmaker_key, o.outcome_id) AS rank,
+            o.outcome_id, o.description, o.market_id, o.price, o.point, m.bookmaker_key
+        FROM outcomes o
+        JOIN markets m ON o.market_id = m.market_id
+        WHERE o.price IS NOT NULL
+    ) ranked
+    WHERE ranked.rank <= %(top_books)s;
+"""
+
+TOP_UNIVERSAL_OUTCOMES_TRIGGERS = """
+    CREATE OR REPLACE FUNCTION refresh_top_universal_outcomes() RETURNS trigger
+    LANGUAGE plpgsql AS $$
+    BEGIN
+        PERFORM pg_advisory_xact_lock(%(lock_class)s, locked.key_hash)
+        FROM (
+            SELECT DISTINCT hashtext(concat_ws('|', k.event_id, k.bet_type_id, k.market_description, k.name,
+                k.point_key)) AS key_hash
+            FROM (""" + CHANGED_TOP_OUTCOMES + """) k
+            ORDER BY key_hash
+        ) locked;
+
+        WITH changed AS (""" + CHANGED_TOP_OUTCOMES + """),
+        removed AS (
+            DELETE FROM top_universal_outcomes t
+            USING changed c
+            WHERE t.event_id = c.event_id
+            AND t.bet_type_id = c.bet_type_id
+            AND t.market_description = c.market_description
+            AND t.name = c.name
+            AND NOT (t.point_key IS DISTINCT FROM c.point_key)
+        )
+        INSERT INTO top_universal_outcomes
+            (event_id, bet_type_id, market_description, name, point_key, rank,
+            outcome_id, description, market_id, price, point, bookmaker_key)
+        SELECT * FROM (
+            SELECT c.event_id, c.bet_type_id, c.market_description, c.name, c.point_key,
+                row_number() OVER (PARTITION BY c.event_id, c.bet_type_id, c.market_description, c.name, c.point_key
+                    ORDER BY o.price DESC, m.bookmaker_key, o.outcome_id) AS rank,
+                o.outcome_id, o.description, o.market_id, o.price, o.point, m.bookmaker_key
+            FROM changed c
+            JOIN markets m ON m.event_id = c.event_id
+                AND m.bet_type_id = c.bet_type_id
+                AND coalesce(m.description, '') = c.market_description
+            JOIN outcomes o ON o.market_id = m.market_id
+                AND o.name = c.name
+                AND NOT (round(o.point * %(point_scale)s)::integer IS DISTINCT FROM c.point_key)
+            WHERE o.price IS NOT NULL
+        ) ranked
+        WHERE ranked.rank <= %(top_books)s;
+        RETURN NULL;
+    END;
+    $$;
+
+    CREATE OR REPLACE TRIGGER outcomes_insert_top_odds AFTER INSERT ON outcomes
+    REFERENCING NEW TABLE AS changed_outcomes
+    FOR EACH STATEMENT EXECUTE FUNCTION refresh_top_universal_outcomes();
+    CREATE OR REPLACE TRIGGER outcomes_update_top_odds AFTER UPDATE ON outcomes
+    REFERENCING NEW TABLE AS changed_outcomes
+    FOR EACH STATEMENT EXECUTE FUNCTION refresh_top_universal_outcomes();
+    CREATE OR REPLACE TRIGGER outcomes_delete_top_odds AFTER DELETE ON outcomes
+    REFERENCING OLD TABLE AS changed_outcomes
+    FOR EACH STATEMENT EXECUTE FUNCTION refresh_top_universal_outcomes();
+"""
+
+# the first key of the advisory locks taken on composite outcomes, keeping them apart from other advisory locks
+TOP_UNIVERSAL_OUTCOMES_LOCK_CLASS = 5705
+
 def prepareUniversalOutcomeTopOdds():
+    """Create the trigger maintained top_universal_outcomes table, or replace an older version of it, run by migrate.py.
+
+    Once created the table is kept up to date by every write to outcomes, so nothing is refreshed here.
+    """
     conn = get_connection()
     cur = conn.cursor()
-    if materialized_view_exists(cur, "universal_outcomes"):
-        refresh_materialized_view(cur, "universal_outcomes")
-    else:
-        query = """
-            CREATE MATERIALIZED VIEW universal_outcomes AS
-            SELECT md5(concat(o1.name, m1.description, o1.point, m1.bet_type_id, m1.event_id)) AS composite_hash,
-            o1.name, o1.description,  o1.market_id, o1.price, o1.point, 
-            m1.bookmaker_key, m1.description AS market_description, m1.event_id, m1.bet_type_id
-            FROM outcomes o1
-            JOIN markets m1 ON o1.market_id = m1.market_id;
-            CREATE INDEX idx_universal_outcomes_hash ON universal_outcomes (composite_hash); 
-        """
-        cur.execute(query)
-        conn.commit()
+    params = {"point_scale": schemas.POINT_SCALE, "top_books": schemas.TOP_BOOKS,
+              "lock_class": TOP_UNIVERSAL_OUTCOMES_LOCK_CLASS}
+    # older databases have these as materialized views, a table keeping only the best quote of every outcome,
+    # or a table copying the last_update of the markets
     if materialized_view_exists(cur, "top_universal_outcomes"):
-        refresh_materialized_view(cur, "top_universal_outcomes")
-    else:
-        query = """
-            CREATE MATERIALIZED VIEW top_universal_outcomes AS
-            SELECT tuo.* FROM universal_outcomes tuo
-            JOIN (
-                SELECT composite_hash, MAX(price) as maxprice
-                FROM universal_outcomes
-                GROUP BY composite_hash
-            ) top 
-            ON tuo.composite_hash = top.composite_hash and tuo.price = top.maxprice;
-            CREATE INDEX idx__top_universal_outcomes_hash ON universal_outcomes (composite_hash); 
-        """
-        cur.execute(query)
-        conn.commit()
+        cur.execute("DROP MATERIALIZED VIEW top_universal_outcomes;")
+    if materialized_view_exists(cur, "universal_outcomes"):
+        cur.execute("DROP MATERIALIZED VIEW universal_outcomes;")
+    if table_exists(cur, "top_universal_outcomes") and (not column_exists(cur, "top_universal_outcomes", "rank")
+                                                        or column_exists(cur, "top_universal_outcomes", "last_update")):
+        cur.execute("DROP TABLE top_universal_outcomes;")
+    # the table is filled and its triggers created in one transaction, the lock keeps writes to outcomes out until both are
+    cur.execute("LOCK TABLE outcomes IN SHARE ROW EXCLUSIVE MODE;")
+    cur.execute(TOP_UNIVERSAL_OUTCOMES_TRIGGERS if table_exists(cur, "top_universal_outcomes")
+                else TOP_UNIVERSAL_OUTCOMES_DDL + TOP_UNIVERSAL_OUTCOMES_TRIGGERS, params)
+    conn.commit()
     cur.close()
     release_connection(conn)
 
+MARKET_UPDATES_CHANNEL = "market_updates"
+
+# notifications sent in one transaction are merged, so a scan notifies once per committed batch of markets
+MARKET_UPDATES_DDL = """
+    CREATE OR REPLACE FUNCTION notify_market_updates() RETURNS trigger
+    LANGUAGE plpgsql AS $$
+    BEGIN
+        PERFORM pg_notify('""" + MARKET_UPDATES_CHANNEL + """', '');
+        RETURN NULL;
+    END;
+    $$;
+
+    CREATE OR REPLACE TRIGGER markets_notify_updates
+    AFTER INSERT OR UPDATE ON markets
+    FOR EACH STATEMENT EXECUTE FUNCTION notify_market_updates();
+    """
+
+def prepareMarketNotifications():
+    """Create the trigger notifying MARKET_UPDATES_CHANNEL whenever markets are written, run by migrate.py."""
+    conn = get_connection()
+    cur = conn.cursor()
+    cur.execute(MARKET_UPDATES_DDL)
+    conn.commit()
+    cur.close()
+    release_connection(conn)
+
+def listenMarketUpdates() -> connection:
+    """Open a dedicated connection listening to MARKET_UPDATES_CHANNEL.
+
+    It is kept out of the pool as it has to stay in autocommit mode for the notifications to arrive.
+    """
+    conn = psycopg2.connect(user=db_params['user'], password=db_params['password'], host=db_params['host'],
+                            port=db_params['port'], database=db_params['database'], options=SESSION_OPTIONS)
+    conn.set_session(autocommit=True)
+    cur = conn.cursor()
+    cur.execute(sql.SQL("LISTEN {};").format(sql.Identifier(MARKET_UPDATES_CHANNEL)))
+    cur.close()
+    return conn
+
+def waitForMarketUpdates(conn : connection, timeout : float) -> bool:
+    """Wait up to timeout seconds for a notification on the listening conn, return whether one arrived."""
+    if len(conn.notifies) == 0 and select.select([conn], [], [], timeout) == ([], [], []):
+        return False
+    conn.poll()
+    received = len(conn.notifies) > 0
+    conn.notifies.clear()
+    return received
+
+def outcomeKeyCondition(key : schemas.OutcomeKey, alias : str = "tuo") -> tuple[str, list]:
+    """Return an index friendly WHERE condition and its parameters matching one composite outcome."""
+    condition = f"""
+        {alias}.event_id = %s
+        AND {alias}.bet_type_id = %s
+        AND {alias}.market_description = %s
+        AND {alias}.name = %s
+        """
+    params : list = [key.event_id, key.bet_type_id, key.market_description, key.name]
+    if key.point_key is None:
+        condition += f"AND {alias}.point_key IS NULL"
+    else:
+        condition += f"AND {alias}.point_key = %s"
+        params.append(key.point_key)
+    return condition, params
+
+def eligibleBookCondition(eligibility : schemas.UserEligibility | None = None, updated_after : Optional[datetime] = None,
+                          alias : str = "tuo", market_alias : str = "m") -> tuple[str, list]:
+    """Return a WHERE condition keeping the quotes a user can bet on, in markets updated after updated_after."""
+    condition = "TRUE"
+    params : list = []
+    if eligibility is not None and eligibility.bookmakers is not None:
+        condition += f" AND {alias}.bookmaker_key = ANY(%s)"
+        params.append(sorted(eligibility.bookmakers))
+    if eligibility is not None and eligibility.categories is not None:
+        condition += f" AND {alias}.event_id IN (SELECT e.event_id FROM events e WHERE e.category_id = ANY(%s))"
+        params.append(sorted(eligibility.categories))
+    if updated_after is not None:
+        condition += f" AND {market_alias}.last_update > %s"
+        params.append(updated_after)
+    return condition, params
+
 def getUniversalOutcomeTopOdds(event : schemas.Event,
                             bet_type_id : int,
                             name : str = "",
-                            user_id : Optional[str] = None,
                             point : Optional[float] = None,
-                            description : Optional[str] = None
-                            ): 
+                            description : Optional[str] = None,
+                            user_id : Optional[int] = None,
+                            updated_after : Optional[datetime] = None,
+                            ) -> tuple[schemas.Outcome | None, str | None]:
+    """Return the best quote of an outcome the user can bet on and its bookmaker, falling back along the ranking
+    of top_universal_outcomes, (None, None) if none of the ranked quotes is eligible."""
     conn = get_connection()
-    cur = conn.cursor() 
-    point_str = (str(int(point)) if point.is_integer() else str(point)) if point is not None else ''
-    concatenated_string = f"{name or ''}{description or ''}{point_str}{bet_type_id}{event.event_id or ''}"
-    md5_hash = hashlib.md5(concatenated_string.encode('utf-8')).hexdigest()
-    query = """
+    cur = conn.cursor()
+    key = schemas.OutcomeKey.of(event.event_id, bet_type_id, description, name, point)
+    condition, params = outcomeKeyCondition(key)
+    eligible, eligible_params = eligibleBookCondition(getUserEligibility(user_id), updated_after)
+    cur.execute(
+        f"""
         SELECT tuo.name, tuo.description, tuo.market_id, tuo.price, tuo.point, tuo.bookmaker_key
         FROM top_universal_outcomes tuo
-        WHERE tuo.composite_hash = %s
+        JOIN markets m ON m.market_id = tuo.market_id
+        WHERE {condition}
+        AND {eligible}
+        ORDER BY tuo.rank
         LIMIT 1
-    """
-    params = (md5_hash,)
-    """
-        params = {"user_id": user_id,
-            "bet_type_id": int(bet_type_id),
-            "description": description,
-            "name": name,
-            "point": point,
-            "event_id": event.event_id}
-    """
+        """,
+        params + eligible_params,
+    )
+    row = cur.fetchone()
+    conn.commit()
+    cur.close()
+    release_connection(conn)
+    return (tupleToOutcome(row), row[5]) if row is not None else (None, None)
+
+def getUniversalTopOddsForEvents(event_ids : list[str], user_id : Optional[int] = None,
+                                 updated_after : Optional[datetime] = None) \
+        -> dict[schemas.OutcomeKey, tuple[schemas.Outcome, str]]:
+    """Return the best quote the user can bet on and its bookmaker for every composite outcome of the given events."""
+    if len(event_ids) == 0:
+        return {}
+    conn = get_connection()
+    cur = conn.cursor()
+    eligible, eligible_params = eligibleBookCondition(getUserEligibility(user_id), updated_after)
+    cur.execute(
+        f"""
+        SELECT DISTINCT ON (tuo.event_id, tuo.bet_type_id, tuo.market_description, tuo.name, tuo.point_key)
+        tuo.event_id, tuo.bet_type_id, tuo.market_description, tuo.name, tuo.point_key,
+        tuo.name, tuo.description, tuo.market_id, tuo.price, tuo.point, tuo.bookmaker_key
+        FROM top_universal_outcomes tuo
+        JOIN markets m ON m.market_id = tuo.market_id
+        WHERE tuo.event_id = ANY(%s::uuid[])
+        AND {eligible}
+        ORDER BY tuo.event_id, tuo.bet_type_id, tuo.market_description, tuo.name, tuo.point_key, tuo.rank
+        """,
+        [list(map(str, event_ids))] + eligible_params,
+    )
+    rows = cur.fetchall()
+    conn.commit()
+    cur.close()
+    release_connection(conn)
+    return {schemas.OutcomeKey(str(row[0]), int(row[1]), row[2], row[3], row[4]): (tupleToOutcome(row[5:10]), row[10])
+            for row in rows}
+
+def getUniversalTopBooksForEvents(event_ids : list[str]) \
+        -> dict[schemas.OutcomeKey, list[tuple[float, str, datetime]]]:
+    """Return the ranked (price, bookmaker, last_update) quotes top_universal_outcomes keeps of every composite outcome
+    of the given events, best first."""
+    if len(event_ids) == 0:
+        return {}
+    conn = get_connection()
+    cur = conn.cursor()
+    cur.execute(
+        """
+        SELECT tuo.event_id, tuo.bet_type_id, tuo.market_description, tuo.name, tuo.point_key,
+        tuo.price, tuo.bookmaker_key, m.last_update
+        FROM top_universal_outcomes tuo
+        JOIN markets m ON m.market_id = tuo.market_id
+        WHERE tuo.event_id = ANY(%s::uuid[])
+        ORDER BY tuo.event_id, tuo.bet_type_id, tuo.market_description, tuo.name, tuo.point_key, tuo.rank
+        """,
+        [list(map(str, event_ids))],
+    )
+    rows = cur.fetchall()
+    conn.commit()
+    cur.close()
+    release_connection(conn)
+    books : dict[schemas.OutcomeKey, list[tuple[float, str, datetime]]] = {}
+    for row in rows:
+        key = schemas.OutcomeKey(str(row[0]), int(row[1]), row[2], row[3], row[4])
+        books.setdefault(key, []).append((float(row[5]), row[6], row[7]))
+    return books
+
+user_eligibilities : dict[int, schemas.UserEligibility] | None = None
+_user_eligibilities_lock = threading.Lock()
 
+def loadUserEligibilities() -> dict[int, schemas.UserEligibility]:
+    """Read what every user can bet on with one query per user table and cache it for getUserEligibility.
+
+    A user's categories are their own categories and every category of their category groups.
+    Users without bookmakers or categories of their own can use them all.
+    """
+    global user_eligibilities
+    conn = get_connection()
+    cur = conn.cursor()
+    cur.execute("SELECT user_id FROM users")
+    eligibilities = {row[0]: schemas.UserEligibility(user_id=row[0]) for row in cur.fetchall()}
+    cur.execute("SELECT user_id, bookmaker_key FROM user_bookmakers")
+    for user_id, bookmaker_key in cur.fetchall():
+        eligibility = eligibilities.setdefault(user_id, schemas.UserEligibility(user_id=user_id))
+        eligibility.bookmakers = (eligibility.bookmakers or set()) | {bookmaker_key}
     cur.execute(
-        query, params
+        """
+        SELECT uc.user_id, uc.category_id FROM user_categories uc
+        UNION
+        SELECT ucg.user_id, c.category_id FROM user_category_groups ucg
+        JOIN categories c ON c.category_group_id = ucg.category_group_id
+        """
     )
-    #print(query, params)
-    row = cur.fetchone()
-    bookmaker = row[5] if row is not None else None
+    for user_id, category_id in cur.fetchall():
+        eligibility = eligibilities.setdefault(user_id, schemas.UserEligibility(user_id=user_id))
+        eligibility.categories = (eligibility.categories or set()) | {category_id}
+    conn.commit()
     cur.close()
     release_connection(conn)
-    return tupleToOutcome(row) if row is not None else None, bookmaker
+    with _user_eligibilities_lock:
+        user_eligibilities = eligibilities
+    return eligibilities
 
+def getUserEligibility(user_id : Optional[int]) -> schemas.UserEligibility | None:
+    """Return what a user can bet on, None for no user. Loaded once for all users by loadUserEligibilities."""
+    if user_id is None:
+        return None
+    eligibilities = user_eligibilities if user_eligibilities is not None else loadUserEligibilities()
+    return eligibilities.get(user_id, schemas.UserEligibility(user_id=user_id))
+
+def getOddsSnapshot(event_ids : list[str], bet_type_ids : list[int] | None = None) \
+        -> list[tuple[str, int, str, float | None, str, float, str, datetime]]:
+    """Return every priced outcome of the given events as (event_id, bet_type_id, market_description, point, name,
+    price, bookmaker_key, last_update) rows, the input of odds_engine.OddsSnapshot."""
+    if len(event_ids) == 0:
+        return []
+    conn = get_connection()
+    cur = conn.cursor()
+    params : list = [list(map(str, event_ids))]
+    query = """
+        SELECT m.event_id, m.bet_type_id, coalesce(m.description, ''), o.point, o.name, o.price, m.bookmaker_key,
+        m.last_update
+        FROM outcomes o
+        JOIN markets m ON o.market_id = m.market_id
+        WHERE m.event_id = ANY(%s::uuid[])
+        AND o.price IS NOT NULL
+        """
+    if bet_type_ids is not None:
+        query += " AND m.bet_type_id = ANY(%s)"
+        params.append([int(bet_type_id) for bet_type_id in bet_type_ids])
+    cur.execute(query, params)
+    rows = cur.fetchall()
+    conn.commit()
+    cur.close()
+    release_connection(conn)
+    return [(str(row[0]), int(row[1]), row[2], row[3], row[4], float(row[5]), row[6], row[7]) for row in rows]
 
+def getChangedEventIds(event_ids : list[str], since : datetime | None = None) -> dict[str, datetime]:
+    """Return the latest markets.last_update of every event with a market updated after since,
+    of every event with markets when since is None."""
+    if len(event_ids) == 0:
+        return {}
+    conn = get_connection()
+    cur = conn.cursor()
+    params : list = [list(map(str, event_ids))]
+    query = """
+        SELECT m.event_id, max(m.last_update)
+        FROM markets m
+        WHERE m.event_id = ANY(%s::uuid[])
+        """
+    if since is not None:
+        query += " AND m.last_update > %s"
+        params.append(since)
+    query += " GROUP BY m.event_id"
+    cur.execute(query, params)
+    rows = cur.fetchall()
+    conn.commit()
+    cur.close()
+    release_connection(conn)
+    return {str(row[0]): row[1] for row in rows}
 
 def getBookmakerOutcome(event : schemas.Event,
                         bookmaker: str,
@@ -1022,3 +1738,50 @@ def tupleToOutcome(tuple):
         price=tuple[3],
         point=tuple[4],
     )
+
+OPPORTUNITIES_DDL = """
+    CREATE TABLE IF NOT EXISTS opportunities (
+        opportunity_id BIGSERIAL PRIMARY KEY,
+        found_at TIMESTAMPTZ NOT NULL DEFAULT now(),
+        info_type SMALLINT NOT NULL,
+        change TEXT,
+        user_id INTEGER,
+        event_id UUID NOT NULL,
+        bet_type_id INTEGER NOT NULL,
+        description TEXT,
+        edge REAL,
+        probability REAL,
+        opportunity JSONB NOT NULL
+    );
+
+    CREATE INDEX IF NOT EXISTS ix_opportunities_found_at ON opportunities (found_at);
+    CREATE INDEX IF NOT EXISTS ix_opportunities_event ON opportunities (event_id, bet_type_id);
+    """
+
+def prepareOpportunities():
+    """Create the opportunities table written by sinks.DatabaseSink, run by migrate.py."""
+    conn = get_connection()
+    cur = conn.cursor()
+    cur.execute(OPPORTUNITIES_DDL)
+    conn.commit()
+    cur.close()
+    release_connection(conn)
+
+def addOpportunities(rows : list[tuple]):
+    """Insert (info_type, change, user_id, event_id, bet_type_id, description, edge, probability, opportunity json) rows."""
+    if len(rows) == 0:
+        return
+    conn = get_connection()
+    cur = conn.cursor()
+    extras.execute_values(
+        cur,
+        """
+        INSERT INTO opportunities (info_type, change, user_id, event_id, bet_type_id, description, edge, probability, opportunity)
+        VALUES %s
+        """,
+        rows,
+    )
+    conn.commit()
+    cur.close()
+    release_connection(conn)
+
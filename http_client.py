@@ -0,0 +1,84 @@
+from __future__ import annotations
+import asyncio
+import http.cookiejar
+import importlib.util
+import weakref
+from typing import Any
+from urllib.parse import urlsplit
+
+import httpx
+
+import profiling
+
+TIMEOUT = httpx.Timeout(30., connect=10.)
+LIMITS = httpx.Limits(max_connections=100, max_keepalive_connections=20, keepalive_expiry=30.)
+# requests in flight to one host, a sweep of a league sends hundreds of small requests to the same API
+PER_HOST_LIMIT = 10
+# HTTP/2 needs the h2 package (httpx[http2]), brotli responses are decoded by httpx when brotli is installed
+HTTP2 = importlib.util.find_spec("h2") is not None
+
+def proxyUrl(proxy_dict : dict[str, str] | None) -> str | None:
+    """Return the proxy of a requests style {"http": ..., "https": ...} dict."""
+    if proxy_dict is None:
+        return None
+    return proxy_dict.get("https") or proxy_dict.get("http")
+
+class _LoopClient():
+    __slots__ = ("client", "host_limits")
+
+    def __init__(self, client : httpx.AsyncClient):
+        self.client = client
+        self.host_limits : dict[str, asyncio.Semaphore] = {}
+
+class AsyncHttpClient():
+    """Keep-alive pooled async HTTP client shared by the requests of a wrapper.
+
+    At most per_host_limit requests are in flight to a host at a time, the others wait for a free slot.
+    Cookies set with setCookies, like the ones a browser collected, are sent with every request.
+    httpx clients can't be shared between event loops, so a wrapper run again under a new loop gets a new client
+    on the same cookies.
+    """
+    def __init__(self, headers : dict[str, str] | None = None, proxy : str | None = None,
+                 per_host_limit : int = PER_HOST_LIMIT, timeout : httpx.Timeout = TIMEOUT):
+        self.headers = dict(headers or {})
+        self.proxy = proxy
+        self.per_host_limit = per_host_limit
+        self.timeout = timeout
+        self.cookies = http.cookiejar.CookieJar()
+        self.loop_clients : weakref.WeakKeyDictionary[asyncio.AbstractEventLoop, _LoopClient] = weakref.WeakKeyDictionary()
+
+    def setCookies(self, cookies : list[http.cookiejar.Cookie]):
+        for cookie in cookies:
+            self.cookies.set_cookie(cookie)
+
+    def loopClient(self) -> _LoopClient:
+        loop = asyncio.get_running_loop()
+        loop_client = self.loop_clients.get(loop)
+        if loop_client is None:
+            loop_client = _LoopClient(httpx.AsyncClient(headers=self.headers, cookies=self.cookies, proxy=self.proxy,
+                                                        timeout=self.timeout, limits=LIMITS, http2=HTTP2))
+            self.loop_clients[loop] = loop_client
+        return loop_client
+
+    async def request(self, method : str, url : str, **kwargs : Any) -> httpx.Response:
+        """Send a request with the httpx.AsyncClient.request arguments, timed as the fetch stage."""
+        loop_client = self.loopClient()
+        host = urlsplit(url).netloc
+        limit = loop_client.host_limits.get(host)
+        if limit is None:
+            limit = loop_client.host_limits.setdefault(host, asyncio.Semaphore(self.per_host_limit))
+        async with limit:
+            with profiling.stage("fetch"):
+                return await loop_client.client.request(method, url, **kwargs)
+
+    async def get(self, url : str, **kwargs : Any) -> httpx.Response:
+        return await self.request("GET", url, **kwargs)
+
+    async def post(self, url : str, **kwargs : Any) -> httpx.Response:
+        return await self.request("POST", url, **kwargs)
+
+    async def aclose(self):
+        """Close the client of the running event loop."""
+        loop_client = self.loop_clients.pop(asyncio.get_running_loop(), None)
+        if loop_client is not None:
+            await loop_client.client.aclose()
@@ -0,0 +1,70 @@
+from __future__ import annotations
+import argparse
+import statistics
+import subprocess
+import sys
+
+import wrapper_registry
+
+# entry points and the modules they load first, the wrappers are timed on their own
+MODULES = ["schemas", "odds_engine", "database_connector", "controller", "sinks", "betinfo", "runscan", "bot",
+           *dict.fromkeys(path.split(":")[0] for path in wrapper_registry.WRAPPER_PATHS.values())]
+# third party stacks only the scrapers or the bot need
+HEAVY_MODULES = ("nodriver", "lxml", "requests", "py_clob_client", "spacy", "matplotlib", "pandas", "telegram")
+
+IMPORT_SCRIPT = """
+import sys, time
+start = time.perf_counter()
+import {module}
+print("import_benchmark", time.perf_counter() - start, ",".join(name for name in {heavy!r} if name in sys.modules))
+"""
+
+def measureImport(module : str, repeat : int) -> tuple[list[float], list[str], str | None]:
+    """Import module in repeat fresh interpreters.
+
+    Returns the import times in seconds, the HEAVY_MODULES it loaded and the last error line if it failed.
+    """
+    seconds = []
+    heavy : list[str] = []
+    for _ in range(repeat):
+        result = subprocess.run([sys.executable, "-c", IMPORT_SCRIPT.format(module=module, heavy=HEAVY_MODULES)],
+                                capture_output=True, text=True)
+        if result.returncode != 0:
+            lines = result.stderr.strip().splitlines()
+            return seconds, heavy, lines[-1] if len(lines) > 0 else f"exit code {result.returncode}"
+        # modules may print while importing, the measurement is the last line
+        _, elapsed, *loaded = result.stdout.strip().splitlines()[-1].split(" ")
+        seconds.append(float(elapsed))
+        heavy = [name for name in "".join(loaded).split(",") if name != ""]
+    return seconds, heavy, None
+
+def slowestImports(module : str, top : int) -> list[tuple[int, str]]:
+    """Return the top (cumulative microseconds, module) imports of module according to python -X importtime."""
+    result = subprocess.run([sys.executable, "-X", "importtime", "-c", f"import {module}"], capture_output=True, text=True)
+    imports = []
+    for line in result.stderr.splitlines():
+        if not line.startswith("import time:") or "cumulative" in line:
+            continue
+        _, cumulative, name = line.removeprefix("import time:").split("|")
+        imports.append((int(cumulative), name.strip()))
+    return sorted(imports, reverse=True)[:top]
+
+def main():
+    parser = argparse.ArgumentParser(description="Measure how long the entry points of the project take to import")
+    parser.add_argument("modules", nargs="*", default=MODULES)
+    parser.add_argument("-r", "--repeat", type=int, default=5, help="fresh interpreters per module")
+    parser.add_argument("--detail", type=int, default=0, metavar="N",
+                        help="also list the N slowest imports of every module from python -X importtime")
+    args = parser.parse_args()
+    print(f"{'module':<22} {'median ms':>10} {'min ms':>8}  heavy modules loaded")
+    for module in args.modules:
+        seconds, heavy, error = measureImport(module, args.repeat)
+        if error is not None:
+            print(f"{module:<22} {'failed':>10} {'':>8}  {error}")
+            continue
+        print(f"{module:<22} {statistics.median(seconds) * 1000:>10.1f} {min(seconds) * 1000:>8.1f}  {', '.join(heavy) or '-'}")
+        for cumulative, name in slowestImports(module, args.detail) if args.detail > 0 else []:
+            print(f"    {cumulative / 1000:>10.1f} ms {name}")
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,28 @@
+import argparse
+import logging
+
+import database_connector
+
+def main():
+    """Apply the schema changes the analysis depends on to the database of db_config.ini.
+
+    Run it once after importing betting_db.sql and again after updating, every step is idempotent. It takes
+    locks on outcomes and markets the scrapers write to, so it is run while no scan is in progress.
+    betinfo, runscan and the sinks never change the schema themselves.
+    """
+    logging.basicConfig(level=logging.INFO)
+    parser = argparse.ArgumentParser(description="Create or update the tables and triggers used by betinfo")
+    parser.parse_args()
+    database_connector.connectDb()
+    try:
+        logging.info("Creating the top odds table and its triggers")
+        database_connector.prepareUniversalOutcomeTopOdds()
+        logging.info("Creating the market update notifications")
+        database_connector.prepareMarketNotifications()
+        logging.info("Creating the opportunities table")
+        database_connector.prepareOpportunities()
+    finally:
+        database_connector.disconnectDb()
+
+if __name__ == '__main__':
+    main()
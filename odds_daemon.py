@@ -0,0 +1,75 @@
+from __future__ import annotations
+import logging
+import time
+from datetime import datetime
+
+import controller
+import database_connector
+import odds_engine
+import schemas
+import sinks
+from schemas import BetInfoParameters, BetInfoType
+
+class OddsDaemon():
+    """Keeps the odds of the upcoming events in an odds book and re-runs the analysis of all_params on every change.
+
+    Changes are found by polling markets.last_update every interval seconds, or as soon as a scraper commits
+    when listen is set.
+    """
+    def __init__(self, info_type : BetInfoType, all_params : list[BetInfoParameters], sink : sinks.OpportunitySink,
+                 interval : float = 5., listen : bool = False):
+        self.info_type = info_type
+        self.all_params = all_params
+        self.sink = sink
+        self.interval = interval
+        self.listen = listen
+        self.odds_book = odds_engine.OddsBook()
+        self.states = {controller.analysisStateName(info_type, params): controller.AnalysisState() for params in all_params}
+        # latest markets.last_update of every event in odds_book
+        self.event_updates : dict[str, datetime] = {}
+        self.high_water_mark : datetime | None = None
+
+    def refresh(self):
+        """Load the markets changed since the last refresh into odds_book and report the changed opportunities."""
+        events_by_category : dict[int | None, list[schemas.Event]] = {}
+        for params in self.all_params:
+            if params.category_id not in events_by_category:
+                events_by_category[params.category_id] = controller.getInfoEvents(params)
+        event_ids = list(dict.fromkeys(str(event.event_id) for events in events_by_category.values() for event in events))
+        since = self.high_water_mark - controller.INCREMENTAL_OVERLAP if self.high_water_mark is not None else None
+        updates = database_connector.getChangedEventIds(event_ids, since)
+        # the overlap returns recent updates again, only the ones not in the book yet are reloaded
+        changed_ids = {event_id for event_id, last_update in updates.items() if self.event_updates.get(event_id) != last_update}
+        window = set(event_ids)
+        self.odds_book.retain(event_ids)
+        self.event_updates = {event_id: last_update for event_id, last_update in self.event_updates.items()
+                              if event_id in window}
+        if len(changed_ids) > 0:
+            self.odds_book.update(list(changed_ids),
+                                  database_connector.getOddsSnapshot(list(changed_ids), list(odds_engine.ANALYSED_BET_TYPES)))
+            self.event_updates.update((event_id, updates[event_id]) for event_id in changed_ids)
+        if len(updates) > 0:
+            high_water_mark = max(updates.values())
+            if self.high_water_mark is None or high_water_mark > self.high_water_mark:
+                self.high_water_mark = high_water_mark
+        for params in self.all_params:
+            state = self.states[controller.analysisStateName(self.info_type, params)]
+            diff = controller.updateAnalysis(self.info_type, params, state, events_by_category[params.category_id],
+                                             changed_ids, self.odds_book)
+            for change, results in controller.diffChanges(self.info_type, diff):
+                self.sink.write(self.info_type, results, change)
+
+    def run(self):
+        conn = database_connector.listenMarketUpdates() if self.listen else None
+        try:
+            while True:
+                start = time.perf_counter()
+                self.refresh()
+                logging.debug(f"Odds book refreshed in {time.perf_counter() - start:.3f}s, {self.odds_book.eventCount()} events")
+                if conn is not None:
+                    database_connector.waitForMarketUpdates(conn, self.interval)
+                else:
+                    time.sleep(self.interval)
+        finally:
+            if conn is not None:
+                conn.close()
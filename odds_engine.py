@@ -0,0 +1,562 @@
+from __future__ import annotations
+from datetime import datetime, timezone
+import threading
+
+import numpy as np
+
+import schemas
+from schemas import BetType, DevigMethod
+
+# bet types where every outcome of a market is known, so the best prices of a market can be combined into an arb
+# or de-vigged into fair odds
+ANALYSED_BET_TYPES = (BetType.h2h, BetType.spreads, BetType.totals, BetType.asian_spreads)
+
+# point_key of outcomes without a point in the int32 point columns
+NO_POINT = np.iinfo(np.int32).min
+
+def toTimestamp(value : datetime | None) -> float:
+    """Return value as POSIX seconds, nan for None.
+
+    Naive datetimes are UTC, like markets.last_update read by the UTC sessions of database_connector.
+    """
+    if value is None:
+        return np.nan
+    if value.tzinfo is None:
+        value = value.replace(tzinfo=timezone.utc)
+    return value.timestamp()
+
+def fromTimestamp(value : float) -> datetime | None:
+    return None if np.isnan(value) else datetime.fromtimestamp(value, timezone.utc)
+
+# bookmaker_key -> bit of the bookmaker in user bookmaker masks, shared by every snapshot of the process
+bookmaker_bits : dict[str, int] = {}
+_bookmaker_bits_lock = threading.Lock()
+MAX_BOOKMAKERS = 64
+
+def bookmakerBit(bookmaker : str) -> int:
+    bit = bookmaker_bits.get(bookmaker)
+    if bit is None:
+        with _bookmaker_bits_lock:
+            bit = bookmaker_bits.get(bookmaker)
+            if bit is None:
+                if len(bookmaker_bits) == MAX_BOOKMAKERS:
+                    raise ValueError(f"More than {MAX_BOOKMAKERS} bookmakers don't fit a bookmaker mask")
+                bit = bookmaker_bits[bookmaker] = len(bookmaker_bits)
+    return bit
+
+def bookmakerMask(bookmakers : set[str] | None) -> np.uint64 | None:
+    """Return the mask with the bits of bookmakers set, None when every bookmaker is allowed."""
+    if bookmakers is None:
+        return None
+    mask = 0
+    for bookmaker in bookmakers:
+        mask |= 1 << bookmakerBit(bookmaker)
+    return np.uint64(mask)
+
+class Interner():
+    """Maps strings to dense integer codes and back."""
+    __slots__ = ("values", "codes")
+
+    def __init__(self, values : list[str] | None = None):
+        self.values : list[str] = []
+        self.codes : dict[str, int] = {}
+        for value in values or []:
+            self.code(value)
+
+    def __len__(self) -> int:
+        return len(self.values)
+
+    def code(self, value : str) -> int:
+        code = self.codes.get(value)
+        if code is None:
+            code = self.codes[value] = len(self.values)
+            self.values.append(value)
+        return code
+
+class OddsSnapshot():
+    """Columnar snapshot of outcome prices.
+
+    Every row is one bookmaker's price for one outcome. Events, markets, outcome names and bookmakers are
+    interned to integer codes, a market being (event_id, bet_type_id, market_description, point_key).
+    """
+    def __init__(self, rows : list[tuple[str, int, str, float | None, str, float, str, datetime | None]]):
+        """rows are (event_id, bet_type_id, market_description, point, name, price, bookmaker_key, last_update) tuples."""
+        events, descriptions, names, bookmakers = Interner(), Interner(), Interner(), Interner()
+        size = len(rows)
+        event = np.empty(size, dtype=np.int32)
+        bet_type = np.empty(size, dtype=np.int16)
+        description = np.empty(size, dtype=np.int32)
+        point_key = np.empty(size, dtype=np.int32)
+        name = np.empty(size, dtype=np.int32)
+        bookmaker = np.empty(size, dtype=np.int32)
+        price = np.empty(size, dtype=np.float64)
+        updated = np.empty(size, dtype=np.float64)
+        for i, (event_id, bet_type_id, market_description, point, outcome_name, outcome_price, book, last_update) \
+                in enumerate(rows):
+            event[i] = events.code(str(event_id))
+            bet_type[i] = bet_type_id
+            description[i] = descriptions.code(market_description or "")
+            point_key[i] = NO_POINT if point is None else schemas.quantizePoint(point)
+            name[i] = names.code(outcome_name)
+            bookmaker[i] = bookmakers.code(book)
+            price[i] = outcome_price
+            updated[i] = toTimestamp(last_update)
+        self.setColumns(events.values, event, bet_type, descriptions.values, description, point_key, names.values, name,
+                        bookmakers.values, bookmaker, price, updated)
+
+    @classmethod
+    def fromColumns(cls, events : list[str], event : np.ndarray, bet_type : np.ndarray, descriptions : list[str],
+                    description : np.ndarray, point_key : np.ndarray, names : list[str], name : np.ndarray,
+                    bookmakers : list[str], bookmaker : np.ndarray, price : np.ndarray,
+                    updated : np.ndarray) -> OddsSnapshot:
+        """Build a snapshot from interned columns, the code columns index the matching string lists."""
+        snapshot = cls.__new__(cls)
+        snapshot.setColumns(events, event, bet_type, descriptions, description, point_key, names, name, bookmakers,
+                            bookmaker, price, updated)
+        return snapshot
+
+    def setColumns(self, events : list[str], event : np.ndarray, bet_type : np.ndarray, descriptions : list[str],
+                   description : np.ndarray, point_key : np.ndarray, names : list[str], name : np.ndarray,
+                   bookmakers : list[str], bookmaker : np.ndarray, price : np.ndarray, updated : np.ndarray):
+        market_columns = np.stack([event, bet_type, description, point_key], axis=1).astype(np.int64)
+        if len(market_columns) > 0:
+            unique_markets, market = np.unique(market_columns, axis=0, return_inverse=True)
+            unique_groups, market_group = np.unique(unique_markets[:, :2], axis=0, return_inverse=True)
+        else:
+            unique_markets, market = np.zeros((0, 4), dtype=np.int64), np.zeros(0, dtype=np.int64)
+            unique_groups, market_group = np.zeros((0, 2), dtype=np.int64), np.zeros(0, dtype=np.int64)
+        self.market_keys : list[tuple[str, int, str, int | None]] = [
+            (events[e], b, descriptions[d], None if p == NO_POINT else p) for e, b, d, p in unique_markets.tolist()
+        ]
+        self.events : list[str] = events
+        self.event = np.asarray(event, dtype=np.int32)
+        self.names : list[str] = names
+        self.bookmakers : list[str] = bookmakers
+        self.market = market.reshape(-1).astype(np.int32)
+        self.name = np.asarray(name, dtype=np.int32)
+        self.bookmaker = np.asarray(bookmaker, dtype=np.int32)
+        self.point = np.where(point_key == NO_POINT, np.nan, point_key / schemas.POINT_SCALE)
+        self.price = np.asarray(price, dtype=np.float64)
+        # last_update of the market of every price as POSIX seconds, nan when unknown
+        self.updated = np.asarray(updated, dtype=np.float64)
+        # (event, bet type) of every market, its outcome names are the names a complete market has to offer
+        self.market_group = market_group.reshape(-1).astype(np.int32)
+        self.group_count = len(unique_groups)
+
+    def __len__(self) -> int:
+        return len(self.price)
+
+    def bookmakerBits(self) -> np.ndarray:
+        """Return the bookmaker mask bit of every row as a one bit uint64."""
+        bits = np.array([bookmakerBit(bookmaker) for bookmaker in self.bookmakers], dtype=np.uint64)
+        return np.left_shift(np.uint64(1), bits[self.bookmaker]) if len(bits) > 0 else np.zeros(len(self), dtype=np.uint64)
+
+    def eligibleRows(self, eligibility : schemas.UserEligibility | None = None, updated_after : datetime | None = None,
+                     event_categories : dict[str, int] | None = None) -> np.ndarray | None:
+        """Return a mask of the rows a user can bet on, None when every row is eligible.
+
+        Rows have to be of the user's bookmakers, updated after updated_after, and of events in the user's categories,
+        which event_categories maps the events of the snapshot to.
+        """
+        bookmaker_mask = bookmakerMask(eligibility.bookmakers) if eligibility is not None else None
+        categories = eligibility.categories if eligibility is not None else None
+        if bookmaker_mask is None and categories is None and updated_after is None:
+            return None
+        eligible = np.ones(len(self), dtype=bool)
+        if bookmaker_mask is not None:
+            eligible &= (self.bookmakerBits() & bookmaker_mask) != 0
+        if categories is not None:
+            if event_categories is None:
+                raise ValueError("event_categories are needed to filter by category")
+            event_allowed = np.array([event_categories.get(event_id) in categories for event_id in self.events], dtype=bool)
+            eligible &= event_allowed[self.event] if len(event_allowed) > 0 else False
+        if updated_after is not None:
+            with np.errstate(invalid="ignore"):
+                eligible &= self.updated > toTimestamp(updated_after)
+        return eligible
+
+    def bestRows(self, eligible : np.ndarray | None = None) -> np.ndarray:
+        """Return the row of the best price for every (market, name), ordered by market then name.
+
+        Only rows in the eligible mask are considered when it is given, so a market falls back to its next best book.
+        Equal prices go to the bookmaker first by name, so the choice doesn't depend on the order of the rows,
+        which changes as an OddsBook reuses freed slots.
+        """
+        rows = np.arange(len(self)) if eligible is None else np.nonzero(eligible)[0]
+        slot = self.market[rows].astype(np.int64) * max(len(self.names), 1) + self.name[rows]
+        bookmaker_order = np.argsort(np.argsort(np.array(self.bookmakers, dtype=object)))
+        order = np.lexsort((bookmaker_order[self.bookmaker[rows]], -self.price[rows], slot))
+        sorted_slot = slot[order]
+        first = np.ones(len(order), dtype=bool)
+        first[1:] = sorted_slot[1:] != sorted_slot[:-1]
+        return rows[order[first]]
+
+    def bookmakerRows(self, bookmaker : str) -> np.ndarray:
+        """Return the row of the best price of bookmaker for every (market, name), ordered by market then name."""
+        if bookmaker not in self.bookmakers:
+            return np.zeros(0, dtype=np.int64)
+        return self.bestRows(self.bookmaker == self.bookmakers.index(bookmaker))
+
+    def requiredNames(self) -> np.ndarray:
+        """Return for every market how many distinct names its (event, bet type) has across all markets."""
+        name_count = max(len(self.names), 1)
+        group_names = np.unique(self.market_group[self.market].astype(np.int64) * name_count + self.name)
+        per_group = np.bincount(group_names // name_count, minlength=self.group_count)
+        return per_group[self.market_group]
+
+class OddsBook():
+    """Prices of many events kept in typed arrays, one slot per (event, bet type, description, point, name, bookmaker).
+
+    Strings are interned to integer codes and points are quantized like schemas.OutcomeKey. Slots are found through
+    a hash index, so setting or removing one price is O(1), and freed slots are reused. The books quoting one outcome
+    are kept ranked by price too, for best price and top-K queries without a snapshot.
+    """
+    __slots__ = ("lock", "events", "descriptions", "names", "bookmakers", "slots", "outcome_slots", "event_slots",
+                 "free", "size", "event", "bet_type", "description", "point_key", "name", "bookmaker", "price", "updated")
+
+    INITIAL_CAPACITY = 1024
+
+    def __init__(self, capacity : int = INITIAL_CAPACITY):
+        self.lock = threading.RLock()
+        self.events = Interner()
+        self.descriptions = Interner()
+        self.names = Interner()
+        self.bookmakers = Interner()
+        # (event, bet type, description, point_key, name, bookmaker) codes -> slot
+        self.slots : dict[tuple[int, int, int, int, int, int], int] = {}
+        # (event, bet type, description, point_key, name) codes -> slots of every book quoting the outcome, best first
+        self.outcome_slots : dict[tuple[int, int, int, int, int], list[int]] = {}
+        self.event_slots : dict[int, set[int]] = {}
+        self.free : list[int] = []
+        self.size = 0
+        self.event = np.zeros(capacity, dtype=np.int32)
+        self.bet_type = np.zeros(capacity, dtype=np.int16)
+        self.description = np.zeros(capacity, dtype=np.int32)
+        self.point_key = np.zeros(capacity, dtype=np.int32)
+        self.name = np.zeros(capacity, dtype=np.int32)
+        self.bookmaker = np.zeros(capacity, dtype=np.int32)
+        self.price = np.full(capacity, np.nan, dtype=np.float64)
+        self.updated = np.full(capacity, np.nan, dtype=np.float64)
+
+    def __len__(self) -> int:
+        """Number of prices in the book."""
+        return len(self.slots)
+
+    def eventCount(self) -> int:
+        return len(self.event_slots)
+
+    def _grow(self):
+        capacity = 2 * len(self.price)
+        for column in ("event", "bet_type", "description", "point_key", "name", "bookmaker"):
+            grown = np.zeros(capacity, dtype=getattr(self, column).dtype)
+            grown[:self.size] = getattr(self, column)[:self.size]
+            setattr(self, column, grown)
+        for column in ("price", "updated"):
+            grown = np.full(capacity, np.nan, dtype=np.float64)
+            grown[:self.size] = getattr(self, column)[:self.size]
+            setattr(self, column, grown)
+
+    def _outcomeCodes(self, event_id : str, bet_type_id : int, description : str | None, point : float | None,
+                      name : str) -> tuple[int, int, int, int, int]:
+        point_key = schemas.quantizePoint(point)
+        return (self.events.code(str(event_id)), int(bet_type_id), self.descriptions.code(description or ""),
+                NO_POINT if point_key is None else point_key, self.names.code(name))
+
+    def set(self, event_id : str, bet_type_id : int, description : str | None, point : float | None, name : str,
+            price : float, bookmaker : str, last_update : datetime | None = None):
+        """Set the price bookmaker offers for an outcome."""
+        with self.lock:
+            outcome = self._outcomeCodes(event_id, bet_type_id, description, point, name)
+            key = outcome + (self.bookmakers.code(bookmaker),)
+            slot = self.slots.get(key)
+            if slot is None:
+                if len(self.free) > 0:
+                    slot = self.free.pop()
+                else:
+                    if self.size == len(self.price):
+                        self._grow()
+                    slot = self.size
+                    self.size += 1
+                self.slots[key] = slot
+                self.event_slots.setdefault(key[0], set()).add(slot)
+                (self.event[slot], self.bet_type[slot], self.description[slot], self.point_key[slot], self.name[slot],
+                 self.bookmaker[slot]) = key
+            self.price[slot] = price
+            self.updated[slot] = toTimestamp(last_update)
+            # a handful of books quote an outcome, re-inserting keeps the ranking without sorting.
+            # Equal prices are ranked by bookmaker name like OddsSnapshot.bestRows and top_universal_outcomes do
+            ranked = self.outcome_slots.setdefault(outcome, [])
+            if slot in ranked:
+                ranked.remove(slot)
+            position = 0
+            while position < len(ranked) and (self.price[ranked[position]] > price or
+                                              (self.price[ranked[position]] == price and
+                                               self.bookmakers.values[self.bookmaker[ranked[position]]] < bookmaker)):
+                position += 1
+            ranked.insert(position, slot)
+
+    def _removeSlot(self, slot : int):
+        key = (int(self.event[slot]), int(self.bet_type[slot]), int(self.description[slot]), int(self.point_key[slot]),
+               int(self.name[slot]), int(self.bookmaker[slot]))
+        del self.slots[key]
+        outcome_slots = self.outcome_slots[key[:5]]
+        outcome_slots.remove(slot)
+        if len(outcome_slots) == 0:
+            del self.outcome_slots[key[:5]]
+        self.price[slot] = np.nan
+        self.updated[slot] = np.nan
+        self.free.append(slot)
+
+    def removeEvent(self, event_id : str):
+        with self.lock:
+            event = self.events.codes.get(str(event_id))
+            for slot in self.event_slots.pop(event, ()):
+                self._removeSlot(slot)
+
+    def update(self, event_ids : list[str], rows : list[tuple[str, int, str, float | None, str, float, str, datetime | None]]):
+        """Replace the prices of event_ids with rows, which have to hold every current price of those events."""
+        with self.lock:
+            for event_id in event_ids:
+                self.removeEvent(event_id)
+            for event_id, bet_type_id, description, point, name, price, bookmaker, last_update in rows:
+                self.set(event_id, bet_type_id, description, point, name, price, bookmaker, last_update)
+
+    def retain(self, event_ids : list[str]):
+        """Drop the prices of every event not in event_ids, e.g. events that have started."""
+        keep = {self.events.codes.get(str(event_id)) for event_id in event_ids}
+        with self.lock:
+            for event in [event for event in self.event_slots if event not in keep]:
+                for slot in self.event_slots.pop(event):
+                    self._removeSlot(slot)
+
+    def topBooks(self, event_id : str, bet_type_id : int, description : str | None, point : float | None, name : str,
+                 k : int = schemas.TOP_BOOKS, bookmakers : set[str] | None = None,
+                 updated_after : datetime | None = None) -> list[tuple[float, str, datetime | None]]:
+        """Return the k best (price, bookmaker, last_update) quotes of an outcome, best first.
+
+        Only quotes of bookmakers updated after updated_after are returned when those are given.
+        """
+        after = toTimestamp(updated_after)
+        quotes = []
+        with self.lock:
+            for slot in self.outcome_slots.get(self._outcomeCodes(event_id, bet_type_id, description, point, name), ()):
+                bookmaker = self.bookmakers.values[self.bookmaker[slot]]
+                if bookmakers is not None and bookmaker not in bookmakers:
+                    continue
+                if updated_after is not None and not self.updated[slot] > after:
+                    continue
+                quotes.append((float(self.price[slot]), bookmaker, fromTimestamp(self.updated[slot])))
+                if len(quotes) == k:
+                    break
+        return quotes
+
+    def best(self, event_id : str, bet_type_id : int, description : str | None, point : float | None, name : str,
+             bookmakers : set[str] | None = None, updated_after : datetime | None = None) -> tuple[float, str] | None:
+        """Return the best eligible (price, bookmaker) quote of an outcome."""
+        quotes = self.topBooks(event_id, bet_type_id, description, point, name, 1, bookmakers, updated_after)
+        return quotes[0][:2] if len(quotes) > 0 else None
+
+    def snapshot(self, event_ids : list[str], bet_type_ids : list[int] | None = None) -> OddsSnapshot:
+        """Return the prices of event_ids, of bet_type_ids only when given, as a snapshot sharing the book's codes."""
+        with self.lock:
+            slots = [slot for event_id in event_ids
+                     for slot in self.event_slots.get(self.events.codes.get(str(event_id)), ())]
+            slots = np.array(sorted(slots), dtype=np.int64)
+            if bet_type_ids is not None and len(slots) > 0:
+                slots = slots[np.isin(self.bet_type[slots], np.array(list(map(int, bet_type_ids)), dtype=np.int16))]
+            return OddsSnapshot.fromColumns(list(self.events.values), self.event[slots], self.bet_type[slots],
+                                            list(self.descriptions.values), self.description[slots], self.point_key[slots],
+                                            list(self.names.values), self.name[slots], list(self.bookmakers.values),
+                                            self.bookmaker[slots], self.price[slots], self.updated[slots])
+
+def findArbs(snapshot : OddsSnapshot, eligible : np.ndarray | None = None) \
+        -> list[tuple[tuple[str, int, str, int | None], list[tuple[str, float | None, float, str]], float]]:
+    """Find every market whose best eligible prices add up to an implied probability below 1.
+
+    The names a complete market has are taken from every row, so ineligible books can't make a market look complete.
+    Returns (market key, [(name, point, price, bookmaker)], probability) tuples, sorted by probability.
+    """
+    if len(snapshot) == 0:
+        return []
+    valid = snapshot.price > 1.0
+    best = snapshot.bestRows(valid if eligible is None else valid & eligible)
+    market = snapshot.market[best]
+    market_count = len(snapshot.market_keys)
+    probability = np.bincount(market, weights=1. / snapshot.price[best], minlength=market_count)
+    offered = np.bincount(market, minlength=market_count)
+    arb_markets = np.nonzero((offered == snapshot.requiredNames()) & (offered >= 2) & (probability < 1.0))[0]
+    starts = np.searchsorted(market, arb_markets, side="left")
+    ends = np.searchsorted(market, arb_markets, side="right")
+    arbs = []
+    for arb_market, start, end in zip(arb_markets, starts, ends):
+        outcomes = []
+        for row in best[start:end]:
+            point = snapshot.point[row]
+            outcomes.append((
+                snapshot.names[snapshot.name[row]],
+                None if np.isnan(point) else float(point),
+                float(snapshot.price[row]),
+                snapshot.bookmakers[snapshot.bookmaker[row]],
+            ))
+        arbs.append((snapshot.market_keys[arb_market], outcomes, float(probability[arb_market])))
+    arbs.sort(key=lambda arb: arb[2])
+    return arbs
+
+# power and Shin solve for one parameter per market, Newton's method stops once every market moved less than
+# SOLVER_TOLERANCE, bisection halves the bracket SHIN_BISECTIONS times
+SOLVER_TOLERANCE = 1e-12
+SOLVER_MAX_ITERATIONS = 100
+SHIN_BISECTIONS = 60
+
+def fairProbabilities(prices : np.ndarray, markets : np.ndarray, method : DevigMethod = DevigMethod.multiplicative) \
+        -> np.ndarray:
+    """Remove the vig from the prices of complete markets.
+
+    prices are decimal odds and markets the index of the market of every price, markets being numbered from 0.
+    Returns the fair probability of every price, nan for markets the method can't de-vig.
+    """
+    prices = np.asarray(prices, dtype=np.float64)
+    markets = np.asarray(markets, dtype=np.int64)
+    if len(prices) == 0:
+        return np.zeros(0, dtype=np.float64)
+    market_count = int(markets.max()) + 1
+    implied = 1. / prices
+    overround = np.bincount(markets, weights=implied, minlength=market_count)
+    outcome_count = np.bincount(markets, minlength=market_count)
+    if method == DevigMethod.multiplicative:
+        probabilities = implied / overround[markets]
+    elif method == DevigMethod.additive:
+        probabilities = implied - ((overround - 1.) / outcome_count)[markets]
+        # a longshot can't carry its share of the margin, the market is left out rather than given a negative price
+        negative = np.bincount(markets, weights=probabilities <= 0, minlength=market_count) > 0
+        probabilities[negative[markets]] = np.nan
+    elif method == DevigMethod.power:
+        probabilities = implied ** _solvePowerExponent(implied, markets, market_count)[markets]
+    elif method == DevigMethod.shin:
+        probabilities = _shinProbabilities(implied, markets, overround)
+    else:
+        raise ValueError(f"Unknown de-vig method {method}")
+    probabilities[(prices <= 1.)] = np.nan
+    invalid = np.bincount(markets, weights=np.isnan(probabilities), minlength=market_count) > 0
+    probabilities[invalid[markets]] = np.nan
+    return probabilities
+
+def _solvePowerExponent(implied : np.ndarray, markets : np.ndarray, market_count : int) -> np.ndarray:
+    """Find k per market so that the implied probabilities raised to k add up to 1, with Newton's method.
+
+    The sum is convex and decreasing in k, so the iteration converges monotonically from k = 1.
+    """
+    k = np.ones(market_count, dtype=np.float64)
+    log_implied = np.log(np.clip(implied, 1e-300, None))
+    for _ in range(SOLVER_MAX_ITERATIONS):
+        powered = implied ** k[markets]
+        value = np.bincount(markets, weights=powered, minlength=market_count) - 1.
+        slope = np.bincount(markets, weights=powered * log_implied, minlength=market_count)
+        step = np.divide(value, slope, out=np.zeros(market_count), where=slope != 0)
+        k -= step
+        if np.all(np.abs(step) < SOLVER_TOLERANCE):
+            break
+    return k
+
+def _shinProbabilities(implied : np.ndarray, markets : np.ndarray, overround : np.ndarray) -> np.ndarray:
+    """De-vig with Shin's model, bisecting the share z of insider money per market.
+
+    The fair probabilities add up to more than 1 at z = 0 and fall as z grows, so the root is bracketed by [0, 1).
+    Markets without a margin keep z = 0 and are normalized like the multiplicative method.
+    """
+    market_count = len(overround)
+    low = np.zeros(market_count, dtype=np.float64)
+    high = np.ones(market_count, dtype=np.float64)
+    scaled = implied ** 2 / overround[markets]
+    for _ in range(SHIN_BISECTIONS):
+        z = (low + high) / 2.
+        zm = z[markets]
+        total = np.bincount(markets, weights=np.sqrt(zm ** 2 + 4. * (1. - zm) * scaled) - zm, minlength=market_count) \
+            / (2. * (1. - z))
+        above = total > 1.
+        low = np.where(above, z, low)
+        high = np.where(above, high, z)
+    zm = low[markets]
+    probabilities = (np.sqrt(zm ** 2 + 4. * (1. - zm) * scaled) - zm) / (2. * (1. - zm))
+    return probabilities / np.bincount(markets, weights=probabilities, minlength=market_count)[markets]
+
+def getKellyCriterion(price : np.ndarray | float, probability : np.ndarray | float, fraction : float = 0.25) \
+        -> np.ndarray | float:
+    """Fractional Kelly stake for decimal odds price when the outcome wins with probability."""
+    return (probability - (1. - probability) / (price - 1.)) * fraction
+
+MIN_EDGE = 1.01
+MIN_KELLY = 0.005
+
+def sharpFairProbabilities(snapshot : OddsSnapshot, sharp_book : str,
+                           method : DevigMethod = DevigMethod.multiplicative) -> tuple[np.ndarray, np.ndarray]:
+    """De-vig every market sharp_book offers completely.
+
+    Returns the sharp rows and their fair probabilities, ordered by market then name. They don't depend on the user,
+    so one result can price the snapshot for many users.
+    """
+    empty = (np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.float64))
+    if len(snapshot) == 0:
+        return empty
+    sharp = snapshot.bookmakerRows(sharp_book)
+    sharp = sharp[snapshot.price[sharp] > 1.0]
+    if len(sharp) == 0:
+        return empty
+    market_count = len(snapshot.market_keys)
+    sharp_markets = snapshot.market[sharp]
+    offered = np.bincount(sharp_markets, minlength=market_count)
+    complete = (offered == snapshot.requiredNames()) & (offered >= 2)
+    sharp = sharp[complete[sharp_markets]]
+    if len(sharp) == 0:
+        return empty
+    # renumber the complete markets from 0 so the solvers only iterate over them
+    _, dense_markets = np.unique(snapshot.market[sharp], return_inverse=True)
+    return sharp, fairProbabilities(snapshot.price[sharp], dense_markets.reshape(-1), method)
+
+def findPositiveEVs(snapshot : OddsSnapshot, sharp_book : str, method : DevigMethod = DevigMethod.multiplicative,
+                    min_edge : float = MIN_EDGE, min_kelly : float = MIN_KELLY, kelly_fraction : float = 0.25,
+                    eligible : np.ndarray | None = None, fair : tuple[np.ndarray, np.ndarray] | None = None) \
+        -> list[tuple[tuple[str, int, str, int | None], str, float | None, float, str, float, float, float]]:
+    """Price every outcome against the de-vigged odds of sharp_book and return the ones with an edge.
+
+    Only markets the sharp book offers completely are priced, every (market, name) is compared to its best price
+    among the eligible rows. The sharp book is the reference for the fair odds whether it is eligible or not,
+    fair can pass them in from sharpFairProbabilities when pricing the same snapshot many times.
+    Returns (market key, name, point, price, bookmaker, fair odds, edge, kelly criterion) tuples,
+    sorted by edge from the highest.
+    """
+    sharp, probabilities = fair if fair is not None else sharpFairProbabilities(snapshot, sharp_book, method)
+    if len(sharp) == 0:
+        return []
+    name_count = max(len(snapshot.names), 1)
+    sharp_slots = snapshot.market[sharp].astype(np.int64) * name_count + snapshot.name[sharp]
+    best = snapshot.bestRows(eligible)
+    if len(best) == 0:
+        return []
+    best_slots = snapshot.market[best].astype(np.int64) * name_count + snapshot.name[best]
+    # both are sorted by slot, a sharp slot lacks a best row when no eligible book quotes it
+    positions = np.minimum(np.searchsorted(best_slots, sharp_slots), len(best) - 1)
+    quoted = best_slots[positions] == sharp_slots
+    sharp_slots, probabilities, positions = sharp_slots[quoted], probabilities[quoted], positions[quoted]
+    rows = best[positions]
+    prices = snapshot.price[rows]
+    edges = prices * probabilities
+    kelly = getKellyCriterion(prices, probabilities, kelly_fraction)
+    with np.errstate(invalid="ignore"):
+        selected = np.nonzero((edges > min_edge) & (np.round(kelly, 3) > min_kelly))[0]
+    selected = selected[np.argsort(-edges[selected], kind="stable")]
+    bets = []
+    for index in selected:
+        row = rows[index]
+        point = snapshot.point[row]
+        bets.append((
+            snapshot.market_keys[snapshot.market[row]],
+            snapshot.names[snapshot.name[row]],
+            None if np.isnan(point) else float(point),
+            float(snapshot.price[row]),
+            snapshot.bookmakers[snapshot.bookmaker[row]],
+            float(1. / probabilities[index]),
+            float(edges[index]),
+            float(kelly[index]),
+        ))
+    return bets
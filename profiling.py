@@ -0,0 +1,127 @@
+from __future__ import annotations
+import contextlib
+import cProfile
+import functools
+import inspect
+import pstats
+import sys
+import threading
+import time
+from contextvars import ContextVar
+from typing import Any, Callable, TextIO
+
+STAGES = ("fetch", "parse", "resolve_teams", "resolve_event", "db_write", "analyze")
+UNSCOPED = "-"
+
+_wrapper : ContextVar[str] = ContextVar("profiling_wrapper", default=UNSCOPED)
+_league : ContextVar[str] = ContextVar("profiling_league", default=UNSCOPED)
+# seconds spent in the stages nested in the open stage, which are not counted to it
+_nested : ContextVar[list[float] | None] = ContextVar("profiling_nested", default=None)
+
+class StageTimings():
+    """Calls, total and longest seconds of every (wrapper, league, stage), added to by the timers of all threads.
+
+    A stage is timed exclusive of the stages nested in it, so the parse time of a page doesn't include
+    the database writes done while parsing it. Times are wall clock, stages of concurrent tasks overlap.
+    """
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.totals : dict[tuple[str, str, str], list[float]] = {}
+
+    def add(self, stage : str, seconds : float, wrapper : str = UNSCOPED, league : str = UNSCOPED):
+        with self.lock:
+            total = self.totals.setdefault((wrapper, league, stage), [0, 0., 0.])
+            total[0] += 1
+            total[1] += seconds
+            total[2] = max(total[2], seconds)
+
+    def reset(self):
+        with self.lock:
+            self.totals = {}
+
+    def report(self) -> str:
+        """Return a table of the timings per wrapper, league and stage, with a total line per wrapper."""
+        with self.lock:
+            totals = dict(self.totals)
+        if len(totals) == 0:
+            return ""
+        stage_order = {stage: index for index, stage in enumerate(STAGES)}
+        lines = [f"{'wrapper':<12} {'league':<40} {'stage':<14} {'calls':>7} {'total s':>9} {'mean ms':>9} {'max ms':>9}"]
+        wrapper_totals : dict[str, float] = {}
+        for (wrapper, league, stage), (calls, seconds, longest) in \
+                sorted(totals.items(), key=lambda item: (item[0][0], item[0][1], stage_order.get(item[0][2], len(STAGES)))):
+            wrapper_totals[wrapper] = wrapper_totals.get(wrapper, 0.) + seconds
+            lines.append(f"{wrapper:<12} {league[:40]:<40} {stage:<14} {int(calls):>7} {seconds:>9.3f} "
+                         f"{seconds / calls * 1000:>9.2f} {longest * 1000:>9.2f}")
+        for wrapper, seconds in sorted(wrapper_totals.items()):
+            lines.append(f"{wrapper:<12} {'all':<40} {'total':<14} {'':>7} {seconds:>9.3f}")
+        return "\n".join(lines)
+
+timings = StageTimings()
+
+@contextlib.contextmanager
+def scope(wrapper : str | None = None, league : str | None = None):
+    """Attribute the stages timed inside to wrapper and league, the ones not given are kept from the enclosing scope."""
+    wrapper_token = _wrapper.set(wrapper) if wrapper is not None else None
+    league_token = _league.set(league) if league is not None else None
+    try:
+        yield
+    finally:
+        if league_token is not None:
+            _league.reset(league_token)
+        if wrapper_token is not None:
+            _wrapper.reset(wrapper_token)
+
+@contextlib.contextmanager
+def stage(name : str):
+    """Time the code inside as stage name of the current scope."""
+    parent = _nested.get()
+    nested = [0.]
+    token = _nested.set(nested)
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        elapsed = time.perf_counter() - start
+        _nested.reset(token)
+        if parent is not None:
+            parent[0] += elapsed
+        timings.add(name, max(0., elapsed - nested[0]), _wrapper.get(), _league.get())
+
+def timed(name : str) -> Callable:
+    """Decorator timing every call of a function or coroutine function as stage name."""
+    def decorator(function : Callable) -> Callable:
+        if inspect.iscoroutinefunction(function):
+            @functools.wraps(function)
+            async def timedCoroutine(*args : Any, **kwargs : Any) -> Any:
+                with stage(name):
+                    return await function(*args, **kwargs)
+            return timedCoroutine
+        @functools.wraps(function)
+        def timedFunction(*args : Any, **kwargs : Any) -> Any:
+            with stage(name):
+                return function(*args, **kwargs)
+        return timedFunction
+    return decorator
+
+def printReport(stream : TextIO = sys.stderr):
+    report = timings.report()
+    if report != "":
+        print(f"Stage timings:\n{report}", file=stream)
+
+@contextlib.contextmanager
+def profiled(path : str | None, top : int = 30, stream : TextIO = sys.stderr):
+    """Run the code inside under cProfile when path is given, then write the stats to path for pstats or snakeviz
+    and print the top functions by cumulative time. Only the thread entering is profiled."""
+    if path is None:
+        yield
+        return
+    profile = cProfile.Profile()
+    profile.enable()
+    try:
+        yield
+    finally:
+        profile.disable()
+        profile.dump_stats(path)
+        print(f"Profile written to {path}", file=stream)
+        pstats.Stats(profile, stream=stream).sort_stats(pstats.SortKey.CUMULATIVE).print_stats(top)
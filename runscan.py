@@ -4,15 +4,17 @@ import logging
 import random
 import sys
 from betting_wrapper import BettingWrapper
-import controller
+from scheduler import TaskScheduler
 import asyncio
 import nodriver as uc
 
 import database_connector
 import argparse
 
+import profiling
 import schemas
-import utils
+import team_similarity
+import wrapper_registry
 
 from Proxy_List_Scrapper import Scrapper, Proxy, ScrapperException
 
@@ -49,9 +51,20 @@ async def main():
   parser.add_argument("-kp", "--knownPages", action='store_true')
   parser.add_argument("-uc", "--useConfig", action='store_true')
   parser.add_argument("-co", "--categoriesOnly", action='store_true')
+  parser.add_argument("--profile", nargs="?", const="runscan.prof",
+                      help="profile the scan with cProfile and write the stats to this file, runscan.prof by default")
   args = parser.parse_args()
+  try:
+    with profiling.profiled(args.profile):
+      await scan(args)
+  finally:
+    profiling.printReport()
+
+async def scan(args : argparse.Namespace):
   # logging.basicConfig(level=logging.INFO)
   database_connector.connectDb()
+  if not args.categoriesOnly:
+    team_similarity.warmUp()
 
   browser = await initBrowser(args.headless)
   browser_conn = (browser.config.host, browser.config.port, chrome_path,)
@@ -80,7 +93,7 @@ async def main():
         await scanBookmaker(bookmaker, browser_conn, categories_only, url, name, args.tabcount)
   
   """
-  wrapper = controller.wrapperDict[args.bookmaker]()
+  wrapper = wrapper_registry.wrappers[args.bookmaker]()
   sport = None
 
   if wrapper.requires_browser:
@@ -92,44 +105,48 @@ async def main():
 
 async def scanBookmaker(bookmaker : str, browser_conn : tuple, categories_only : bool, link : str | None = None,\
                         field : str | None = None, tabcount : int | None = None):
-  wrapper = controller.wrapperDict[bookmaker]()
+  wrapper = wrapper_registry.wrappers[bookmaker]()
   wrapper.proxy_dict = proxy_dict
   if wrapper.requires_browser:
     wrapper.browser_conn = browser_conn
     wrapper.tab_count = tabcount or wrapper.tab_count
-  await wrapper.run(schemas.BookmakerScanParameters(link=link, bookmaker=bookmaker, field=field, categories_only=categories_only))
+  with profiling.scope(wrapper=bookmaker, league=field or link):
+    await wrapper.run(schemas.BookmakerScanParameters(link=link, bookmaker=bookmaker, field=field, categories_only=categories_only))
 
 
 
 async def scanKnownPages(browser_conn : tuple, bookmaker : str | None, tab_count : int | None):
-  scannable_wrappers = ['veikkaus', 'coolbet', 'coolbetv2']
+  scannable_wrappers = ['veikkaus', 'coolbet', 'coolbetv2', 'pinnacle']
   if bookmaker is not None and bookmaker in scannable_wrappers:
     scannable_wrappers = [bookmaker]
-  instance_dict : dict[str, BettingWrapper] = {key: controller.wrapperDict[key]() for key in scannable_wrappers}
-  for instance in instance_dict.values():
+  instance_dict : dict[str, BettingWrapper] = {key: wrapper_registry.wrappers[key]() for key in scannable_wrappers}
+  # the wrappers that can refresh all their prices at once do so side by side, the others rescan their pages
+  refreshes = []
+  for key, instance in instance_dict.items():
     if instance.can_update_all:
       if instance.requires_browser:
         instance.browser_conn = browser_conn
-      await instance.updateOdds()
-      return
+      with profiling.scope(wrapper=key):
+        refreshes.append(asyncio.create_task(instance.updateOdds()))
+  await asyncio.gather(*refreshes)
+  if all(instance.can_update_all for instance in instance_dict.values()):
+    return
   events = database_connector.getEvents()
   event_pages : list[schemas.EventPageData] = []
   for event in events:
     event_pages = event_pages + database_connector.getEventPageData(event.event_id)
-  tasks = []
-  for page in event_pages:
-    for key in instance_dict:
-      if page.bookmaker == key:
-        wrapper = instance_dict[key]
-        if wrapper.can_update_all:
-          continue
-        if wrapper.requires_browser:
-          wrapper.browser_conn = browser_conn
-        event = database_connector.getEventById(page.event_id)
-        tasks.append(wrapper.scrapeGame(page.event_url, event, page.oghome, page.ogaway, True))
-  batch_size = tab_count or 20
-  for batch in utils.chunk_list(tasks, batch_size):
-    await asyncio.gather(*batch)
+  async with TaskScheduler(tab_count or 20, "known pages") as scheduler:
+    for page in event_pages:
+      for key in instance_dict:
+        if page.bookmaker == key:
+          wrapper = instance_dict[key]
+          if wrapper.can_update_all:
+            continue
+          if wrapper.requires_browser:
+            wrapper.browser_conn = browser_conn
+          event = database_connector.getEventById(page.event_id)
+          with profiling.scope(wrapper=key):
+            scheduler.submit(wrapper.scrapeGame(page.event_url, event, page.oghome, page.ogaway, True))
 
 async def initBrowser(headless : bool):
   browser = await uc.start(
@@ -0,0 +1,86 @@
+from __future__ import annotations
+import asyncio
+import contextvars
+import logging
+from typing import Any, Coroutine
+
+class TaskScheduler():
+    """Run coroutines on the running event loop, at most concurrency of them at a time.
+
+    Submitted coroutines wait in a FIFO queue and the next one starts as soon as any running one finishes,
+    so one slow page doesn't hold back the rest. Every coroutine runs in a copy of the context it was submitted
+    from, keeping its profiling scope. A coroutine that raises is logged and counted in failed, the others go on.
+
+    Used as an async context manager the scheduler waits for all its work on exit, and cancels the running and
+    queued coroutines when the block raises or is cancelled:
+
+        async with TaskScheduler(self.tab_count) as scheduler:
+            for link in links:
+                scheduler.submit(self.scrapeGame(link, ...))
+    """
+    def __init__(self, concurrency : int, name : str = "scheduler"):
+        if concurrency < 1:
+            raise ValueError(f"concurrency must be at least 1, got {concurrency}")
+        self.concurrency = concurrency
+        self.name = name
+        self.queue : asyncio.Queue[tuple[Coroutine, contextvars.Context]] = asyncio.Queue()
+        self.workers : list[asyncio.Task] = []
+        self.completed = 0
+        self.failed = 0
+        self.closed = False
+
+    def submit(self, coro : Coroutine):
+        """Queue coro to run when a slot is free."""
+        if self.closed:
+            coro.close()
+            raise RuntimeError(f"{self.name} is closed")
+        self.queue.put_nowait((coro, contextvars.copy_context()))
+        # workers are started on demand, a scheduler running a handful of coroutines doesn't idle concurrency tasks
+        if len(self.workers) < self.concurrency and self.queue.qsize() > 0:
+            self.workers.append(asyncio.create_task(self.work(), name=f"{self.name}-worker-{len(self.workers)}"))
+
+    async def work(self):
+        while True:
+            coro, context = await self.queue.get()
+            try:
+                await asyncio.create_task(coro, context=context)
+                self.completed += 1
+            except asyncio.CancelledError:
+                # the scheduler is being cancelled, or only this coroutine was and the worker goes on
+                if asyncio.current_task().cancelling() > 0:
+                    raise
+                self.failed += 1
+            except Exception:
+                self.failed += 1
+                logging.exception(f"{self.name}: {getattr(coro, '__qualname__', coro)} failed")
+            finally:
+                self.queue.task_done()
+
+    async def join(self):
+        """Wait until every submitted coroutine has finished."""
+        await self.queue.join()
+
+    async def cancel(self):
+        """Cancel the running coroutines and drop the queued ones, the scheduler takes no more work after this."""
+        self.closed = True
+        for worker in self.workers:
+            worker.cancel()
+        await asyncio.gather(*self.workers, return_exceptions=True)
+        self.workers = []
+        while not self.queue.empty():
+            coro, _ = self.queue.get_nowait()
+            # closing the dropped coroutines keeps them from warning they were never awaited
+            coro.close()
+            self.queue.task_done()
+
+    async def __aenter__(self) -> TaskScheduler:
+        return self
+
+    async def __aexit__(self, exc_type : Any, exc : Any, traceback : Any):
+        try:
+            if exc_type is None:
+                await self.join()
+        finally:
+            await self.cancel()
+        if self.failed > 0:
+            logging.warning(f"{self.name}: {self.failed} of {self.completed + self.failed} tasks failed")
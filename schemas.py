@@ -1,7 +1,7 @@
 from __future__ import annotations
 from datetime import datetime
 from enum import Enum, IntEnum
-from typing import List, Union
+from typing import List, NamedTuple, Union
 
 from pydantic import BaseModel
 
@@ -59,6 +59,12 @@ class BetInfoType(IntEnum):
     arbs = 1
     evs = 2
 
+class DevigMethod(IntEnum):
+    multiplicative = 1
+    additive = 2
+    power = 3
+    shin = 4
+
 class BetInfoParameters(BaseModel):
     event: Event | None = None
     names: list[str] | None = None
@@ -66,8 +72,17 @@ class BetInfoParameters(BaseModel):
     point: float | None = None
     description: str | None = None
     category_id : int | None = None
-    user_id: str | None = None
+    user_id: int | None = None
     sharp_book: str | None = None
+    devig_method: DevigMethod = DevigMethod.multiplicative
+    # seconds after which a quote is too old to bet on, None accepts every quote
+    max_odds_age: float | None = None
+
+class UserEligibility(BaseModel):
+    """What a user can bet on, None allowing everything."""
+    user_id : int | None = None
+    bookmakers : set[str] | None = None
+    categories : set[int] | None = None
 
 class PositiveEVBet(BaseModel):
     outcome : Outcome
@@ -79,6 +94,38 @@ class PositiveEVBet(BaseModel):
     fair_odds : float
     kelly_criterion : float
 
+class Arb(BaseModel):
+    event : Event
+    bet_type : BetType
+    description : str | None
+    outcomes : list[tuple[Outcome, str]]
+    probability : float
+
+# what the analysis of betinfo finds, arbs or positive EV bets
+Opportunity = Union[PositiveEVBet, Arb]
+
+# points are stored as REAL, so they are compared as integer multiples of 1/POINT_SCALE
+POINT_SCALE = 100
+
+# how many of the best quotes of every outcome are ranked by top_universal_outcomes and the odds book
+TOP_BOOKS = 5
+
+def quantizePoint(point : float | None) -> int | None:
+    return None if point is None else int(round(point * POINT_SCALE))
+
+class OutcomeKey(NamedTuple):
+    """Identifies the same outcome across bookmakers, used as the key of top_universal_outcomes."""
+    event_id: str
+    bet_type_id: int
+    market_description: str
+    name: str
+    point_key: int | None
+
+    @classmethod
+    def of(cls, event_id : str, bet_type_id : int, market_description : str | None, name : str,
+           point : float | None) -> OutcomeKey:
+        return cls(str(event_id), int(bet_type_id), market_description or "", name, quantizePoint(point))
+
 class BookmakerScanParameters(BaseModel):
     link : str | None = None
     category : str | None = None
@@ -0,0 +1,208 @@
+from __future__ import annotations
+import csv
+import json
+import logging
+import socket
+import sys
+import threading
+from typing import Iterable, TextIO
+
+import pytz
+
+import database_connector
+from schemas import Arb, BetInfoType, Opportunity, PositiveEVBet
+
+OUTPUTS = ("text", "jsonl", "csv", "db", "socket")
+
+CSV_COLUMNS = ["change", "user_id", "info_type", "event_id", "commence_time", "category_id", "home", "away", "bet_type",
+               "description", "name", "point", "price", "book", "fair_odds", "edge", "kelly_criterion", "probability"]
+
+def opportunityRecord(info_type : BetInfoType, opportunity : Opportunity, change : str | None = None,
+                      user_id : int | None = None) -> dict:
+    """Return a JSON serializable record of opportunity."""
+    record = {"change": change, "info_type": info_type.name, "opportunity": opportunity.model_dump(mode="json")}
+    if user_id is not None:
+        record["user_id"] = user_id
+    return record
+
+class OpportunitySink():
+    """Where the opportunities found by betinfo are written.
+
+    change is None for a full analysis, new, changed or disappeared for an incremental one,
+    user_id is set when the analysis is done for several users at once.
+    """
+    def write(self, info_type : BetInfoType, opportunities : Iterable[Opportunity], change : str | None = None,
+              user_id : int | None = None):
+        raise NotImplementedError
+
+    def close(self):
+        pass
+
+class TextSink(OpportunitySink):
+    """Human readable output, printed as the opportunities arrive with their count after the last one."""
+    def __init__(self, stream : TextIO = sys.stdout):
+        self.stream = stream
+
+    def write(self, info_type : BetInfoType, opportunities : Iterable[Opportunity], change : str | None = None,
+              user_id : int | None = None):
+        count = 0
+        for opportunity in opportunities:
+            if count == 0 and user_id is not None:
+                print(f"User: {user_id}", file=self.stream)
+            count += 1
+            teams = database_connector.getTeamNames([opportunity.event.home, opportunity.event.away])
+            if isinstance(opportunity, Arb):
+                self.writeArb(opportunity, teams)
+            else:
+                self.writePositiveEV(opportunity, teams)
+            self.stream.flush()
+        if count == 0:
+            return
+        if change is not None:
+            print(f"{change.capitalize()}: {count}", file=self.stream)
+        if info_type == BetInfoType.arbs:
+            print("Arbs found: ", count, file=self.stream)
+        self.stream.flush()
+
+    def writePositiveEV(self, bet : PositiveEVBet, teams : dict[int, str | None]):
+        commence_time = bet.event.commence_time.replace(tzinfo=pytz.utc)
+        bet_type_str = database_connector.getBetTypeName(bet.bet_type)
+        print(f"Event: {teams[bet.event.home]} vs {teams[bet.event.away]} market: {bet_type_str} {bet.description or ''} "
+              f"category: {bet.event.category_id}", file=self.stream)
+        print(f"Time: {commence_time}", file=self.stream)
+        print(f"{bet.outcome.name} ({bet.outcome.point or ''!s}) at {round(bet.outcome.price,3)!s} from {bet.book}", file=self.stream)
+        edge = round((bet.edge - 1)*100, 2)
+        print(f"Edge: {edge!s}% Fair Odds: {round(bet.fair_odds, 2)!s}", file=self.stream)
+        print(f"Kelly Criterion: {round(bet.kelly_criterion, 3)!s}\n", file=self.stream)
+
+    def writeArb(self, arb : Arb, teams : dict[int, str | None]):
+        bet_type_str = database_connector.getBetTypeName(arb.bet_type)
+        print(f"Event: {teams[arb.event.home]} vs {teams[arb.event.away]} market: {bet_type_str} {arb.description or ''}",
+              file=self.stream)
+        for outcome, book in arb.outcomes:
+            print(f"({str(outcome.point or '')}) {outcome.name} {str(outcome.price)} from {book}", file=self.stream)
+        print("Total: " + str(arb.probability) + "\n", file=self.stream)
+
+class JsonLinesSink(OpportunitySink):
+    """One opportunityRecord per line, written as the opportunities arrive."""
+    def __init__(self, stream : TextIO = sys.stdout):
+        self.stream = stream
+
+    def write(self, info_type : BetInfoType, opportunities : Iterable[Opportunity], change : str | None = None,
+              user_id : int | None = None):
+        for opportunity in opportunities:
+            self.stream.write(json.dumps(opportunityRecord(info_type, opportunity, change, user_id)) + "\n")
+        self.stream.flush()
+
+class CsvSink(OpportunitySink):
+    """One CSV_COLUMNS row per positive EV bet and per outcome of an arb, the header is written before the first row."""
+    def __init__(self, stream : TextIO = sys.stdout):
+        self.stream = stream
+        self.writer = csv.DictWriter(stream, CSV_COLUMNS)
+        self.header_written = False
+
+    def write(self, info_type : BetInfoType, opportunities : Iterable[Opportunity], change : str | None = None,
+              user_id : int | None = None):
+        for opportunity in opportunities:
+            if not self.header_written:
+                self.writer.writeheader()
+                self.header_written = True
+            event = opportunity.event
+            teams = database_connector.getTeamNames([event.home, event.away])
+            row = {
+                "change": change,
+                "user_id": user_id,
+                "info_type": info_type.name,
+                "event_id": event.event_id,
+                "commence_time": event.commence_time.replace(tzinfo=pytz.utc).isoformat(),
+                "category_id": event.category_id,
+                "home": teams[event.home],
+                "away": teams[event.away],
+                "bet_type": database_connector.getBetTypeName(opportunity.bet_type),
+                "description": opportunity.description,
+            }
+            if isinstance(opportunity, Arb):
+                for outcome, book in opportunity.outcomes:
+                    self.writer.writerow(row | {"name": outcome.name, "point": outcome.point, "price": outcome.price,
+                                                "book": book, "probability": opportunity.probability})
+            else:
+                outcome = opportunity.outcome
+                self.writer.writerow(row | {"name": outcome.name, "point": outcome.point, "price": outcome.price,
+                                            "book": opportunity.book, "fair_odds": opportunity.fair_odds,
+                                            "edge": opportunity.edge, "kelly_criterion": opportunity.kelly_criterion})
+        self.stream.flush()
+
+class DatabaseSink(OpportunitySink):
+    """Insert the opportunities into the opportunities table migrate.py creates, batch_size rows per statement."""
+    def __init__(self, batch_size : int = 500):
+        self.batch_size = batch_size
+
+    def write(self, info_type : BetInfoType, opportunities : Iterable[Opportunity], change : str | None = None,
+              user_id : int | None = None):
+        rows = []
+        for opportunity in opportunities:
+            rows.append((
+                int(info_type),
+                change,
+                user_id,
+                str(opportunity.event.event_id),
+                int(opportunity.bet_type),
+                opportunity.description,
+                opportunity.edge if isinstance(opportunity, PositiveEVBet) else None,
+                opportunity.probability if isinstance(opportunity, Arb) else None,
+                json.dumps(opportunityRecord(info_type, opportunity, change, user_id)["opportunity"]),
+            ))
+            if len(rows) >= self.batch_size:
+                database_connector.addOpportunities(rows)
+                rows = []
+        database_connector.addOpportunities(rows)
+
+class SocketSink(OpportunitySink):
+    """Serve the JSON lines of every opportunity to all TCP clients connected to address."""
+    def __init__(self, address : str):
+        host, port = address.rsplit(":", 1)
+        self.server = socket.create_server((host, int(port)))
+        self.clients : list[socket.socket] = []
+        self.lock = threading.Lock()
+        threading.Thread(target=self.accept, name="odds-socket", daemon=True).start()
+        logging.info(f"Serving opportunities on {address}")
+
+    def accept(self):
+        while True:
+            client, peer = self.server.accept()
+            logging.info(f"Opportunity client connected from {peer}")
+            with self.lock:
+                self.clients.append(client)
+
+    def write(self, info_type : BetInfoType, opportunities : Iterable[Opportunity], change : str | None = None,
+              user_id : int | None = None):
+        data = "".join(json.dumps(opportunityRecord(info_type, opportunity, change, user_id)) + "\n"
+                       for opportunity in opportunities).encode()
+        if len(data) == 0:
+            return
+        with self.lock:
+            for client in list(self.clients):
+                try:
+                    client.sendall(data)
+                except OSError:
+                    self.clients.remove(client)
+                    client.close()
+
+    def close(self):
+        with self.lock:
+            for client in self.clients:
+                client.close()
+            self.clients = []
+        self.server.close()
+
+def makeSink(output : str, address : str | None = None) -> OpportunitySink:
+    """Return the sink of an OUTPUTS name, address being the host:port of the socket sink."""
+    if output == "jsonl":
+        return JsonLinesSink()
+    if output == "csv":
+        return CsvSink()
+    if output == "db":
+        return DatabaseSink()
+    if output == "socket":
+        return SocketSink(address)
+    return TextSink()
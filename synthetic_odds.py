@@ -0,0 +1,147 @@
+from __future__ import annotations
+import logging
+import uuid
+from datetime import datetime, timedelta
+from typing import NamedTuple
+
+import numpy as np
+import pytz
+
+import database_connector
+import odds_engine
+import schemas
+from schemas import BetType
+
+SYNTHETIC_CATEGORY = "synthetic benchmark"
+SHARP_BOOK = "pinnacle"
+SHARP_MARGIN = 1.025
+# bookmaker margins are drawn from this range, the noise is the spread of every book's opinion around the true odds
+SOFT_MARGINS = (1.04, 1.08)
+SHARP_NOISE = 0.01
+SOFT_NOISE = 0.04
+# share of the markets of an event a soft book offers
+SOFT_COVERAGE = 0.85
+# handicap and total lines offered around the main line of every event
+LINES = 3
+MARKET_BATCH = 2000
+
+class SyntheticOdds(NamedTuple):
+    """Generated events and their prices, rows being the (event_id, bet_type_id, description, point, name, price,
+    bookmaker_key, last_update) tuples of database_connector.getOddsSnapshot."""
+    events : list[schemas.Event]
+    rows : list[tuple]
+    teams : list[str]
+
+def sigmoid(x : np.ndarray | float) -> np.ndarray | float:
+    return 1. / (1. + np.exp(-x))
+
+def eventMarkets(strength : float, goals : float) -> list[tuple[BetType, float | None, list[str], np.ndarray]]:
+    """Return the (bet type, point, names, true probabilities) of every market of an event.
+
+    strength is how much better the home team is, goals the expected total, points are the home handicap
+    like the scrapers store them.
+    """
+    draw = 0.28 * np.exp(-strength ** 2 / 2)
+    home = sigmoid(1.4 * strength) * (1 - draw)
+    markets = [(BetType.h2h, None, ["home", "draw", "away"], np.array([home, draw, 1 - home - draw]))]
+    main_handicap = -round(strength * 2) / 2
+    main_total = round(goals - 0.5) + 0.5
+    for line in range(-(LINES // 2), LINES - LINES // 2):
+        point = main_handicap + line + 0.5
+        cover = sigmoid(1.1 * strength + 0.7 * point)
+        markets.append((BetType.spreads, point, ["home", "away"], np.array([cover, 1 - cover])))
+        quarter = main_handicap + line * 0.5 + 0.25
+        cover = sigmoid(1.1 * strength + 0.7 * quarter)
+        markets.append((BetType.asian_spreads, quarter, ["home", "away"], np.array([cover, 1 - cover])))
+        total = main_total + line
+        over = sigmoid(1.3 * (goals - total))
+        markets.append((BetType.totals, total, ["over", "under"], np.array([over, 1 - over])))
+    return markets
+
+def quotePrices(rng : np.random.Generator, probabilities : np.ndarray, margin : float, noise : float) -> np.ndarray:
+    """Return the decimal odds a book with margin and noise quotes for the true probabilities."""
+    implied = probabilities * np.exp(rng.normal(0., noise, len(probabilities)))
+    implied = implied / implied.sum() * margin
+    return np.maximum(np.round(1. / implied, 2), 1.01)
+
+def generateOdds(outcome_count : int, seed : int = 0, bookmaker_count : int = 8, category_id : int = 0,
+                 now : datetime | None = None) -> SyntheticOdds:
+    """Generate events until they have at least outcome_count priced outcomes.
+
+    Every event is quoted by SHARP_BOOK on all its markets and by bookmaker_count - 1 soft books on SOFT_COVERAGE
+    of them, so the engines find the occasional positive EV bet and the rare arb. The same seed gives the same odds.
+    """
+    rng = np.random.default_rng(seed)
+    if now is None:
+        now = datetime.now(pytz.utc).replace(tzinfo=None)
+    soft_books = [f"synthetic{index}" for index in range(1, bookmaker_count)]
+    soft_margins = dict(zip(soft_books, rng.uniform(*SOFT_MARGINS, len(soft_books))))
+    # every event draws its teams from a pool, so the teams have several events like in a real league
+    teams = [f"Synthetic Team {index}" for index in range(max(20, int(np.sqrt(outcome_count))))]
+    events : list[schemas.Event] = []
+    rows : list[tuple] = []
+    while len(rows) < outcome_count:
+        home, away = rng.choice(len(teams), 2, replace=False)
+        event = schemas.Event(
+            event_id=str(uuid.UUID(bytes=rng.bytes(16), version=4)),
+            category_id=category_id,
+            commence_time=now + timedelta(seconds=float(rng.uniform(3600, 7 * 24 * 3600))),
+            home=int(home),
+            away=int(away),
+        )
+        events.append(event)
+        strength = float(rng.normal(0., 0.8))
+        goals = float(rng.uniform(2.2, 3.2))
+        for bet_type, point, names, probabilities in eventMarkets(strength, goals):
+            for book in [SHARP_BOOK, *soft_books]:
+                if book == SHARP_BOOK:
+                    prices = quotePrices(rng, probabilities, SHARP_MARGIN, SHARP_NOISE)
+                elif rng.random() < SOFT_COVERAGE:
+                    prices = quotePrices(rng, probabilities, soft_margins[book], SOFT_NOISE)
+                else:
+                    continue
+                last_update = now - timedelta(seconds=float(rng.uniform(0, 600)))
+                rows.extend((event.event_id, int(bet_type), "", point, name, float(price), book, last_update)
+                            for name, price in zip(names, prices))
+    return SyntheticOdds(events, rows, teams)
+
+def loadOddsBook(odds : SyntheticOdds, odds_book : odds_engine.OddsBook | None = None) -> odds_engine.OddsBook:
+    """Put the prices of odds into an odds book, a new one unless given."""
+    if odds_book is None:
+        odds_book = odds_engine.OddsBook()
+    odds_book.update([event.event_id for event in odds.events], odds.rows)
+    return odds_book
+
+def toMarkets(rows : list[tuple]) -> list[schemas.Market]:
+    """Group rows into the markets upsertMarkets writes."""
+    markets : dict[tuple, schemas.Market] = {}
+    for event_id, bet_type_id, description, point, name, price, book, last_update in rows:
+        key = (event_id, book, bet_type_id, description)
+        market = markets.get(key)
+        if market is None:
+            market = schemas.Market(event_id=event_id, bookmaker_key=book, bet_type_id=bet_type_id,
+                                    description=description or None, last_update=last_update, outcomes=[])
+            markets[key] = market
+        market.outcomes.append(schemas.Outcome(name=name, price=price, point=point))
+    return list(markets.values())
+
+def loadDatabase(odds : SyntheticOdds, category_name : str = SYNTHETIC_CATEGORY) -> tuple[int, list[schemas.Event]]:
+    """Write odds into a new category of the database through the same upserts as the scrapers.
+
+    Returns the category id, to remove the data with database_connector.deleteCategory, and the events
+    with the category and team ids they got in the database.
+    """
+    category_id = int(database_connector.addCategory(category_name))
+    for team in odds.teams:
+        database_connector.addTeam(team, category_id)
+    team_ids = dict(database_connector.getTeamDict(category_id))
+    events = [event.model_copy(update={"category_id": category_id, "home": team_ids[odds.teams[event.home]],
+                                       "away": team_ids[odds.teams[event.away]]})
+              for event in odds.events]
+    database_connector.addEvents(events)
+    markets = toMarkets(odds.rows)
+    for start in range(0, len(markets), MARKET_BATCH):
+        database_connector.upsertMarkets(markets[start:start + MARKET_BATCH])
+    logging.info(f"Loaded {len(events)} events, {len(markets)} markets and {len(odds.rows)} outcomes "
+                 f"into category {category_id}")
+    return category_id, events
@@ -0,0 +1,138 @@
+from __future__ import annotations
+import atexit
+from importlib import metadata
+import logging
+import os
+import threading
+
+import numpy as np
+
+MODEL_NAME = "en_core_web_sm"
+# team names are only compared by their doc vectors, which come from tok2vec alone
+DISABLED_COMPONENTS = ["tagger", "parser", "attribute_ruler", "lemmatizer", "ner", "senter"]
+
+vector_cache_path = "team_vectors.npz"
+
+_nlp = None
+_nlp_lock = threading.Lock()
+_vector_cache : dict[str, np.ndarray] | None = None
+_vector_cache_lock = threading.Lock()
+_vector_cache_dirty = False
+
+def getNlp():
+    """Return the spaCy pipeline, loading it on first use."""
+    global _nlp
+    if _nlp is None:
+        with _nlp_lock:
+            if _nlp is None:
+                import spacy
+                _nlp = spacy.load(MODEL_NAME, exclude=DISABLED_COMPONENTS)
+    return _nlp
+
+def warmUp() -> threading.Thread:
+    """Load the model in a background thread so the first similarity lookup doesn't wait for it."""
+    thread = threading.Thread(target=getNlp, name="nlp-warmup", daemon=True)
+    thread.start()
+    return thread
+
+def modelVersion() -> str:
+    try:
+        return metadata.version(MODEL_NAME)
+    except metadata.PackageNotFoundError:
+        return ""
+
+def loadVectorCache() -> dict[str, np.ndarray]:
+    """Return the name -> unit vector cache, reading it from vector_cache_path on first use."""
+    global _vector_cache
+    with _vector_cache_lock:
+        if _vector_cache is not None:
+            return _vector_cache
+        _vector_cache = {}
+        if os.path.exists(vector_cache_path):
+            try:
+                with np.load(vector_cache_path, allow_pickle=False) as data:
+                    if str(data["version"]) == modelVersion():
+                        _vector_cache = dict(zip(data["names"].tolist(), data["vectors"]))
+            except (OSError, KeyError, ValueError) as e:
+                logging.warning(f"Ignoring unreadable team vector cache {vector_cache_path}: {e}")
+        return _vector_cache
+
+def saveVectorCache():
+    """Write the vector cache to vector_cache_path if new names were encoded since it was loaded."""
+    global _vector_cache_dirty
+    with _vector_cache_lock:
+        if _vector_cache is None or not _vector_cache_dirty or len(_vector_cache) == 0:
+            return
+        names = list(_vector_cache.keys())
+        tmp_path = vector_cache_path + ".tmp.npz"
+        np.savez(tmp_path, version=np.array(modelVersion()), names=np.array(names),
+                 vectors=np.stack([_vector_cache[name] for name in names]))
+        os.replace(tmp_path, vector_cache_path)
+        _vector_cache_dirty = False
+
+atexit.register(saveVectorCache)
+
+def encode(names : list[str]) -> np.ndarray:
+    """Return the doc vectors of names as rows of a matrix, scaled to unit length.
+
+    Names without a vector are left as zero rows so they get a similarity of 0 like in spaCy.
+    Vectors are served from the on-disk cache when possible, the model is only loaded for unseen names.
+    """
+    global _vector_cache_dirty
+    cache = loadVectorCache()
+    missing = list(dict.fromkeys(name for name in names if name not in cache))
+    if len(missing) > 0:
+        vectors = np.array([doc.vector for doc in getNlp().pipe(missing)], dtype=np.float32)
+        norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+        np.divide(vectors, norms, out=vectors, where=norms > 0)
+        with _vector_cache_lock:
+            cache.update(zip(missing, vectors))
+            _vector_cache_dirty = True
+    if len(names) == 0:
+        return np.zeros((0, 0), dtype=np.float32)
+    return np.stack([cache[name] for name in names])
+
+class TeamSimilarityIndex():
+    """Unit vectors of every known team name in a category, queried with one matrix-vector product."""
+    def __init__(self, names : list[str], team_ids : list[int]):
+        self.lock = threading.Lock()
+        self.names : list[str] = []
+        self.team_ids : list[int] = []
+        self.positions : dict[str, int] = {}
+        self.vectors = np.zeros((0, 0), dtype=np.float32)
+        self.addMany(names, team_ids)
+
+    def __len__(self) -> int:
+        return len(self.names)
+
+    def addMany(self, names : list[str], team_ids : list[int]):
+        new = [(name, team_id) for name, team_id in zip(names, team_ids) if name not in self.positions]
+        if len(new) == 0:
+            return
+        vectors = encode([name for name, _ in new])
+        with self.lock:
+            size = len(self.names)
+            needed = size + len(new)
+            if self.vectors.shape[1] != vectors.shape[1] or self.vectors.shape[0] < needed:
+                grown = np.zeros((max(needed, 2 * self.vectors.shape[0]), vectors.shape[1]), dtype=np.float32)
+                if size > 0:
+                    grown[:size] = self.vectors[:size]
+                self.vectors = grown
+            self.vectors[size:needed] = vectors
+            for name, team_id in new:
+                self.positions[name] = len(self.names)
+                self.names.append(name)
+                self.team_ids.append(team_id)
+
+    def add(self, name : str, team_id : int):
+        self.addMany([name], [team_id])
+
+    def closest(self, name : str) -> tuple[str, float, int] | None:
+        """Return the most similar known name with its cosine similarity and team id."""
+        if len(self.names) == 0:
+            return None
+        vector = encode([name])[0]
+        with self.lock:
+            similarities = self.vectors[:len(self.names)] @ vector
+            best = int(np.argmax(similarities))
+            return (self.names[best], float(similarities[best]), self.team_ids[best])
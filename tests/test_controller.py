@@ -0,0 +1,66 @@
+import random
+
+import pytest
+
+import controller
+import odds_engine
+import synthetic_odds
+from schemas import BetInfoParameters, BetInfoType, BetType
+
+@pytest.fixture(scope="module")
+def odds():
+    odds = synthetic_odds.generateOdds(5000, seed=5)
+    # prices rounded to one decimal tie between books, a reload must not move the opportunities between them
+    return odds._replace(rows=[row[:5] + (round(row[5], 1),) + row[6:] for row in odds.rows])
+
+def infoParameters(bet_type : BetType) -> BetInfoParameters:
+    return BetInfoParameters(bet_type=bet_type, category_id=0, sharp_book=synthetic_odds.SHARP_BOOK)
+
+def eventIds(odds : synthetic_odds.SyntheticOdds) -> list[str]:
+    return [event.event_id for event in odds.events]
+
+INFO = [(info_type, bet_type) for info_type in (BetInfoType.arbs, BetInfoType.evs)
+        for bet_type in odds_engine.ANALYSED_BET_TYPES]
+
+@pytest.mark.parametrize(("info_type", "bet_type"), INFO)
+def test_reloadingTheSameOddsChangesNothing(odds, info_type, bet_type):
+    params = infoParameters(bet_type)
+    book = synthetic_odds.loadOddsBook(odds)
+    state = controller.AnalysisState()
+    first = controller.updateAnalysis(info_type, params, state, odds.events, set(eventIds(odds)), book)
+    assert first.changed == [] and first.disappeared == []
+    # every event is re-evaluated from prices written again in another order, reusing the freed slots differently
+    book.retain([])
+    book.update(eventIds(odds), random.Random(0).sample(odds.rows, len(odds.rows)))
+    second = controller.updateAnalysis(info_type, params, state, odds.events, set(eventIds(odds)), book)
+    assert [(change, results) for change, results in controller.diffChanges(info_type, second)] == \
+        [("new", []), ("changed", []), ("disappeared", [])]
+    assert len(state.opportunities) == len(first.new)
+
+@pytest.mark.parametrize(("info_type", "bet_type"), INFO)
+def test_savedStateChangesNothing(odds, info_type, bet_type):
+    params = infoParameters(bet_type)
+    book = synthetic_odds.loadOddsBook(odds)
+    state = controller.AnalysisState()
+    controller.updateAnalysis(info_type, params, state, odds.events, set(eventIds(odds)), book)
+    loaded = controller.AnalysisState.fromJson(info_type, state.toJson())
+    diff = controller.updateAnalysis(info_type, params, loaded, odds.events, set(eventIds(odds)), book)
+    assert diff == controller.AnalysisDiff([], [], [])
+
+def test_onlyChangedEventsAreReported(odds):
+    params = infoParameters(BetType.h2h)
+    book = synthetic_odds.loadOddsBook(odds)
+    state = controller.AnalysisState()
+    first = controller.updateAnalysis(BetInfoType.evs, params, state, odds.events, set(eventIds(odds)), book)
+    assert len(first.new) > 1
+    event_id = str(first.new[0].event.event_id)
+    # the event loses its soft books and the last event is no longer analysed
+    rows = [row for row in odds.rows if row[0] == event_id and row[6] == synthetic_odds.SHARP_BOOK]
+    book.update([event_id], rows)
+    events = odds.events[:-1]
+    diff = controller.updateAnalysis(BetInfoType.evs, params, state, events, {event_id}, book)
+    assert diff.new == [] and diff.changed == []
+    removed = {event_id, str(odds.events[-1].event_id)}
+    assert {str(result.event.event_id) for result in diff.disappeared} <= removed
+    assert sorted(map(controller.opportunityKey, diff.disappeared)) == \
+        sorted(controller.opportunityKey(result) for result in first.new if str(result.event.event_id) in removed)
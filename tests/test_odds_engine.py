@@ -0,0 +1,89 @@
+import numpy as np
+import pytest
+
+import odds_engine
+import schemas
+import synthetic_odds
+from schemas import DevigMethod
+
+# a two-way and a three-way market with margins of a sharp and a soft book
+PRICES = np.array([1.90, 1.95, 2.60, 3.30, 2.75])
+MARKETS = np.array([0, 0, 1, 1, 1])
+
+@pytest.mark.parametrize("method", list(DevigMethod))
+def test_fairProbabilitiesSumToOne(method):
+    probabilities = odds_engine.fairProbabilities(PRICES, MARKETS, method)
+    assert np.all(probabilities > 0)
+    np.testing.assert_allclose(np.bincount(MARKETS, weights=probabilities), 1., atol=1e-9)
+    # removing the vig makes every outcome less likely than its price implies
+    assert np.all(probabilities < 1. / PRICES)
+
+@pytest.mark.parametrize("method", list(DevigMethod))
+def test_fairProbabilitiesOfSyntheticSharpOdds(method):
+    snapshot = odds_engine.OddsSnapshot(synthetic_odds.generateOdds(2000, seed=1).rows)
+    sharp, probabilities = odds_engine.sharpFairProbabilities(snapshot, synthetic_odds.SHARP_BOOK, method)
+    assert len(sharp) > 0
+    markets = snapshot.market[sharp]
+    valid = ~np.isnan(probabilities)
+    sums = np.bincount(markets[valid], weights=probabilities[valid])
+    np.testing.assert_allclose(sums[np.unique(markets[valid])], 1., atol=1e-9)
+
+def test_additiveLeavesOutMarketsItCantDevig():
+    # the longshot's implied probability is below its share of the margin
+    prices = np.array([1.5, 1.5, 100., 1.90, 1.90])
+    probabilities = odds_engine.fairProbabilities(prices, np.array([0, 0, 0, 1, 1]), DevigMethod.additive)
+    assert np.all(np.isnan(probabilities[:3]))
+    np.testing.assert_allclose(probabilities[3:], 0.5)
+
+def reloadedBook(rows : list[tuple], event_ids : list[str]) -> odds_engine.OddsBook:
+    """Return an odds book holding rows after dropping and updating events, so its freed slots are reused
+    in a different order than a snapshot of rows has."""
+    book = odds_engine.OddsBook()
+    half = set(event_ids[len(event_ids) // 2:])
+    book.update(list(half), [row for row in rows if row[0] in half])
+    book.retain(event_ids[:len(event_ids) // 4])
+    book.update(list(reversed(event_ids)), list(reversed(rows)))
+    return book
+
+@pytest.fixture(scope="module")
+def tiedOdds():
+    odds = synthetic_odds.generateOdds(3000, seed=3)
+    # prices rounded to one decimal tie between books all the time
+    rows = [row[:5] + (round(row[5], 1),) + row[6:] for row in odds.rows]
+    return rows, [event.event_id for event in odds.events]
+
+@pytest.mark.parametrize("bookmakers", [None, {"pinnacle", "synthetic1", "synthetic2", "synthetic5"}])
+def test_oddsBookMatchesRowSnapshot(tiedOdds, bookmakers):
+    rows, event_ids = tiedOdds
+    from_book = reloadedBook(rows, event_ids).snapshot(event_ids)
+    from_rows = odds_engine.OddsSnapshot(rows)
+    assert len(from_book) == len(from_rows)
+    eligibility = schemas.UserEligibility(bookmakers=bookmakers)
+    book_arbs = odds_engine.findArbs(from_book, from_book.eligibleRows(eligibility))
+    row_arbs = odds_engine.findArbs(from_rows, from_rows.eligibleRows(eligibility))
+    assert len(row_arbs) > 0
+    assert sorted(book_arbs, key=str) == sorted(row_arbs, key=str)
+    book_evs = odds_engine.findPositiveEVs(from_book, synthetic_odds.SHARP_BOOK,
+                                           eligible=from_book.eligibleRows(eligibility))
+    row_evs = odds_engine.findPositiveEVs(from_rows, synthetic_odds.SHARP_BOOK,
+                                          eligible=from_rows.eligibleRows(eligibility))
+    assert len(row_evs) > 0
+    assert sorted(book_evs, key=str) == sorted(row_evs, key=str)
+
+def test_oddsBookRanksEqualPricesByBookmaker(tiedOdds):
+    rows, event_ids = tiedOdds
+    book = reloadedBook(rows, event_ids)
+    quotes = {}
+    for event_id, bet_type_id, description, point, name, price, bookmaker, _ in rows:
+        quotes.setdefault((event_id, bet_type_id, description, point, name), []).append((-price, bookmaker))
+    for outcome, outcome_quotes in quotes.items():
+        expected = [(-price, bookmaker) for price, bookmaker in sorted(outcome_quotes)]
+        assert [quote[:2] for quote in book.topBooks(*outcome, k=len(expected))] == expected
+
+def test_oddsBookRetainDropsEvents(tiedOdds):
+    rows, event_ids = tiedOdds
+    book = reloadedBook(rows, event_ids)
+    book.retain(event_ids[:3])
+    assert book.eventCount() == 3
+    assert len(book) == sum(row[0] in set(event_ids[:3]) for row in rows)
+    assert len(book.snapshot(event_ids[3:])) == 0
@@ -0,0 +1,105 @@
+import asyncio
+import contextvars
+import logging
+
+import pytest
+
+from scheduler import TaskScheduler
+
+def test_concurrencyIsBounded():
+    running = 0
+    peak = 0
+
+    async def task():
+        nonlocal running, peak
+        running += 1
+        peak = max(peak, running)
+        await asyncio.sleep(0.01)
+        running -= 1
+
+    async def run() -> TaskScheduler:
+        async with TaskScheduler(3) as scheduler:
+            for _ in range(20):
+                scheduler.submit(task())
+        return scheduler
+
+    scheduler = asyncio.run(run())
+    assert peak == 3
+    assert (scheduler.completed, scheduler.failed) == (20, 0)
+    assert scheduler.workers == []
+
+def test_failuresAreCountedAndLogged(caplog):
+    finished = []
+
+    async def task(index : int):
+        await asyncio.sleep(0.001 * index)
+        if index == 2:
+            raise ValueError("broken page")
+        finished.append(index)
+
+    async def run() -> TaskScheduler:
+        async with TaskScheduler(2, name="pages") as scheduler:
+            for index in range(5):
+                scheduler.submit(task(index))
+        return scheduler
+
+    with caplog.at_level(logging.WARNING):
+        scheduler = asyncio.run(run())
+    assert sorted(finished) == [0, 1, 3, 4]
+    assert (scheduler.completed, scheduler.failed) == (4, 1)
+    assert any(record.exc_info is not None and isinstance(record.exc_info[1], ValueError) for record in caplog.records)
+    assert "pages: 1 of 5 tasks failed" in caplog.text
+
+def test_errorInTheBlockCancelsTheWork():
+    started = []
+    cancelled = []
+
+    async def task(index : int):
+        started.append(index)
+        try:
+            await asyncio.sleep(10)
+        except asyncio.CancelledError:
+            cancelled.append(index)
+            raise
+
+    async def run():
+        async with TaskScheduler(2) as scheduler:
+            for index in range(5):
+                scheduler.submit(task(index))
+            await asyncio.sleep(0.01)
+            raise RuntimeError("scan aborted")
+
+    with pytest.raises(RuntimeError, match="scan aborted"):
+        asyncio.run(run())
+    assert started == [0, 1]
+    assert sorted(cancelled) == [0, 1]
+
+def test_tasksRunInTheSubmittersContext():
+    variable = contextvars.ContextVar("variable", default=None)
+    seen = []
+
+    async def task():
+        seen.append(variable.get())
+
+    async def run():
+        async with TaskScheduler(2) as scheduler:
+            for value in ("a", "b", "c"):
+                variable.set(value)
+                scheduler.submit(task())
+
+    asyncio.run(run())
+    assert sorted(seen) == ["a", "b", "c"]
+
+def test_closedSchedulerRejectsWork():
+    async def task():
+        pass
+
+    async def run():
+        scheduler = TaskScheduler(1)
+        await scheduler.cancel()
+        with pytest.raises(RuntimeError):
+            scheduler.submit(task())
+
+    asyncio.run(run())
+    with pytest.raises(ValueError):
+        TaskScheduler(0)
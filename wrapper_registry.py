@@ -0,0 +1,49 @@
+from __future__ import annotations
+import importlib
+import threading
+from collections.abc import Iterator, Mapping
+from typing import TYPE_CHECKING
+
+if TYPE_CHECKING:
+    from betting_wrapper import BettingWrapper
+
+# bookmaker key -> "module:class" of its wrapper
+WRAPPER_PATHS : dict[str, str] = {
+    "veikkaus" : "wrappers.veikkaus:VeikkausWrapper",
+    "coolbet" : "wrappers.coolbet:CoolbetWrapper",
+    "coolbetv2" : "wrappers.coolbetV2:CoolbetWrapperV2",
+    "polymarket" : "wrappers.polymarket:PolymarketWrapper",
+    "pinnacle" : "wrappers.pinnacle:PinnacleWrapper",
+}
+
+class WrapperRegistry(Mapping):
+    """Maps bookmaker keys to wrapper classes, importing a wrapper module the first time its class is looked up.
+
+    Checking a key or listing the keys imports nothing, so the analysis doesn't load the browser and HTTP stacks
+    of the scrapers, and a wrapper with a broken dependency only fails when it is used.
+    """
+    def __init__(self, paths : dict[str, str]):
+        self.paths = paths
+        self.classes : dict[str, type[BettingWrapper]] = {}
+        self.lock = threading.Lock()
+
+    def __getitem__(self, key : str) -> type[BettingWrapper]:
+        wrapper_class = self.classes.get(key)
+        if wrapper_class is not None:
+            return wrapper_class
+        module_name, class_name = self.paths[key].split(":")
+        with self.lock:
+            wrapper_class = getattr(importlib.import_module(module_name), class_name)
+            self.classes[key] = wrapper_class
+        return wrapper_class
+
+    def __contains__(self, key : object) -> bool:
+        return key in self.paths
+
+    def __iter__(self) -> Iterator[str]:
+        return iter(self.paths)
+
+    def __len__(self) -> int:
+        return len(self.paths)
+
+wrappers = WrapperRegistry(WRAPPER_PATHS)
@@ -8,21 +8,18 @@ import asyncio
 
 import pytz
 import database_connector
+import profiling
 import schemas
 from schemas import BetType, BookmakerScanParameters
 import controller
 from enum import Enum
 from betting_wrapper import BettingWrapper
+from scheduler import TaskScheduler
 import contextlib
 import logging
-import concurrent.futures
 from lxml import html, etree
 
 
-
-def run_coroutine(coro):
-    asyncio.run(coro)
-
 class CoolbetWrapper(BettingWrapper):
 
     def __init__(self):
@@ -87,7 +84,8 @@ class CoolbetWrapper(BettingWrapper):
 
     async def scrapeEventPage(self, link: str):
         markets = []
-        page = await self.browser.get(link)
+        with profiling.stage("fetch"):
+            page = await self.browser.get(link)
         elems = None
         await page.wait(5)
         await page
@@ -95,9 +93,11 @@ class CoolbetWrapper(BettingWrapper):
             await page.scroll_down(300)
             await page.wait(1)
 
-        content = str(await page.get_content())
-        tree = html.fromstring(content)
-        elems : list[html.HtmlElement] = tree.xpath("//*[contains(@class, '"+self.game_element_class+"')]")
+        with profiling.stage("fetch"):
+            content = str(await page.get_content())
+        with profiling.stage("parse"):
+            tree = html.fromstring(content)
+            elems : list[html.HtmlElement] = tree.xpath("//*[contains(@class, '"+self.game_element_class+"')]")
         await page
         if not elems:
             return
@@ -109,25 +109,17 @@ class CoolbetWrapper(BettingWrapper):
         if self.browser is None:
             return
 
-        with concurrent.futures.ThreadPoolExecutor() as executor:
-            tasks = []
+        async with TaskScheduler(self.tab_count, self.bookmaker) as scheduler:
             for i in range(gameCount):
                 outright_name = elems[i].xpath('.//*[contains(@class, "match-outright-name")]')
                 match_teams = elems[i].xpath('.//*[contains(@class, "match-teams")]')
                 if (not outright_name) and match_teams:
-                    event_id, event_url, oghome, ogaway = await self.eventFromGame(elems[i]) # recover event id to avoid researching
-                    event = database_connector.getEventById(event_id)
+                    event, event_url, oghome, ogaway = await self.eventFromGame(elems[i]) # recover event id to avoid researching
                     if event_url is None:
-                        task = self.scrapeGame(link, event, oghome, ogaway,is_event_url=False, index=i)
-                        tasks.append(task)
+                        scheduler.submit(self.scrapeGame(link, event, oghome, ogaway,is_event_url=False, index=i))
                     else:
-                        task = self.scrapeGame(event_url, event, oghome, ogaway, is_event_url=True)
-                        tasks.append(task)
-                        # append coroutine that opens the odds page directly
-                if i % self.tab_count == 0 or i == gameCount - 1:
-                    futures = [executor.submit(run_coroutine, coro) for coro in tasks]
-                    await asyncio.gather(*[asyncio.wrap_future(future) for future in futures])
-                    tasks.clear()
+                        # open the odds page directly
+                        scheduler.submit(self.scrapeGame(event_url, event, oghome, ogaway, is_event_url=True))
         # await page.close()
       #  print("pageclose")
 
@@ -137,7 +129,6 @@ class CoolbetWrapper(BettingWrapper):
         away = controller.get_text_by_xpath(game, ".//*[contains(@class, 'team-away')]//*[contains(@class, 'name')][1]").strip()
         category = self.link_category if self.link_category is not None else \
             controller.get_text_by_xpath(game, "(.//*[contains(@class, 'category-name')]//a)[1]").strip()
-        category_id = database_connector.searchOrAddCategory(re.sub(r"^\d+\s*", "", category))
         is_live = False
         try:
             live_element = game.xpath(".//*[contains(@class, 'live-info')][1]")[0]
@@ -165,15 +156,26 @@ class CoolbetWrapper(BettingWrapper):
             logging.error("Date and time element not found for game: " + home + " vs " + away)
 
 
+        # the database calls block, they run on a thread so the open tabs keep scraping
+        event, event_url = await asyncio.to_thread(self.resolveEvent, home, away, category, event_datetime)
+        print("event found", home, away)
+        return (event, event_url, home, away)
+
+    def resolveEvent(self, home : str, away : str, category : str, event_datetime : datetime.datetime | None) \
+            -> tuple[schemas.Event, str | None]:
+        """Find or add the category and event of a game and return the event with its stored url, blocks on the database."""
+        category_id = database_connector.searchOrAddCategory(re.sub(r"^\d+\s*", "", category))
         event_id = database_connector.searchOrAddEvent(home, away, category_id, event_datetime)
         event_url = database_connector.getEventUrl(event_id, self.bookmaker)
-        print("event found", home, away)
-        return (event_id, event_url, home, away)
+        return database_connector.getEventById(event_id), event_url
 
+    @profiling.timed("fetch")
     async def scrapeGame(self, link: str, event : schemas.Event,\
                         oghome : str, ogaway : str,  is_event_url : bool, index : int | None = None, disable_scroll : bool = True):
-        browser = await self.initBrowser()
-        page = await browser.get(link, new_window=True)
+        # the tabs of a scan share one browser connection now that they run on the same event loop
+        if self.browser is None:
+            await self.initBrowser()
+        page = await self.browser.get(link, new_window=True)
         try:
             test = await page.find("Additional security check is required", timeout=1)
             page.wait(20)
@@ -215,7 +217,7 @@ class CoolbetWrapper(BettingWrapper):
                 await expand.click()
             await page
 
-            database_connector.addBookmakerEvent(event.event_id, self.bookmaker, page.url, oghome, ogaway)
+            await asyncio.to_thread(database_connector.addBookmakerEvent, event.event_id, self.bookmaker, page.url, oghome, ogaway)
         await self.scrapeOddsPage(page, event, oghome, ogaway)
         await page.close()
     
@@ -245,11 +247,13 @@ class CoolbetWrapper(BettingWrapper):
         # Return the corresponding value from the dictionary, or (None, None) if not found
         return market_mapping.get(regular_title, (None, None))
 
+    @profiling.timed("parse")
     async def scrapeOddsPage(self, gametab: uc.Tab, event : schemas.Event, oghome : str, ogaway : str):
         await gametab.wait(10)
         await gametab
         # TODO redo this to use lxml
-        content = str(await gametab.get_content())
+        with profiling.stage("fetch"):
+            content = str(await gametab.get_content())
         tree = html.fromstring(content)
         market_titles : list[html.HtmlElement] = tree.xpath("//div[contains(@class, 'sidebets-layout')]//div[contains(@class, 'sidebet-name')]")
         markets : list[tuple[BetType, str]] = []
@@ -263,6 +267,7 @@ class CoolbetWrapper(BettingWrapper):
                 continue
             market_cards.append(market_title.getparent().getparent().getparent())
             markets.append((market_type, market_description))
+        event_markets : list[schemas.Market] = []
         for i, market_card in enumerate(market_cards):
             bet_type = markets[i][0]
             description = markets[i][1]
@@ -311,7 +316,7 @@ class CoolbetWrapper(BettingWrapper):
                             point=point,
                         )
                     )
-            database_connector.addOrUpdateMarket(
+            event_markets.append(
                 schemas.Market(
                     event_id=event.event_id,
                     bookmaker_key=self.bookmaker,
@@ -321,3 +326,4 @@ class CoolbetWrapper(BettingWrapper):
                     outcomes=outcomes,
                 )
             )
+        await asyncio.to_thread(database_connector.upsertMarkets, event_markets)
@@ -10,29 +10,25 @@ import time
 import asyncio
 
 import pytz
-import requests.cookies
 import database_connector
+import http_client
+import profiling
 import schemas
 from schemas import BetType, BookmakerScanParameters, Outcome
 import controller
 from enum import Enum
 from betting_wrapper import BettingWrapper
+from scheduler import TaskScheduler
 import contextlib
 import logging
-import concurrent.futures
 from lxml import html, etree
-import requests
 
-import utils
-
-
-def run_coroutine(coro):
-    asyncio.run(coro)
 
 class CoolbetWrapperV2(BettingWrapper):
 
     def __init__(self):
         self.bookmaker = "coolbetv2"
+        self.http = http_client.AsyncHttpClient()
 
     async def test(self):
         print("veikkauswrapper test")
@@ -45,13 +41,16 @@ class CoolbetWrapperV2(BettingWrapper):
                     "Handicap (3 Way)",
                     "Asian Handicap"]
     tab_count = 5
+    # leagues and events scraped from the API at a time
+    max_concurrency = 10
+    # markets in one request for their current odds
+    odds_batch_size = 60
     link_category = None
     browser = None
     chrome_path = "/home/Projects/Betting/kaarme-scraper/chromeprofile"
     browser_conn = None
     requires_browser = True
     can_update_all = True
-    requests_session : requests.Session = requests.Session()
     start_url = "https://www.coolbet.com/en/sports/football"
     headers : dict[str, str] = {
             'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64; rv:109.0) Gecko/20100101 Firefox/113.0',
@@ -66,7 +65,10 @@ class CoolbetWrapperV2(BettingWrapper):
         self.list_link = params.link
         self.sport = params.sport
         self.link_category = params.category
-        return await self.scrapeSite()
+        try:
+            return await self.scrapeSite()
+        finally:
+            await self.http.aclose()
     
     async def rescanEvent(self, link : str):
         if self.browser_conn is None:
@@ -83,6 +85,7 @@ class CoolbetWrapperV2(BettingWrapper):
                         uses_custom_data_dir=True,
                         port=self.browser_conn[1], 
                         browser_args=["--blink-settings=imagesEnabled=false"])
+        self.http = http_client.AsyncHttpClient(proxy=http_client.proxyUrl(self.proxy_dict))
         page = await self.browser.get(self.start_url)
         try:
             await page.find("Additional security check is required", timeout=1)
@@ -93,13 +96,13 @@ class CoolbetWrapperV2(BettingWrapper):
         cookies = await self.browser.cookies.get_all(requests_cookie_format=True)
         for cookie in cookies:
             assert isinstance(cookie, http.cookiejar.Cookie)
-            self.requests_session.cookies.set_cookie(cookie)
+        self.http.setCookies(cookies)
         return self.browser
 
     async def scrapeSite(self):
         leagues = await self.scrapeCategories()
-        raw_events = []
-        tasks = []
+        database_connector.preloadResolutionCache()
+        scannable_leagues : list[tuple[str, int, str]] = []
         for league in leagues:
             bookmaker_category_id = str(league["id"])
             slug = league["fullSlug"]
@@ -110,18 +113,24 @@ class CoolbetWrapperV2(BettingWrapper):
             if category_id is None:
                 logging.info(f"Category not found: {slug} for {self.bookmaker}")
                 continue
-            raw_events = await self.scrapeEvents(bookmaker_category_id, category_id)
-            for raw_event in raw_events:
-                tasks.append(self.scrapeEvent(raw_event, category_id))
-        with concurrent.futures.ThreadPoolExecutor() as executor:
-            for batch in utils.chunk_list(tasks, 10):
-                futures = [executor.submit(run_coroutine, coro) for coro in batch]
-                await asyncio.gather(*[asyncio.wrap_future(future) for future in futures])
+            scannable_leagues.append((bookmaker_category_id, category_id, slug))
+        database_connector.preloadResolutionCache([league[1] for league in scannable_leagues], self.bookmaker)
+        # the leagues and then their events are fanned out to one scheduler, the events of a league
+        # start as soon as its list is in while the other leagues are still loading
+        async with TaskScheduler(self.max_concurrency, self.bookmaker) as scheduler:
+            for bookmaker_category_id, category_id, slug in scannable_leagues:
+                with profiling.scope(league=slug):
+                    scheduler.submit(self.scrapeLeague(scheduler, bookmaker_category_id, category_id))
         return True
+
+    async def scrapeLeague(self, scheduler : TaskScheduler, api_category_id : str, category_id : int):
+        """Load the events of a league and submit them to scheduler to be scraped."""
+        for raw_event in await self.scrapeEvents(api_category_id, category_id):
+            scheduler.submit(self.scrapeEvent(raw_event, category_id))
     
     async def scrapeCategories(self) -> list[dict[str, str]]:
         url = "https://www.coolbet.com/s/sbgate/category/fo-tree/en?country=FI"
-        response = self.requests_session.get(url, headers=self.headers, proxies=self.proxy_dict)
+        response = await self.http.get(url, headers=self.headers)
         if response.status_code != 200:
             logging.error(f"Request failed with status code: {response.status_code}\n{url}")
         data = json.loads(response.text)
@@ -132,12 +141,9 @@ class CoolbetWrapperV2(BettingWrapper):
             for league in region['children']
         ]
     
-    def run_coroutine(coro):
-        asyncio.run(coro)
-    
     async def scrapeEvents(self, api_category_id : str, category_id : int) -> list[Any]:
         url = f"https://www.coolbet.com/s/sbgate/sports/fo-category/?categoryId={api_category_id}&country=NL&isMobile=0&language=en&layout=EUROPEAN&limit=99"
-        response = self.requests_session.get(url, headers=self.headers, proxies=self.proxy_dict)
+        response = await self.http.get(url, headers=self.headers)
         if response.status_code != 200:
             logging.error(f"Request failed with status code: {response.status_code} \n{url}")
         response.encoding = 'utf-8'
@@ -151,17 +157,16 @@ class CoolbetWrapperV2(BettingWrapper):
         ]
         return matches
     
+    @profiling.timed("parse")
     async def scrapeEvent(self, match, category_id):
         oghome : str | None = match['home_team_name']
         ogaway : str | None = match['away_team_name']
         if oghome == "" or ogaway == "" or oghome is None or ogaway is None:
             logging.debug(f"Null teams found, skipping ({match})")
             return
-        event_id, event_url, oghome, ogaway = await self.eventFromGame(oghome, ogaway,\
-                                            match['match_start'], category_id)
-        event = database_connector.getEventById(event_id)
-        database_connector.addBookmakerEvent(event.event_id, self.bookmaker, None, oghome, ogaway)
-        markets = self.scrapeEventMarkets(match['id'], self.headers)
+        # the database calls block, they run on a thread so the other events and leagues keep loading
+        event = await asyncio.to_thread(self.resolveEvent, oghome, ogaway, match['match_start'], category_id)
+        markets = await self.scrapeEventMarkets(match['id'], self.headers)
         outcome_ids : list[int] = []
         market_info : dict[int, tuple[BetType | None, str | None]] = {}
         for market in markets:
@@ -173,8 +178,9 @@ class CoolbetWrapperV2(BettingWrapper):
         market_ids = [market['id'] for market in markets]
         if len(market_ids) == 0:
             return
-        outcome_odds = self.scrapeOutcomeOdds(market_ids)
+        outcome_odds = await self.scrapeOutcomeOdds(market_ids)
 
+        event_markets : list[schemas.Market] = []
         for market in markets:
             market_id = market['id']
             market_type, market_description = market_info[market_id]
@@ -189,7 +195,7 @@ class CoolbetWrapperV2(BettingWrapper):
                     self.outcomeDataToOutcome(outcome['result_key'], market['raw_line'],\
                                             outcome_odds[outcome_bookmaker_id], oghome, ogaway, outcome_bookmaker_id)
                 )
-            database_connector.addOrUpdateMarket(
+            event_markets.append(
                 schemas.Market(
                     event_id=event.event_id,
                     bookmaker_key=self.bookmaker,
@@ -200,23 +206,35 @@ class CoolbetWrapperV2(BettingWrapper):
                     market_bookmaker_id=str(market_id),
                 )
             )
+        await asyncio.to_thread(database_connector.upsertMarkets, event_markets)
+
+    def resolveEvent(self, oghome : str, ogaway : str, start_time : str, category_id : int) -> schemas.Event:
+        """Find or add the event of a match and link it to the bookmaker, blocks on the database."""
+        event_datetime = datetime.datetime.strptime(start_time, "%Y-%m-%dT%H:%M:%S%z")
+        event_id = database_connector.searchOrAddEvent(oghome, ogaway, category_id, event_datetime)
+        event = database_connector.getEventById(event_id)
+        database_connector.addBookmakerEvent(event.event_id, self.bookmaker, None, oghome, ogaway)
+        return event
     
     async def updateOdds(self):
+        """Refresh the prices of the stored outcomes of the events that haven't started, without rescanning the markets."""
         await self.initBrowser()
-        markets = database_connector.getBookmakerMarkets(self.bookmaker)
-        market_dict = {int(item[1]): item[0] for item in markets}
-        market_api_keys = [int(market[1]) for market in markets]
-        print(markets)
-        odds = self.scrapeOutcomeOdds(market_api_keys)
-        update : dict[int, float] = {}
-        for item in odds.items():
-            if item[0] in market_dict:
-                update[market_dict[item[0]] : item[1]]
-        database_connector.updateOddsByOutcomeId(update)
+        try:
+            outcomes = database_connector.getBookmakerOutcomeIds(self.bookmaker)
+            upcoming_markets = {market_id for _, _, market_id, _ in outcomes}
+            market_api_keys = [int(market_bookmaker_id) for market_id, market_bookmaker_id
+                               in database_connector.getBookmakerMarkets(self.bookmaker)
+                               if market_id in upcoming_markets and market_bookmaker_id is not None]
+            with profiling.scope(league="all"):
+                odds = await self.scrapeOutcomeOdds(market_api_keys)
+                changed = self.savePrices(outcomes, odds)
+            logging.info(f"{self.bookmaker}: {changed} of {len(outcomes)} prices changed")
+        finally:
+            await self.http.aclose()
     
-    def scrapeEventMarkets(self, api_event_id : int, headers : dict[str, str]) -> list:
+    async def scrapeEventMarkets(self, api_event_id : int, headers : dict[str, str]) -> list:
         url = f"https://www.coolbet.com/s/sbgate/sports/fo-market/sidebets?country=NL&language=en&layout=EUROPEAN&matchId={api_event_id}&matchStatus=OPEN"
-        response = self.requests_session.get(url, headers=headers, proxies=self.proxy_dict)
+        response = await self.http.get(url, headers=headers)
         print(url)
         if response.status_code != 200:
             logging.error(f"Request failed with status code: {response.status_code}\n{url}\n{headers}\n{response.text}")
@@ -228,15 +246,16 @@ class CoolbetWrapperV2(BettingWrapper):
                 markets.extend(market['markets'])
         return markets
 
-    def scrapeOutcomeOdds(self, market_ids : list[int]) -> dict[str, float]:
-        split_market_ids = self.split_list(market_ids, 60)
+    async def scrapeOutcomeOdds(self, market_ids : list[int]) -> dict[str, float]:
+        """Return the current odds of the outcomes of market_ids by outcome id, the batches are requested concurrently."""
+        url = "https://www.coolbet.com/s/sb-odds/odds/current/fo-line/"
+        batches = [{"marketIds": [id_list]} for id_list in self.split_list(market_ids, self.odds_batch_size)]
+        responses = await asyncio.gather(*[self.http.post(url, headers=self.headers, json=batch) for batch in batches])
         odds_dict : dict[str, float] = {}
-        for id_list in split_market_ids:
-            url = "https://www.coolbet.com/s/sb-odds/odds/current/fo-line/"
-            market_ids_json = {"marketIds": [id_list] }
-            response = self.requests_session.post(url, headers=self.headers, json=market_ids_json, proxies=self.proxy_dict)
+        for batch, response in zip(batches, responses):
             if response.status_code != 200:
-                logging.error(f"Request failed with status code: {response.status_code}\n{url}\n{market_ids_json}")
+                logging.error(f"Request failed with status code: {response.status_code}\n{url}\n{batch}")
+                continue
             data = json.loads(response.text)
             for i in data:
                 odds_dict[i] = data[i]["value"]
@@ -244,15 +263,6 @@ class CoolbetWrapperV2(BettingWrapper):
     def split_list(self, input_list: list[int], max_size: int) -> list[list[int]]:
         return [input_list[i:i + max_size] for i in range(0, len(input_list), max_size)]
 
-    async def eventFromGame(self, home : str, away : str, start_time : str, category_id : int, inplay : bool = False):
-        is_live = False
-        today = datetime.date.today()
-        event_datetime = datetime.datetime.strptime(start_time, "%Y-%m-%dT%H:%M:%S%z")
-        event_id = database_connector.searchOrAddEvent(home, away, category_id, event_datetime)
-        event_url = database_connector.getEventUrl(event_id, self.bookmaker)
-        print("event found", home, away)
-        return (event_id, event_url, home, away)
-    
 
 
     async def getGameElement(self, page : uc.Tab, index : int) -> uc.Element | None:
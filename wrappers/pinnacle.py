@@ -11,27 +11,25 @@ import time
 import asyncio
 
 import pytz
-import requests.cookies
 import database_connector
+import http_client
+import profiling
 import schemas
 from schemas import BetType, BookmakerScanParameters, Outcome
 import controller
 from enum import Enum
 from betting_wrapper import BettingWrapper
+from scheduler import TaskScheduler
 import contextlib
 import logging
-import concurrent.futures
 from lxml import html, etree
-import requests
 
 
-def run_coroutine(coro):
-    asyncio.run(coro)
-
 class PinnacleWrapper(BettingWrapper):
 
     def __init__(self):
         self.bookmaker = "pinnacle"
+        self.http = http_client.AsyncHttpClient(per_host_limit=self.max_in_flight)
 
     async def test(self):
         print("pinnaclewrapper test")
@@ -44,13 +42,17 @@ class PinnacleWrapper(BettingWrapper):
                     "Handicap (3 Way)",
                     "Asian Handicap"]
     tab_count = 5
+    # leagues and matchups scraped at a time, and requests in flight to the API at a time
+    max_concurrency = 100
+    max_in_flight = 50
+    # load the markets of a whole league in one request, events with specials still get theirs per matchup
+    bulk_markets = True
     link_category = None
     browser = None
     chrome_path = "/home/Projects/Betting/kaarme-scraper/chromeprofile"
     browser_conn = None
     requires_browser = True
     can_update_all = True
-    requests_session : requests.Session = requests.Session()
     start_url = "https://www.pinnacle.com/en/"
     headers : dict[str, str] = {
             'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64; rv:109.0) Gecko/20100101 Firefox/113.0',
@@ -68,7 +70,10 @@ class PinnacleWrapper(BettingWrapper):
         self.sport = params.sport
         self.link_category = params.category
         category_only = params.categories_only
-        return await self.scrapeSite(category_only)
+        try:
+            return await self.scrapeSite(category_only)
+        finally:
+            await self.http.aclose()
     
     async def rescanEvent(self, link : str):
         if self.browser_conn is None:
@@ -84,6 +89,7 @@ class PinnacleWrapper(BettingWrapper):
                         user_data_dir=self.browser_conn[2],host=self.browser_conn[0],
                         port=self.browser_conn[1], 
                         browser_args=["--blink-settings=imagesEnabled=false"])
+        self.http = http_client.AsyncHttpClient(per_host_limit=self.max_in_flight)
         page = await self.browser.get(self.start_url)
         try:
             await page.find("Additional security check is required", timeout=1)
@@ -94,11 +100,13 @@ class PinnacleWrapper(BettingWrapper):
         cookies = await self.browser.cookies.get_all(requests_cookie_format=True)
         for cookie in cookies:
             assert isinstance(cookie, http.cookiejar.Cookie)
-            self.requests_session.cookies.set_cookie(cookie)
+        self.http.setCookies(cookies)
         return self.browser
 
     async def scrapeSite(self, category_only = False):
         leagues = await self.scrapeCategories()
+        database_connector.preloadResolutionCache()
+        scannable_leagues : list[tuple[str, int, str]] = []
         for league in leagues:
             bookmaker_category_id = str(league["id"])
             name = league["name"]
@@ -109,24 +117,28 @@ class PinnacleWrapper(BettingWrapper):
             if category_id is None:
                 logging.info(f"Category not found: {name} for {self.bookmaker}")
                 continue
-            if not category_only:
-                await self.scrapeEvents(bookmaker_category_id, category_id)
+            scannable_leagues.append((bookmaker_category_id, category_id, name))
+        if category_only:
+            return True
+        database_connector.preloadResolutionCache([league[1] for league in scannable_leagues], self.bookmaker)
+        # the leagues and then their matchups are fanned out to one scheduler, the matchups of a league
+        # start as soon as its list is in while the other leagues are still loading
+        async with TaskScheduler(self.max_concurrency, self.bookmaker) as scheduler:
+            for bookmaker_category_id, category_id, name in scannable_leagues:
+                with profiling.scope(league=name):
+                    scheduler.submit(self.scrapeLeague(scheduler, bookmaker_category_id, category_id))
         return True
     
     async def scrapeCategories(self) -> list[dict[str, str]]:
         #sports : list [int] = self.scrapeSports()  
         sports = [ 1, 3, 4, 6, 10, 12, 15, 19, 22, 28, 29, 33, 34, 37, 40 ]
+        urls = [f"https://guest.api.arcadia.pinnacle.com/0.1/sports/{sport}/leagues?all=false&brandId=0" for sport in sports]
+        responses = await asyncio.gather(*[self.http.get(url, headers=self.headers) for url in urls])
         result_data = []
-        for sport in sports:
-            url = f"https://guest.api.arcadia.pinnacle.com/0.1/sports/{sport}/leagues?all=false&brandId=0"
-            response = self.requests_session.get(url, headers=self.headers)
+        for url, response in zip(urls, responses):
             if response.status_code != 200:
-                #print(url)
-                #print(response.text)
-                logging.debug(f"Request failed with status code: {response.status_code}")
+                logging.debug(f"Request failed with status code: {response.status_code} \n url: {url}")
                 continue
-            else:
-                print(url)
             data = json.loads(response.text)
             for league_obj in data:
                 result_data.append({
@@ -135,9 +147,9 @@ class PinnacleWrapper(BettingWrapper):
                 })
         return result_data
     
-    def scrapeSports(self) -> list:
+    async def scrapeSports(self) -> list:
         url = "https://guest.api.arcadia.pinnacle.com/0.1/sports?brandId=0"
-        response = self.requests_session.get(url, headers=self.headers)
+        response = await self.http.get(url, headers=self.headers)
         if response.status_code != 200:
             logging.error(f"Request failed with status code: {response.status_code} \n url: {url}")
         data = json.loads(response.text)
@@ -146,25 +158,28 @@ class PinnacleWrapper(BettingWrapper):
             result_data.append(obj['id'])
         return result_data
     
-    async def scrapeEvents(self, api_category_id : str, category_id : int):
-        url = f"https://guest.api.arcadia.pinnacle.com/0.1/leagues/{api_category_id}/matchups?brandId=0"
-        print(url)
-        headers = self.headers.copy()
-        headers.pop("Origin")
-        response = self.requests_session.get(url, headers=headers)
-        if response.status_code != 200:
-            logging.debug(f"Request failed with status code: {response.status_code} \n url: {url}")
-            return
-        response.encoding = 'utf-8'
-        data = json.loads(response.text)
-        if len(data) == 0:
-            return
-        parents = []
-        for matchup in data:
-            if "parent" in matchup and matchup["parent"] is None:
-                parents.append(matchup)
+    async def scrapeLeague(self, scheduler : TaskScheduler, api_category_id : str, category_id : int):
+        """Resolve the events of a league and save their markets.
 
-        for match in parents:
+        With bulk_markets the straight markets of the league are loaded in one request and joined to the events
+        by matchup, which takes two requests per league instead of two per event. Events with specials, and all
+        of them if the league request fails, are submitted to scheduler to be scraped per matchup.
+        """
+        if self.bulk_markets:
+            league_matchups, league_markets = await asyncio.gather(self.scrapeEvents(api_category_id),
+                                                                   self.scrapeLeagueMarkets(api_category_id))
+        else:
+            league_matchups, league_markets = await self.scrapeEvents(api_category_id), None
+        related : dict[int, list[dict[str, Any]]] = {}
+        for matchup in league_matchups:
+            related.setdefault(self.parentMatchupId(matchup) or matchup['id'], []).append(matchup)
+        markets_by_matchup : dict[int, list[dict[str, Any]]] = {}
+        for api_market in league_markets or []:
+            markets_by_matchup.setdefault(api_market.get("matchupId"), []).append(api_market)
+        games : list[tuple[dict[str, Any], str, str]] = []
+        for match in league_matchups:
+            if "parent" not in match or match["parent"] is not None:
+                continue
             oghome : str | None = None
             ogaway : str | None = None
             for participant in match['participants']:
@@ -175,42 +190,98 @@ class PinnacleWrapper(BettingWrapper):
             if oghome == "" or ogaway == "" or oghome is None or ogaway is None:
                 logging.debug(f"Null teams found, skipping ({match})")
                 continue
-            event_id, event_url, oghome, ogaway = await self.eventFromGame(oghome, ogaway,\
-                                                match['startTime'], category_id)
+            games.append((match, oghome, ogaway))
+        # the database calls block, they run on a thread once per league so the other leagues keep loading
+        events = await asyncio.to_thread(self.resolveEvents, games, category_id)
+        markets : list[schemas.Market] = []
+        for (match, oghome, ogaway), event in zip(games, events):
+            matchups = related[match['id']]
+            if league_markets is None or any(matchup.get("special") for matchup in matchups):
+                scheduler.submit(self.scrapeEventMarkets(match['id'], self.headers, event, oghome, ogaway))
+                continue
+            api_markets = [api_market for matchup in matchups for api_market in markets_by_matchup.get(matchup['id'], [])]
+            markets.extend(self.parseEventMarkets(api_markets, matchups, event, oghome, ogaway))
+        if len(markets) > 0:
+            await asyncio.to_thread(database_connector.upsertMarkets, markets)
+
+    def resolveEvents(self, games : list[tuple[dict[str, Any], str, str]], category_id : int) -> list[schemas.Event]:
+        """Find or add the event of every (matchup, home, away) of a league and link it to the bookmaker.
+
+        Blocks on the database, scrapeLeague runs it on a thread.
+        """
+        events : list[schemas.Event] = []
+        for match, oghome, ogaway in games:
+            event_datetime = datetime.datetime.strptime(match['startTime'], "%Y-%m-%dT%H:%M:%S%z")
+            event_id = database_connector.searchOrAddEvent(oghome, ogaway, category_id, event_datetime)
             event = database_connector.getEventById(event_id)
             database_connector.addBookmakerEvent(event.event_id, self.bookmaker, None, oghome, ogaway)
-            markets = self.scrapeEventMarkets(match['id'], self.headers, event, oghome, ogaway)
+            events.append(event)
+        return events
+
+    def parentMatchupId(self, matchup : dict[str, Any]) -> int | None:
+        """Return the id of the event a related matchup, like a special or the corners, belongs to."""
+        parent = matchup.get("parent")
+        if isinstance(parent, dict):
+            return parent.get("id")
+        return matchup.get("parentId")
+
+    @profiling.timed("parse")
+    async def scrapeEvents(self, api_category_id : str) -> list[dict[str, Any]]:
+        """Return the matchups of a league, the events and the matchups related to them."""
+        url = f"https://guest.api.arcadia.pinnacle.com/0.1/leagues/{api_category_id}/matchups?brandId=0"
+        headers = self.headers.copy()
+        headers.pop("Origin")
+        response = await self.http.get(url, headers=headers)
+        if response.status_code != 200:
+            logging.debug(f"Request failed with status code: {response.status_code} \n url: {url}")
+            return []
+        response.encoding = 'utf-8'
+        return json.loads(response.text)
+
+    async def scrapeLeagueMarkets(self, api_category_id : str) -> list[dict[str, Any]] | None:
+        """Return the straight markets of every matchup of a league, None if the request fails."""
+        url = f"https://guest.api.arcadia.pinnacle.com/0.1/leagues/{api_category_id}/markets/straight"
+        return await self.loadUrl(url, self.headers)
     
     async def updateOdds(self):
+        """Refresh the prices of the stored outcomes of the events that haven't started, without rescanning the markets.
+
+        Takes one request per league with upcoming events, the prices are matched to the outcomes by the
+        outcome_bookmaker_id parseEventMarkets gave them.
+        """
         await self.initBrowser()
-        markets = database_connector.getBookmakerMarkets(self.bookmaker)
-        market_dict = {int(item[1]): item[0] for item in markets}
-        market_api_keys = [int(market[1]) for market in markets]
-        odds = self.scrapeOutcomeOdds(market_api_keys)
-        update : dict[int, float] = {}
-        for item in odds.items():
-            if item[0] in market_dict:
-                update[market_dict[item[0]] : item[1]]
-        database_connector.updateOddsByOutcomeId(update)
+        try:
+            outcomes = database_connector.getBookmakerOutcomeIds(self.bookmaker)
+            league_ids = database_connector.getBookmakerCategoryKeys(self.bookmaker)
+            with profiling.scope(league="all"):
+                odds = await self.scrapeOutcomeOdds(league_ids)
+                changed = self.savePrices(outcomes, odds)
+            logging.info(f"{self.bookmaker}: {changed} of {len(outcomes)} prices changed")
+        finally:
+            await self.http.aclose()
 
 
     
-    def scrapeEventMarkets(self, api_event_id : int, headers : dict[str, str], event : schemas.Event, oghome : str, ogaway : str) -> list:
+    async def scrapeEventMarkets(self, api_event_id : int, headers : dict[str, str], event : schemas.Event, oghome : str, ogaway : str) -> list:
         headers2 = headers.copy()
         headers2.pop("Origin")
         url = f"https://guest.api.arcadia.pinnacle.com/0.1/matchups/{api_event_id}/markets/related/straight"
-        api_markets = self.loadUrl(url, headers)
-        if api_markets is None:
-            return []
         url2 = f"https://guest.api.arcadia.pinnacle.com/0.1/matchups/{api_event_id}/related"
-        matchups = self.loadUrl(url2, headers2)
-        if matchups is None:
+        api_markets, matchups = await asyncio.gather(self.loadUrl(url, headers), self.loadUrl(url2, headers2))
+        if api_markets is None or matchups is None:
             return []
+        markets = self.parseEventMarkets(api_markets, matchups, event, oghome, ogaway)
+        await asyncio.to_thread(database_connector.upsertMarkets, markets)
+        return markets
 
+    @profiling.timed("parse")
+    def parseEventMarkets(self, api_markets : list[dict[str, Any]], matchups : list[dict[str, Any]],
+                          event : schemas.Event, oghome : str, ogaway : str) -> list[schemas.Market]:
+        """Return the markets of an event from its straight markets and the matchups related to it."""
         matchup_dict = {}
         matchups_by_description : dict[str, list] = {}
         for raw_matchup in matchups:
-            description = raw_matchup.get("special", {}).get("description")
+            description = (raw_matchup.get("special") or {}).get("description")
             point = None
             if description is not None:
                 match = re.search(r"(-?\d+)(?!.*\d)", description)
@@ -250,7 +321,6 @@ class PinnacleWrapper(BettingWrapper):
             matchup_points = matchup.get("points")
             outcomes : list[schemas.Outcome] = []
             for price in api_market['prices']:
-                print(price)
                 name = None
                 participant_id = price.get("participantId")
                 if participant_id is None:
@@ -267,6 +337,7 @@ class PinnacleWrapper(BettingWrapper):
                     name=name,
                     price=controller.american_to_decimal(price['price']),
                     point=point,
+                    outcome_bookmaker_id=self.outcomeBookmakerId(api_market, price),
                 ))
             if market is None:
                 market_dict[(market_type, matchup_id, half, side)] = \
@@ -285,6 +356,7 @@ class PinnacleWrapper(BettingWrapper):
 
 
         
+        markets : list[schemas.Market] = []
         for market in market_dict.values():
             market_type, market_description = self.matchMarketTitle(
                 market["type"],
@@ -294,7 +366,7 @@ class PinnacleWrapper(BettingWrapper):
                 market["half"])
             if market_type is None:
                 continue
-            database_connector.addOrUpdateMarket(schemas.Market(
+            markets.append(schemas.Market(
                 event_id=event.event_id,
                 bookmaker_key=self.bookmaker,
                 last_update=datetime.datetime.now(pytz.utc),
@@ -302,7 +374,7 @@ class PinnacleWrapper(BettingWrapper):
                 bet_type_id=market_type,
                 outcomes=market["outcomes"],
             ))
-        return market_dict
+        return markets
     
     def getParticipantInfo(self, matchup, participant_id : str, oghome : str, ogaway : str):
         for participant in matchup['participants']:
@@ -313,42 +385,30 @@ class PinnacleWrapper(BettingWrapper):
                 return (participant['alignment'], name)
         return None
 
-    def loadUrl(self, url : str, headers : dict[str, str]):
+    async def loadUrl(self, url : str, headers : dict[str, str]):
         url = url
-        response = self.requests_session.get(url, headers=headers)
-        print(url)
+        response = await self.http.get(url, headers=headers)
+        logging.debug(url)
         if response.status_code != 200:
             logging.debug(f"Request failed with status code: {response.status_code} \n url: {url}")
             return None
         return json.loads(response.text)
 
 
-    def scrapeOutcomeOdds(self, market_ids : list[int]) -> dict[str, float]:
-        split_market_ids = self.split_list(market_ids, 60)
+    def outcomeBookmakerId(self, api_market : dict[str, Any], price : dict[str, Any]) -> str:
+        """Identify a price of a straight market by its matchup, market key and side, the key includes the line."""
+        return f"{api_market.get('matchupId')};{api_market['key']};{price.get('designation') or price.get('participantId')}"
+
+    async def scrapeOutcomeOdds(self, league_ids : list[str]) -> dict[str, float]:
+        """Return the current decimal odds of the straight markets of the leagues by outcomeBookmakerId,
+        the leagues are requested concurrently."""
         odds_dict : dict[str, float] = {}
-        for id_list in split_market_ids:
-            url = "https://www.coolbet.com/s/sb-odds/odds/current/fo-line/"
-            market_ids_json = {'marketIds': [id_list] }
-            response = self.requests_session.post(url, headers=self.headers, json=market_ids_json)
-            if response.status_code != 200:
-                logging.error(f"Request failed with status code: {response.status_code}")
-            data = json.loads(response.text)
-            for i in data:
-                odds_dict[i] = data[i]["value"]
+        for league_markets in await asyncio.gather(*[self.scrapeLeagueMarkets(league_id) for league_id in league_ids]):
+            for api_market in league_markets or []:
+                for price in api_market['prices']:
+                    odds_dict[self.outcomeBookmakerId(api_market, price)] = controller.american_to_decimal(price['price'])
         return odds_dict
-    
-    def split_list(self, input_list: list[int], max_size: int) -> list[list[int]]:
-        return [input_list[i:i + max_size] for i in range(0, len(input_list), max_size)]
 
-    async def eventFromGame(self, home : str, away : str, start_time : str, category_id : int, inplay : bool = False):
-        is_live = False
-        today = datetime.date.today()
-        event_datetime = datetime.datetime.strptime(start_time, "%Y-%m-%dT%H:%M:%S%z")
-        event_id = database_connector.searchOrAddEvent(home, away, category_id, event_datetime)
-        event_url = database_connector.getEventUrl(event_id, self.bookmaker)
-        print("event found", home, away)
-        return (event_id, event_url, home, away)
-    
 
 
     async def getGameElement(self, page : uc.Tab, index : int) -> uc.Element | None:
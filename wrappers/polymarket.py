@@ -10,6 +10,7 @@ import asyncio
 
 import pytz
 import database_connector
+import profiling
 import schemas
 from schemas import BetType
 import controller
@@ -17,7 +18,6 @@ from enum import Enum
 from betting_wrapper import BettingWrapper
 import contextlib
 import logging
-import concurrent.futures
 
 import os
 
@@ -29,9 +29,6 @@ from py_clob_client.constants import POLYGON
 import requests
 
 
-def run_coroutine(coro):
-    asyncio.run(coro)
-
 class PolymarketWrapper(BettingWrapper):
 
     def __init__(self):
@@ -56,7 +53,8 @@ class PolymarketWrapper(BettingWrapper):
         queryTime = datetime.datetime.now(pytz.utc) - datetime.timedelta(days=7)
         queryIsoTime = queryTime.isoformat().replace("+00:00", "Z")
         url = "https://gamma-api.polymarket.com/markets?start_date_min="+queryIsoTime+"&closed=false&limit=500"
-        markets = requests.get(url).json()
+        with profiling.stage("fetch"):
+            markets = requests.get(url).json()
         fields = database_connector.getFieldNames()
         field_names = list(map(lambda x: x[1], fields))
         market_dict = defaultdict(list)
@@ -8,20 +8,17 @@ import asyncio
 
 import pytz
 import database_connector
+import profiling
 import schemas
 from schemas import BetType, BookmakerScanParameters
 import controller
 from enum import Enum
 from betting_wrapper import BettingWrapper
+from scheduler import TaskScheduler
 import contextlib
 import logging
-import concurrent.futures
 from lxml import html, etree
 
-
-def run_coroutine(coro):
-    asyncio.run(coro)
-
 class VeikkausWrapper(BettingWrapper):
 
     def __init__(self):
@@ -100,7 +97,8 @@ class VeikkausWrapper(BettingWrapper):
 
     async def scrapeEventPage(self, link: str):
         markets = []
-        page = await self.browser.get(link)
+        with profiling.stage("fetch"):
+            page = await self.browser.get(link)
         await page.maximize()
         await page.wait(1)
         await page
@@ -122,9 +120,11 @@ class VeikkausWrapper(BettingWrapper):
             await page.scroll_down(300)
             await page.wait(1)
 
-        content = str(await page.get_content())
-        tree = html.fromstring(content)
-        elems = tree.xpath('//*[@class="subpage-game-row"]')
+        with profiling.stage("fetch"):
+            content = str(await page.get_content())
+        with profiling.stage("parse"):
+            tree = html.fromstring(content)
+            elems = tree.xpath('//*[@class="subpage-game-row"]')
         if elems is None or len(elems) == 0:
             return
         processList = []
@@ -132,29 +132,20 @@ class VeikkausWrapper(BettingWrapper):
         print(gameCount)
         if self.browser is None:
             return
-        with concurrent.futures.ThreadPoolExecutor() as executor:
-            tasks = []
+        async with TaskScheduler(self.tab_count, self.bookmaker) as scheduler:
             for i in range(gameCount):
-                event_id, event_url, oghome, ogaway  = await self.eventFromGame(elems[i]) # recover event id to avoid researching
-                event = database_connector.getEventById(event_id)
+                event, event_url, oghome, ogaway = await self.eventFromGame(elems[i]) # recover event id to avoid researching
                 if event_url is None:
-                    task = self.scrapeGame(link, event, oghome, ogaway,is_event_url=False, index=i)
-                    tasks.append(task)
+                    scheduler.submit(self.scrapeGame(link, event, oghome, ogaway,is_event_url=False, index=i))
                 else:
-                    task = self.scrapeGame(event_url, event, oghome, ogaway, is_event_url=True)
-                    tasks.append(task)
-                    # append coroutine that opens the odds page directly
-                if (i != 0 and(i % self.tab_count == 0)) or i == gameCount - 1:
-                    futures = [executor.submit(run_coroutine, coro) for coro in tasks]
-                    await asyncio.gather(*[asyncio.wrap_future(future) for future in futures])
-                    tasks.clear()
+                    # open the odds page directly
+                    scheduler.submit(self.scrapeGame(event_url, event, oghome, ogaway, is_event_url=True))
         #await page.close()
 
     async def eventFromGame(self, game : html.HtmlElement):
         home = controller.get_text_by_xpath(game, ".//*[contains(@class, 'gameinfo-teams-team--home')][1]")
         away = controller.get_text_by_xpath(game, ".//*[contains(@class, 'gameinfo-teams-team--away')][1]")
         category = self.link_category if self.link_category is not None else controller.get_text_by_xpath(game, ".//*[contains(@class, 'teams-description')][1]")
-        category_id = database_connector.searchOrAddCategory(re.sub(r"^\d+\s*", "", category))
         day = None
         try:
             day = controller.get_text_by_xpath(game, ".//*[@class='pitkaveto-subpage-game-row__gameinfo--time--day'][1]")
@@ -179,15 +170,26 @@ class VeikkausWrapper(BettingWrapper):
             game_time_list = time.split(".")
             game_time = datetime.time(int(game_time_list[0]), int(game_time_list[1]))
             game_datetime = datetime.datetime.combine(weekday, game_time, tzinfo=pytz.timezone("Europe/Helsinki")).astimezone(tz=pytz.utc)
-        event_id = database_connector.searchOrAddEvent(home, away, category_id, game_datetime)
-        event_url = database_connector.getEventUrl(event_id, self.bookmaker)
+        # the database calls block, they run on a thread so the open tabs keep scraping
+        event, event_url = await asyncio.to_thread(self.resolveEvent, home, away, category, game_datetime)
         print("event found", home, away)
-        return (event_id, event_url, home, away)
+        return (event, event_url, home, away)
 
+    def resolveEvent(self, home : str, away : str, category : str, event_datetime : datetime.datetime | None) \
+            -> tuple[schemas.Event, str | None]:
+        """Find or add the category and event of a game and return the event with its stored url, blocks on the database."""
+        category_id = database_connector.searchOrAddCategory(re.sub(r"^\d+\s*", "", category))
+        event_id = database_connector.searchOrAddEvent(home, away, category_id, event_datetime)
+        event_url = database_connector.getEventUrl(event_id, self.bookmaker)
+        return database_connector.getEventById(event_id), event_url
+
+    @profiling.timed("fetch")
     async def scrapeGame(self, link: str, event : schemas.Event,\
                         oghome : str, ogaway : str,  is_event_url : bool, index : int | None = None, disable_scroll : bool = True):
-        browser = await self.initBrowser()
-        page = await browser.get(link, new_window=True)
+        # the tabs of a scan share one browser connection now that they run on the same event loop
+        if self.browser is None:
+            await self.initBrowser()
+        page = await self.browser.get(link, new_window=True)
         await page.maximize()
         await page
         if not is_event_url:
@@ -202,7 +204,7 @@ class VeikkausWrapper(BettingWrapper):
             await game.click()
             await page
 
-            database_connector.addBookmakerEvent(event.event_id, self.bookmaker, page.url, oghome, ogaway)
+            await asyncio.to_thread(database_connector.addBookmakerEvent, event.event_id, self.bookmaker, page.url, oghome, ogaway)
 
         await self.scrapeOddsPage(page, event, oghome, ogaway)
         await page.close()
@@ -228,12 +230,14 @@ class VeikkausWrapper(BettingWrapper):
         return market_mapping.get(regular_title, (None, None))
     
 
+    @profiling.timed("parse")
     async def scrapeOddsPage(self, gametab: uc.Tab, event : schemas.Event, oghome : str, ogaway : str):
         try:
             await gametab.find("Suosituimmat", timeout=60)
         except: 
             pass
-        content = str(await gametab.get_content())
+        with profiling.stage("fetch"):
+            content = str(await gametab.get_content())
         tree = html.fromstring(content)
         market_titles : list[html.HtmlElement] = tree.xpath("//h2[contains(@class, 'sub-rows-card__header--market-name')]")
         markets : list[tuple[BetType, str | None]] = []
@@ -244,6 +248,7 @@ class VeikkausWrapper(BettingWrapper):
                 continue
             market_cards.append(market_title.getparent().getparent().getparent())
             markets.append((market_type, market_name))
+        event_markets : list[schemas.Market] = []
         for i, market_card in enumerate(market_cards):
             bet_type = markets[i][0]
             description = markets[i][1]
@@ -299,8 +304,8 @@ class VeikkausWrapper(BettingWrapper):
                             point=point,
                         )
                     )
-            logging.debug(f"addOrUpdateMarket {description} {bet_type}")
-            database_connector.addOrUpdateMarket(
+            logging.debug(f"upsertMarkets {description} {bet_type}")
+            event_markets.append(
                 schemas.Market(
                     event_id=event.event_id,
                     bookmaker_key="veikkaus",
@@ -309,7 +314,8 @@ class VeikkausWrapper(BettingWrapper):
                     bet_type_id=bet_type,
                     outcomes=outcomes,
                 )
-            )   
+            )
+        await asyncio.to_thread(database_connector.upsertMarkets, event_markets)
     def scrapeLeagues(self):
         pass
 